@@ -0,0 +1,122 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import itertools
+import time
+
+from ryu.app.sdnhub_apps import flow_writer
+
+# Every flow programmed by the sdnhub apps carries a cookie laid out as
+#
+#    63      56 55           40 39         28 27                0
+#   +----------+---------------+-------------+------------------+
+#   |  app id  |  generation   |  instance   |     sequence     |
+#   +----------+---------------+-------------+------------------+
+#
+# The app id says who owns the flow, the generation changes on every
+# controller start, the instance lets an app tell apart flows of separate
+# objects it manages (e.g. one load-balanced service) and the sequence is
+# unique within those. With a cookie mask, an app can then delete or dump
+# just its own flows, or just those of one instance, with one message.
+
+APP_LEARNING_SWITCH = 0x01
+APP_STATELESS_LB = 0x02
+APP_TAP = 0x03
+
+APP_SHIFT = 56
+GENERATION_SHIFT = 40
+INSTANCE_SHIFT = 28
+
+APP_MASK = 0xff << APP_SHIFT
+GENERATION_MASK = 0xffff << GENERATION_SHIFT
+INSTANCE_MASK = 0xfff << INSTANCE_SHIFT
+SEQUENCE_MASK = (1 << INSTANCE_SHIFT) - 1
+
+MAX_INSTANCE = 0xfff
+
+
+def cookie_app_id(cookie):
+    return (cookie & APP_MASK) >> APP_SHIFT
+
+
+def cookie_generation(cookie):
+    return (cookie & GENERATION_MASK) >> GENERATION_SHIFT
+
+
+def cookie_instance(cookie):
+    return (cookie & INSTANCE_MASK) >> INSTANCE_SHIFT
+
+
+class CookieAllocator(object):
+
+    def __init__(self, app_id, instance=0, generation=None):
+        if generation is None:
+            generation = int(time.time())
+
+        self.app_id = app_id & 0xff
+        self.generation = generation & 0xffff
+        self.instance = instance & MAX_INSTANCE
+        self.prefix = ((self.app_id << APP_SHIFT) |
+                       (self.generation << GENERATION_SHIFT) |
+                       (self.instance << INSTANCE_SHIFT))
+        self._sequence = itertools.count(1)
+
+    # Instances draw from the sequence of the app, so that an instance id
+    # reused within a generation never mints the cookie of a flow of its
+    # previous owner that may still be on its way out
+    def for_instance(self, instance):
+        allocator = CookieAllocator(self.app_id, instance, self.generation)
+        allocator._sequence = self._sequence
+        return allocator
+
+    def next_cookie(self):
+        return self.prefix | (next(self._sequence) & SEQUENCE_MASK)
+
+    # (cookie, cookie_mask) pairs for use in FlowMod and FlowStats
+    def owner_match(self):
+        return (self.app_id << APP_SHIFT, APP_MASK)
+
+    def generation_match(self):
+        return (self.prefix & (APP_MASK | GENERATION_MASK),
+                APP_MASK | GENERATION_MASK)
+
+    def instance_match(self):
+        return (self.prefix, APP_MASK | GENERATION_MASK | INSTANCE_MASK)
+
+    def owns(self, cookie):
+        return (cookie & APP_MASK) == (self.app_id << APP_SHIFT)
+
+    def delete_flows(self, datapath, cookie_match=None):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        if cookie_match is None:
+            cookie_match = self.owner_match()
+        cookie, cookie_mask = cookie_match
+
+        mod = ofp_parser.OFPFlowMod(datapath=datapath, command=ofp.OFPFC_DELETE,
+                table_id=ofp.OFPTT_ALL, cookie=cookie, cookie_mask=cookie_mask,
+                out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY)
+        flow_writer.send_msg(datapath, mod)
+
+    def flow_stats_request(self, datapath, cookie_match=None):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        if cookie_match is None:
+            cookie_match = self.owner_match()
+        cookie, cookie_mask = cookie_match
+
+        return ofp_parser.OFPFlowStatsRequest(datapath, 0, ofp.OFPTT_ALL,
+                ofp.OFPP_ANY, ofp.OFPG_ANY, cookie, cookie_mask,
+                ofp_parser.OFPMatch())
@@ -0,0 +1,220 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import json
+import logging
+import time
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.ofproto import ofproto_v1_3
+from ryu.lib import dpid as dpid_lib
+from ryu.lib import hub
+from ryu.lib import ofctl_v1_3
+from ryu.app.sdnhub_apps import flow_writer
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.fabric_stats')
+
+DEFAULT_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 60
+POLL_TICK = 1
+
+PORT_COUNTERS = ('rx_packets', 'tx_packets', 'rx_bytes', 'tx_bytes',
+                 'rx_dropped', 'tx_dropped', 'rx_errors', 'tx_errors')
+
+# Polls the flow and port counters of every switch once per interval, no
+# matter how many clients read them. Requests to all switches go out
+# together and their replies are collected as they come. A switch that
+# has not answered by its next poll is polled half as often, up to
+# MAX_POLL_INTERVAL, until it answers again. Each sample also carries
+# the rates since the previous one.
+
+
+class FabricStats(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    def __init__(self, *args, **kwargs):
+        super(FabricStats, self).__init__(*args, **kwargs)
+        self.datapaths = {}
+        self.poll_interval = DEFAULT_POLL_INTERVAL
+
+        # dpid -> poll state and latest sample of the switch
+        self.poll_state = {}
+        self.samples = {}
+
+        # Bumped on every new sample, so that readers can cache what they
+        # built from the samples
+        self.version = 0
+        self.snapshot = None
+
+        self.threads.append(hub.spawn(self.poll_loop))
+
+    def set_poll_interval(self, poll_interval):
+        self.poll_interval = poll_interval
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def state_change_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is None:
+            return
+
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+            self.poll_state[datapath.id] = {'interval': self.poll_interval,
+                                            'next_poll': 0, 'pending': None}
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+            self.poll_state.pop(datapath.id, None)
+            if self.samples.pop(datapath.id, None) is not None:
+                self.version += 1
+
+    def poll_loop(self):
+        while True:
+            now = time.time()
+            for dpid, datapath in list(self.datapaths.items()):
+                self.poll_switch(datapath, now)
+            hub.sleep(POLL_TICK)
+
+    def poll_switch(self, datapath, now):
+        state = self.poll_state.get(datapath.id)
+        if state is None or now < state['next_poll']:
+            return
+
+        if state['pending'] is not None:
+            state['interval'] = min(state['interval'] * 2, MAX_POLL_INTERVAL)
+            LOG.debug('Switch %x is slow to answer, polling every %d seconds',
+                      datapath.id, state['interval'])
+
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        flow_req = ofp_parser.OFPFlowStatsRequest(datapath, 0, ofp.OFPTT_ALL,
+                ofp.OFPP_ANY, ofp.OFPG_ANY, 0, 0, ofp_parser.OFPMatch())
+        port_req = ofp_parser.OFPPortStatsRequest(datapath, 0, ofp.OFPP_ANY)
+        flow_writer.send_msg(datapath, flow_req)
+        flow_writer.send_msg(datapath, port_req)
+
+        # Replies are told apart by xid, so that late replies to an
+        # earlier poll are not mixed into this one
+        state['pending'] = {'time': now, 'flows': [], 'ports': [],
+                            'xids': {flow_req.xid: 'flows',
+                                     port_req.xid: 'ports'}}
+        state['next_poll'] = now + state['interval']
+
+    def stats_reply(self, msg, kind):
+        datapath = msg.datapath
+        state = self.poll_state.get(datapath.id)
+        if state is None or state['pending'] is None:
+            return
+
+        pending = state['pending']
+        if pending['xids'].get(msg.xid) != kind:
+            return
+
+        pending[kind].extend(msg.body)
+        if msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+
+        del pending['xids'][msg.xid]
+        if pending['xids']:
+            return
+
+        state['pending'] = None
+        state['interval'] = self.poll_interval
+        self.store_sample(datapath, pending)
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+        self.stats_reply(ev.msg, 'flows')
+
+    @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
+    def port_stats_reply_handler(self, ev):
+        self.stats_reply(ev.msg, 'ports')
+
+    def store_sample(self, datapath, pending):
+        now = pending['time']
+        previous = self.samples.get(datapath.id)
+        elapsed = None
+        if previous is not None and now > previous['timestamp']:
+            elapsed = now - previous['timestamp']
+
+        previous_flows = {}
+        previous_ports = {}
+        if previous is not None:
+            for flow in previous['flows']:
+                previous_flows[self.flow_key(flow)] = flow
+            for port in previous['ports']:
+                previous_ports[port['port_no']] = port
+
+        flows = []
+        for stat in pending['flows']:
+            flow = {'priority': stat.priority,
+                    'cookie': stat.cookie,
+                    'table_id': stat.table_id,
+                    'duration_sec': stat.duration_sec,
+                    'duration_nsec': stat.duration_nsec,
+                    'packet_count': stat.packet_count,
+                    'byte_count': stat.byte_count,
+                    'match': ofctl_v1_3.match_to_str(stat.match),
+                    'actions': ofctl_v1_3.actions_to_str(stat.instructions)}
+            self.add_rates(flow, previous_flows.get(self.flow_key(flow)), elapsed,
+                           ('packet_count', 'byte_count'))
+            flows.append(flow)
+
+        ports = []
+        for stat in pending['ports']:
+            port = {'port_no': stat.port_no}
+            for counter in PORT_COUNTERS:
+                port[counter] = getattr(stat, counter)
+
+            self.add_rates(port, previous_ports.get(stat.port_no), elapsed,
+                           PORT_COUNTERS)
+            ports.append(port)
+
+        ports.sort(key=lambda port: port['port_no'])
+
+        self.samples[datapath.id] = {'dpid': dpid_lib.dpid_to_str(datapath.id),
+                                     'timestamp': now,
+                                     'flows': flows,
+                                     'ports': ports}
+        self.version += 1
+
+    def flow_key(self, flow):
+        return json.dumps([flow['table_id'], flow['priority'], flow['cookie'],
+                           flow['match']], sort_keys=True)
+
+    def add_rates(self, entry, previous, elapsed, counters):
+        # Per second rate of each counter since the previous sample; None
+        # when there is nothing to compare against or the counter reset
+        for counter in counters:
+            rate = None
+            if previous is not None and elapsed:
+                delta = entry[counter] - previous[counter]
+                if delta >= 0:
+                    rate = delta / elapsed
+            entry[counter + '_rate'] = rate
+
+    def get_snapshot(self, since=None):
+        switches = [sample for sample in self.samples.values()
+                    if since is None or sample['timestamp'] > since]
+        switches.sort(key=lambda sample: sample['dpid'])
+        return {'timestamp': time.time(), 'switches': switches}
+
+    # The full snapshot serialized once per version, as every open
+    # dashboard asks for the same thing
+    def get_snapshot_json(self):
+        if self.snapshot is None or self.snapshot[0] != self.version:
+            self.snapshot = (self.version, json.dumps(self.get_snapshot()))
+        return self.snapshot[1]
@@ -0,0 +1,73 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+# REST API
+#
+############# Fabric statistics ##############
+#
+# get the latest flow and port counters of all switches, with the rates
+# since the previous poll
+# GET /v1.0/stats/fabric
+#
+# get only the switches polled after a "timestamp" of an earlier answer
+# GET /v1.0/stats/fabric?since={timestamp}
+#
+#
+
+import logging
+import json
+from webob import Response
+
+from ryu.base import app_manager
+from ryu.app.wsgi import ControllerBase, WSGIApplication, route
+from ryu.ofproto import ofproto_v1_3
+from ryu.app.sdnhub_apps import fabric_stats
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.fabric_stats_rest')
+
+class FabricStatsController(ControllerBase):
+    def __init__(self, req, link, data, **config):
+        super(FabricStatsController, self).__init__(req, link, data, **config)
+        self.fabric_stats = data['fabric_stats']
+
+    @route('stats', '/v1.0/stats/fabric', methods=['GET'])
+    def get_fabric_stats(self, req, **_kwargs):
+        since = req.GET.get('since')
+        if since is None:
+            body = self.fabric_stats.get_snapshot_json()
+        else:
+            try:
+                since = float(since)
+            except ValueError:
+                return Response(status=400)
+            body = json.dumps(self.fabric_stats.get_snapshot(since))
+
+        return Response(status=200,content_type='application/json', body=body)
+
+
+class FabricStatsRestApi(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    _CONTEXTS = {
+            'wsgi': WSGIApplication,
+            'fabric_stats': fabric_stats.FabricStats
+            }
+
+    def __init__(self, *args, **kwargs):
+        super(FabricStatsRestApi, self).__init__(*args, **kwargs)
+        wsgi = kwargs['wsgi']
+
+        self.data = {}
+        self.data['fabric_stats'] = kwargs['fabric_stats']
+
+        wsgi.register(FabricStatsController, self.data)
@@ -11,7 +11,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
 # implied.
 
-import json
+import gzip
+import hashlib
+import io
 from webob import Response
 import os
 import mimetypes
@@ -31,28 +33,144 @@ from ryu.app.wsgi import ControllerBase, WSGIApplication
 # GET /web/{file}
 #
 
+# The web directory is read once at startup. Small files are kept in
+# memory along with a gzip variant when that is worth it, and answered
+# with a strong ETag so that a reload only costs a 304. Files above
+# LARGE_FILE_SIZE are only indexed, and streamed from disk per request.
+LARGE_FILE_SIZE = 4 * 1024 * 1024
+FILE_CHUNK_SIZE = 64 * 1024
+
+# The assets are not fingerprinted, so browsers revalidate them often;
+# pages are always revalidated
+ASSET_CACHE_CONTROL = 'public, max-age=300'
+PAGE_CACHE_CONTROL = 'no-cache'
+
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json',
+                      'application/x-javascript', 'image/svg+xml')
+
+
+def is_compressible(filetype):
+    return filetype.startswith('text/') or filetype in COMPRESSIBLE_TYPES
+
+
+def gzip_bytes(body):
+    buf = io.BytesIO()
+    # Fixed mtime so that the variant, and its ETag, are stable
+    gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0)
+    gz.write(body)
+    gz.close()
+    return buf.getvalue()
+
+
+def load_asset(path):
+    filetype, encoding = mimetypes.guess_type(path)
+    if filetype == None:
+        filetype = 'application/octet-stream'
+
+    asset = {'path': path,
+             'content_type': filetype,
+             'encoding': encoding,
+             'size': os.path.getsize(path),
+             'cache_control': ASSET_CACHE_CONTROL,
+             'body': None,
+             'gzip_body': None}
+
+    if filetype == 'text/html':
+        asset['cache_control'] = PAGE_CACHE_CONTROL
+
+    if asset['size'] > LARGE_FILE_SIZE:
+        stat = os.stat(path)
+        asset['etag'] = '%x-%x' % (int(stat.st_mtime), stat.st_size)
+        return asset
+
+    with open(path, 'rb') as f:
+        body = f.read()
+    asset['body'] = body
+    asset['etag'] = hashlib.sha1(body).hexdigest()
+
+    if encoding is None and is_compressible(filetype):
+        compressed = gzip_bytes(body)
+        if len(compressed) < len(body):
+            asset['gzip_body'] = compressed
+
+    return asset
+
+
+def load_assets(directory):
+    assets = {}
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, directory).replace(os.sep, '/')
+            assets[filename] = load_asset(path)
+    return assets
+
+
 class WebController(ControllerBase):
     def __init__(self, req, link, data, **config):
         super(WebController, self).__init__(req, link, data, **config)
-        self.directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web')
-
-    def make_response(self, filename):
-        filetype, encoding = mimetypes.guess_type(filename)
-        if filetype == None:
-            filetype = 'application/octet-stream'
-        res = Response(content_type=filetype)
-        res.body = open(filename, 'rb').read()
+        self.assets = data['assets']
+
+    def make_response(self, req, asset):
+        body = asset['body']
+        etag = asset['etag']
+        encoding = asset['encoding']
+
+        # Without an Accept-Encoding header webob accepts any encoding,
+        # but a client that did not ask may not be able to decode gzip
+        if (asset['gzip_body'] is not None and
+                'Accept-Encoding' in req.headers and
+                'gzip' in req.accept_encoding):
+            body = asset['gzip_body']
+            etag = etag + '-gzip'
+            encoding = 'gzip'
+
+        if etag in req.if_none_match:
+            res = Response(status=304)
+        elif body is None:
+            res = Response(content_type=asset['content_type'])
+            res.app_iter = self.file_iter(req, asset['path'])
+            res.content_length = asset['size']
+        else:
+            res = Response(content_type=asset['content_type'], body=body)
+            res.content_encoding = encoding
+
+        res.etag = etag
+        res.cache_control = asset['cache_control']
+        if asset['gzip_body'] is not None:
+            res.vary = ('Accept-Encoding',)
         return res
 
+    def file_iter(self, req, path):
+        f = open(path, 'rb')
+        file_wrapper = req.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, FILE_CHUNK_SIZE)
+        return self.read_chunks(f)
+
+    def read_chunks(self, f):
+        with f:
+            while True:
+                chunk = f.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
     def get_root(self, req, **_kwargs):
         return self.get_file(req, None)
 
     def get_file(self, req, filename, **_kwargs):
         if (filename == "" or filename == None):
             filename = "index.html"
+
+        # Only what was found under the web directory at startup is
+        # served, so there is no way out of it either
+        asset = self.assets.get(filename)
+        if asset is None:
+            return Response(status=400)
+
         try:
-            filename = os.path.join(self.directory, filename)
-            return self.make_response(filename)
+            return self.make_response(req, asset)
         except IOError:
             return Response(status=400)
 
@@ -65,6 +183,11 @@ class WebRestApi(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super(WebRestApi, self).__init__(*args, **kwargs)
         wsgi = kwargs['wsgi']
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web')
+        self.data = {}
+        self.data['assets'] = load_assets(directory)
+
+        wsgi.registory['WebController'] = self.data
         mapper = wsgi.mapper
 
         mapper.connect('web', '/web/{filename:.*}',
@@ -74,5 +197,3 @@ class WebRestApi(app_manager.RyuApp):
         mapper.connect('web', '/',
                        controller=WebController, action='get_root',
                        conditions=dict(method=['GET']))
-
-
@@ -0,0 +1,131 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import logging
+
+from ryu.base import app_manager
+from ryu.controller import ofp_event
+from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
+from ryu.controller.handler import set_ev_cls
+from ryu.lib import hub
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.flow_writer')
+
+# datapath.send_msg() hands every message to the send loop on its own,
+# which ends up as one socket write per FlowMod. The writer here keeps a
+# per-datapath queue of serialized messages instead, and pushes the whole
+# queue to the switch as one buffer once the current event handler
+# yields. Callers that need to know when the switch has processed the
+# batch can ask for a barrier and wait on the returned event.
+#
+# The barrier replies are handed back to the writers by the
+# FlowWriterBarriers app below, whichever other apps are loaded. Apps
+# asking for barriers pull it in with app_manager.require_app().
+
+_writers = {}
+
+
+class FlowWriter(object):
+
+    def __init__(self, datapath):
+        self.datapath = datapath
+        self.queue = []
+        self.flush_scheduled = False
+        self.barriers = {}
+        self.messages = 0
+        self.writes = 0
+
+    def send_msg(self, msg):
+        self.datapath.set_xid(msg)
+        msg.serialize()
+        self.queue.append(msg.buf)
+        self.messages += 1
+
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            hub.spawn(self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self.flush_scheduled = False
+        self.flush()
+
+    def flush(self, barrier=False):
+        done = None
+        if barrier:
+            ofp_parser = self.datapath.ofproto_parser
+            req = ofp_parser.OFPBarrierRequest(self.datapath)
+            self.datapath.set_xid(req)
+            req.serialize()
+            self.queue.append(req.buf)
+
+            done = hub.Event()
+            self.barriers[req.xid] = done
+
+        if self.queue:
+            buf = b''.join(self.queue)
+            del self.queue[:]
+            self.writes += 1
+            self.datapath.send(buf)
+
+        return done
+
+    def barrier_reply(self, msg):
+        done = self.barriers.pop(msg.xid, None)
+        if done is not None:
+            done.set()
+
+    def get_stats(self):
+        ratio = 0.0
+        if self.writes:
+            ratio = float(self.messages) / self.writes
+        return {'messages': self.messages,
+                'writes': self.writes,
+                'batching_ratio': ratio}
+
+
+def get_writer(datapath):
+    writer = _writers.get(datapath.id)
+    if writer is None or writer.datapath is not datapath:
+        writer = FlowWriter(datapath)
+        _writers[datapath.id] = writer
+    return writer
+
+
+def remove_writer(dpid):
+    _writers.pop(dpid, None)
+
+
+def send_msg(datapath, msg):
+    get_writer(datapath).send_msg(msg)
+
+
+def flush(datapath, barrier=False):
+    return get_writer(datapath).flush(barrier)
+
+
+def barrier_reply(msg):
+    writer = _writers.get(msg.datapath.id)
+    if writer is not None:
+        writer.barrier_reply(msg)
+
+
+def get_stats():
+    return dict((dpid, writer.get_stats()) for dpid, writer in _writers.items())
+
+
+class FlowWriterBarriers(app_manager.RyuApp):
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply,
+                [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def barrier_reply_handler(self, ev):
+        barrier_reply(ev.msg)
@@ -0,0 +1,61 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+# REST API
+#
+############# Flow writer ##############
+#
+# get the number of messages sent to each switch, the number of socket
+# writes they were batched into, and the ratio of the two
+# GET /v1.0/stats/flow_writer
+#
+#
+
+import logging
+import json
+from webob import Response
+
+from ryu.base import app_manager
+from ryu.app.wsgi import ControllerBase, WSGIApplication, route
+from ryu.lib import dpid as dpid_lib
+from ryu.ofproto import ofproto_v1_3
+from ryu.app.sdnhub_apps import flow_writer
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.flow_writer_rest')
+
+class FlowWriterController(ControllerBase):
+    @route('stats', '/v1.0/stats/flow_writer', methods=['GET'])
+    def get_flow_writer_stats(self, req, **_kwargs):
+        switches = []
+        for dpid, stats in flow_writer.get_stats().items():
+            stats['dpid'] = dpid_lib.dpid_to_str(dpid)
+            switches.append(stats)
+        switches.sort(key=lambda stats: stats['dpid'])
+
+        return Response(status=200,content_type='application/json', charset='utf-8',
+                body=json.dumps({'switches': switches}))
+
+
+class FlowWriterRestApi(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    _CONTEXTS = {
+            'wsgi': WSGIApplication,
+            }
+
+    def __init__(self, *args, **kwargs):
+        super(FlowWriterRestApi, self).__init__(*args, **kwargs)
+        wsgi = kwargs['wsgi']
+
+        self.data = {}
+        wsgi.register(FlowWriterController, self.data)
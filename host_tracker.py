@@ -11,47 +11,146 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
 # implied.
 
-import logging
-import json
-from webob import Response
+import collections
+import heapq
 import time
-from threading import Timer
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
-from ryu.controller import dpset
-from ryu.app.wsgi import ControllerBase, WSGIApplication
 
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ipv4
-from ryu.lib.packet import arp
 from ryu.ofproto import ether
-from ryu.ofproto import ofproto_v1_0, ofproto_v1_3
+from ryu.app.sdnhub_apps import packet_view
 from ryu.lib import dpid as dpid_lib
+from ryu.lib import hub
+
+DEFAULT_IDLE_TIMEOUT = 300
+
+# Upper bound on how long the expiry thread sleeps
+MAX_EXPIRY_SLEEP = 60
 
 
 class HostTracker(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super(HostTracker, self).__init__(*args, **kwargs)
         self.hosts = {}
-        self.routers = []
-        self.IDLE_TIMEOUT = 300
-
-        Timer(self.IDLE_TIMEOUT, self.expireHostEntries).start()
+        self.routers = set()
+        self.IDLE_TIMEOUT = DEFAULT_IDLE_TIMEOUT
+
+        # Secondary indexes into self.hosts, kept in step with it. The
+        # IPs in self.recent are in the order they were last seen.
+        self.mac_to_ips = {}
+        self.dpid_to_ips = {}
+        self.recent = collections.OrderedDict()
+
+        # Bumped on every change to the table, last seen times included,
+        # for readers that cache what they derive from it. The structure
+        # version only moves when a host appears, goes or changes location,
+        # which under steady traffic is far less often.
+        self.version = 0
+        self.structure_version = 0
+        self.sorted_ips = None
+
+        # Heap of (last seen, ip) with at most one entry per IP. Refreshing
+        # a host does not touch the heap; the stale time is noticed when
+        # it comes due and the entry is pushed back with the new one. The
+        # deadlines are worked out from the idle timeout as they are
+        # checked, so that a change of the timeout applies to every host.
+        self.expiry_heap = []
+        self.expiry_scheduled = set()
+
+        # Called with (ip, entry) when a host appears or changes location,
+        # and with (ip, None) when it is removed
+        self.host_listeners = []
+
+        self.threads.append(hub.spawn(self.expiryLoop))
+
+    def getIdleTimeout(self):
+        return self.IDLE_TIMEOUT
+
+    def setIdleTimeout(self, idle_timeout):
+        self.IDLE_TIMEOUT = idle_timeout
+        self.expireHostEntries()
+
+    def addHostListener(self, listener):
+        self.host_listeners.append(listener)
+
+    def notifyHostListeners(self, ip, entry):
+        for listener in self.host_listeners:
+            listener(ip, entry)
+
+    def scheduleExpiry(self, ip, timestamp):
+        if ip not in self.expiry_scheduled:
+            self.expiry_scheduled.add(ip)
+            heapq.heappush(self.expiry_heap, (timestamp, ip))
 
     def expireHostEntries(self):
-        expiredEntries = []
-        for key,val in self.hosts.items():
-            if int(time.time()) > val['timestamp'] + self.IDLE_TIMEOUT:
-                expiredEntries.append(key)
-
-        for ip in expiredEntries:
-            del self.hosts[ip]
-
-        Timer(self.IDLE_TIMEOUT, self.expireHostEntries).start()
+        now = int(time.time())
+        heap = self.expiry_heap
+
+        while heap and heap[0][0] + self.IDLE_TIMEOUT < now:
+            _timestamp, ip = heapq.heappop(heap)
+            self.expiry_scheduled.discard(ip)
+
+            entry = self.hosts.get(ip)
+            if entry is None:
+                continue
+
+            if now > entry['timestamp'] + self.IDLE_TIMEOUT:
+                self.removeHost(ip)
+            else:
+                self.scheduleExpiry(ip, entry['timestamp'])
+
+    def expiryLoop(self):
+        while True:
+            self.expireHostEntries()
+
+            sleep_time = MAX_EXPIRY_SLEEP
+            if self.expiry_heap:
+                next_deadline = (self.expiry_heap[0][0] + self.IDLE_TIMEOUT + 1 -
+                                 time.time())
+                sleep_time = max(1, min(sleep_time, next_deadline))
+            hub.sleep(sleep_time)
+
+    def _discardIndex(self, index, key, ip):
+        ips = index.get(key)
+        if ips is not None:
+            ips.discard(ip)
+            if not ips:
+                del index[key]
+
+    def removeHost(self, ip):
+        entry = self.hosts.pop(ip, None)
+        if entry is not None:
+            self._discardIndex(self.mac_to_ips, entry['mac'], ip)
+            self._discardIndex(self.dpid_to_ips, entry['dpid'], ip)
+            self.recent.pop(ip, None)
+            self.version += 1
+            self.structure_version += 1
+            self.notifyHostListeners(ip, None)
+
+    def getHostsByDpid(self, dpid):
+        hosts = self.hosts
+        return dict((ip, hosts[ip]) for ip in self.dpid_to_ips.get(dpid, ()))
+
+    def getIpsByMac(self, mac):
+        return list(self.mac_to_ips.get(mac, ()))
+
+    # IPs of the hosts seen after the given time, newest first
+    def getIpsSince(self, since):
+        ips = []
+        hosts = self.hosts
+        for ip in reversed(self.recent):
+            if hosts[ip]['timestamp'] <= since:
+                break
+            ips.append(ip)
+        return ips
+
+    def getSortedIps(self):
+        if self.sorted_ips is None or self.sorted_ips[0] != self.structure_version:
+            self.sorted_ips = (self.structure_version, sorted(self.hosts))
+        return self.sorted_ips[1]
 
     # The hypothesis is that a router will be the srcMAC
     # for many IP addresses at the same time
@@ -59,42 +158,70 @@ class HostTracker(app_manager.RyuApp):
         if mac in self.routers:
            return True
 
-        ip_list = []
-        for key,val in self.hosts.items():
-            if val['mac'] == mac:
-                ip_list.append(key)
-
-        if len(ip_list) > 1:
-            for ip in ip_list:
-                del self.hosts[ip]
-            self.routers.append(mac)
-            return true
+        ip_list = self.mac_to_ips.get(mac)
+        if ip_list is not None and len(ip_list) > 1:
+            for ip in list(ip_list):
+                self.removeHost(ip)
+            self.routers.add(mac)
+            return True
 
         return False
 
-    def updateHostTable(self, srcIP, dpid, port):
-        self.hosts[srcIP]['timestamp'] = int(time.time())
-        self.hosts[srcIP]['dpid'] = dpid
-        self.hosts[srcIP]['port'] = port
+    def updateHostTable(self, srcIP, srcMac, dpid, port):
+        entry = self.hosts.get(srcIP)
+        if entry is None:
+            entry = self.hosts[srcIP] = {}
+            changed = True
+        else:
+            changed = (entry['mac'] != srcMac or entry['dpid'] != dpid or
+                       entry['port'] != port)
+            if entry['mac'] != srcMac:
+                self._discardIndex(self.mac_to_ips, entry['mac'], srcIP)
+            if entry['dpid'] != dpid:
+                self._discardIndex(self.dpid_to_ips, entry['dpid'], srcIP)
+
+        timestamp = int(time.time())
+        if changed:
+            self.structure_version += 1
+        if changed or entry['timestamp'] != timestamp:
+            self.version += 1
+            self.recent.pop(srcIP, None)
+            self.recent[srcIP] = True
+
+        entry['mac'] = srcMac
+        entry['timestamp'] = timestamp
+        self.scheduleExpiry(srcIP, entry['timestamp'])
+        entry['dpid'] = dpid
+        entry['port'] = port
+
+        self.mac_to_ips.setdefault(srcMac, set()).add(srcIP)
+        self.dpid_to_ips.setdefault(dpid, set()).add(srcIP)
+
+        # A host that is only seen again is not news
+        if changed:
+            self.notifyHostListeners(srcIP, entry)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def packet_in_handler(self, ev):
         msg = ev.msg
         datapath = msg.datapath
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        headers = packet_view.get_headers(msg)
+        if headers is None:
+            return
 
-        if eth.ethertype == ether.ETH_TYPE_ARP:
-            arp_pkt = pkt.get_protocols(arp.arp)[0]
+        if headers.ethertype == ether.ETH_TYPE_ARP:
+            arp_pkt = headers.arp
+            if arp_pkt is None:
+                return
             srcMac = arp_pkt.src_mac
             srcIP = arp_pkt.src_ip
-        elif eth.ethertype == ether.ETH_TYPE_IP:
-            ip = pkt.get_protocols(ipv4.ipv4)[0]
-            srcMac = eth.src
+        elif headers.ethertype == ether.ETH_TYPE_IP:
+            ip = headers.ipv4
+            if ip is None:
+                return
+            srcMac = headers.eth_src
             srcIP = ip.src
         else:
             return
@@ -102,10 +229,6 @@ class HostTracker(app_manager.RyuApp):
         if self.isRouter(srcMac):
             return
 
-        if srcIP not in self.hosts:
-            self.hosts[srcIP] = {}
-
         # Always update MAC and switch-port location, just in case
         # DHCP reassigned the IP or the host moved
-        self.hosts[srcIP]['mac'] = srcMac
-        self.updateHostTable(srcIP, dpid_lib.dpid_to_str(datapath.id), in_port)
+        self.updateHostTable(srcIP, srcMac, dpid_lib.dpid_to_str(datapath.id), in_port)
@@ -18,11 +18,24 @@
 # get all hosts
 # GET /hosts
 #
+#  Optional query parameters narrow the answer down: "mac" to the IPs of
+#  one MAC, "since" to the hosts seen after a UNIX time, and "offset" and
+#  "limit" to a page of the hosts sorted by IP. The total number of
+#  matching hosts is returned in the X-Total-Count header. Answers carry
+#  an ETag that changes as soon as a host appears, goes or moves; the
+#  last seen times in an answer may lag by up to a minute.
+#
 # get all hosts associated with a switch
 # GET /hosts/{dpid}
 #
+# get or change the seconds after which a silent host is forgotten,
+# e.g. with {"idle_timeout": 30}
+# GET /v1.0/host_tracker/idle_timeout
+# PUT /v1.0/host_tracker/idle_timeout
+#
 #
 
+import hashlib
 import logging
 import json
 from webob import Response
@@ -41,18 +54,106 @@ from ryu.lib.packet import ipv4
 from ryu.ofproto import ether
 from ryu.ofproto import ofproto_v1_0, ofproto_v1_3
 from ryu.app.sdnhub_apps import host_tracker
+from ryu.app.sdnhub_apps import rest_body
 from ryu.lib import dpid as dpid_lib
 
+LOG = logging.getLogger('ryu.app.sdnhub_apps.host_tracker_rest')
+
+# Most often a host being seen again only changes its timestamp. The
+# ETag and the cached listing follow such changes at most this often, so
+# that pollers keep getting 304s under steady traffic.
+TIMESTAMP_REFRESH_INTERVAL = 60
+
+IDLE_TIMEOUT = rest_body.obj({
+    'idle_timeout': rest_body.integer(1),
+}, required=('idle_timeout',))
+
 class HostTrackerController(ControllerBase):
     def __init__(self, req, link, data, **config):
         super(HostTrackerController, self).__init__(req, link, data, **config)
         self.host_tracker = data['host_tracker']
         self.dpset = data['dpset']
+        self.hosts_cache = data['hosts_cache']
+
+    # Generation of the host listing: a new one on every change of the
+    # hosts or their locations, and on timestamp changes once the
+    # current generation is TIMESTAMP_REFRESH_INTERVAL old
+    def listing_generation(self):
+        host_tracker = self.host_tracker
+        cache = self.hosts_cache
+        now = time.time()
+
+        if cache.get('structure_version') != host_tracker.structure_version or \
+                (cache['version'] != host_tracker.version and
+                 now - cache['time'] >= TIMESTAMP_REFRESH_INTERVAL):
+            cache['generation'] = cache.get('generation', 0) + 1
+            cache['structure_version'] = host_tracker.structure_version
+            cache['version'] = host_tracker.version
+            cache['time'] = now
+            cache['body'] = None
+
+        return cache['generation']
 
     @route('hosts', '/v1.0/hosts', methods=['GET'])
     def get_all_hosts(self, req, **kwargs):
-        return Response(status=200,content_type='application/json',
-                body=json.dumps(self.host_tracker.hosts))
+        host_tracker = self.host_tracker
+        params = req.GET
+
+        # Which hosts were seen since a time changes with every timestamp
+        if 'since' in params:
+            version = 'v%d' % host_tracker.version
+        else:
+            version = 'g%d' % self.listing_generation()
+
+        query = req.query_string.encode('utf-8')
+        etag = 'hosts-%s-%s' % (version, hashlib.sha1(query).hexdigest()[:16])
+        if etag in req.if_none_match:
+            res = Response(status=304)
+            res.etag = etag
+            return res
+
+        try:
+            since = float(params['since']) if 'since' in params else None
+            offset = int(params.get('offset', 0))
+            limit = int(params['limit']) if 'limit' in params else None
+        except ValueError:
+            return Response(status=400)
+        if offset < 0 or (limit is not None and limit < 0):
+            return Response(status=400)
+
+        mac = params.get('mac')
+        if mac is None and since is None and limit is None and offset == 0:
+            # The whole table is serialized once per generation of it
+            if self.hosts_cache['body'] is None:
+                self.hosts_cache['body'] = json.dumps(host_tracker.hosts)
+            body = self.hosts_cache['body']
+            total = len(host_tracker.hosts)
+        else:
+            if mac is not None:
+                ips = host_tracker.getIpsByMac(mac.lower())
+                if since is not None:
+                    ips = [ip for ip in ips
+                           if host_tracker.hosts[ip]['timestamp'] > since]
+                ips.sort()
+            elif since is not None:
+                ips = sorted(host_tracker.getIpsSince(since))
+            else:
+                ips = host_tracker.getSortedIps()
+
+            total = len(ips)
+            if limit is None:
+                ips = ips[offset:]
+            else:
+                ips = ips[offset:offset + limit]
+
+            hosts = host_tracker.hosts
+            body = json.dumps(dict((ip, hosts[ip]) for ip in ips))
+
+        res = Response(status=200,content_type='application/json', charset='utf-8',
+                body=body)
+        res.etag = etag
+        res.headers['X-Total-Count'] = str(total)
+        return res
 
     @route('hosts', '/v1.0/hosts/{dpid}', methods=['GET'])
             #requirements={'dpid': dpid_lib.DPID_PATTERN})
@@ -61,14 +162,28 @@ class HostTrackerController(ControllerBase):
         if dp is None:
             return Response(status=404)
 
-        switch_hosts = {}
-        for key,val in self.host_tracker.hosts.items():
-            if val['dpid']== dpid_lib.dpid_to_str(dp.id):
-                switch_hosts[key] = val
+        switch_hosts = self.host_tracker.getHostsByDpid(dpid_lib.dpid_to_str(dp.id))
 
-        return Response(status=200,content_type='application/json',
+        return Response(status=200,content_type='application/json', charset='utf-8',
                 body=json.dumps(switch_hosts))
 
+    @route('host_tracker', '/v1.0/host_tracker/idle_timeout', methods=['GET'])
+    def get_idle_timeout(self, req, **_kwargs):
+        return Response(status=200,content_type='application/json', charset='utf-8',
+                body=json.dumps({'idle_timeout': self.host_tracker.getIdleTimeout()}))
+
+    @route('host_tracker', '/v1.0/host_tracker/idle_timeout', methods=['PUT'])
+    def set_idle_timeout(self, req, **_kwargs):
+        try:
+            config = rest_body.parse_body(req, IDLE_TIMEOUT)
+        except rest_body.BodyError as err:
+            LOG.error('Invalid idle timeout: %s', err.message)
+            return rest_body.error_response(err)
+
+        self.host_tracker.setIdleTimeout(config['idle_timeout'])
+        return Response(status=200,content_type='application/json', charset='utf-8',
+                body=json.dumps({'status':'success'}))
+
 
 class HostTrackerRestApi(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_0.OFP_VERSION,
@@ -90,6 +205,7 @@ class HostTrackerRestApi(app_manager.RyuApp):
         self.data['dpset'] = dpset
         self.data['waiters'] = {}
         self.data['host_tracker'] = host_tracker
+        self.data['hosts_cache'] = {}
 
         wsgi.register(HostTrackerController, self.data)
         #mapper = wsgi.mapper
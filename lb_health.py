@@ -0,0 +1,119 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import logging
+import socket
+
+from ryu.lib import hub
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.lb_health')
+
+HEALTH_CHECK_ARP = 'arp'
+HEALTH_CHECK_TCP = 'tcp'
+
+DEFAULT_INTERVAL = 5
+DEFAULT_TIMEOUT = 1
+DEFAULT_FALL = 3
+DEFAULT_RISE = 2
+
+# Health checking for the servers of a load-balanced service. Every
+# interval, one probe goes out to every server at once through
+# send_probe(key). Probes do not block: an answer is reported back
+# with report(key), from a PacketIn (ARP) or a green thread (TCP
+# connect). Whatever has not answered when the timeout runs out counts
+# as a failure. A server goes down after `fall` failures in a row and
+# comes back after `rise` successes in a row. on_change(key, healthy) is
+# called on each transition. Servers start out healthy, so a new
+# service does not wait for its first round before taking connections.
+
+
+class HealthChecker(object):
+
+    def __init__(self, send_probe, on_change, interval=DEFAULT_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT, fall=DEFAULT_FALL, rise=DEFAULT_RISE):
+        self.send_probe = send_probe
+        self.on_change = on_change
+        self.interval = interval
+        self.timeout = min(timeout, interval)
+        self.fall = fall
+        self.rise = rise
+        self.targets = {}
+        self.thread = None
+
+    def set_targets(self, keys):
+        for key in list(self.targets):
+            if key not in keys:
+                del self.targets[key]
+
+        for key in keys:
+            self.targets.setdefault(key, {'healthy': True, 'answered': False,
+                                          'failures': 0, 'successes': 0})
+
+    def is_healthy(self, key):
+        target = self.targets.get(key)
+        return target is None or target['healthy']
+
+    def report(self, key):
+        target = self.targets.get(key)
+        if target is not None:
+            target['answered'] = True
+
+    def run_round(self):
+        for key, target in list(self.targets.items()):
+            target['answered'] = False
+            try:
+                self.send_probe(key)
+            except Exception:
+                LOG.exception('Health probe for %s failed to send', key)
+
+        hub.sleep(self.timeout)
+
+        for key, target in list(self.targets.items()):
+            if target['answered']:
+                target['failures'] = 0
+                target['successes'] += 1
+                if not target['healthy'] and target['successes'] >= self.rise:
+                    target['healthy'] = True
+                    self.on_change(key, True)
+            else:
+                target['successes'] = 0
+                target['failures'] += 1
+                if target['healthy'] and target['failures'] >= self.fall:
+                    target['healthy'] = False
+                    self.on_change(key, False)
+
+    def _loop(self):
+        while True:
+            self.run_round()
+            hub.sleep(max(0, self.interval - self.timeout))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = hub.spawn(self._loop)
+
+    def stop(self):
+        if self.thread is not None:
+            hub.kill(self.thread)
+            self.thread = None
+
+
+def tcp_probe(checker, key, ip, port):
+    # Runs in its own green thread; a refused or timed out connect is
+    # simply not reported
+    try:
+        sock = socket.create_connection((ip, port), checker.timeout)
+        sock.close()
+    except (socket.error, socket.timeout):
+        return
+
+    checker.report(key)
@@ -0,0 +1,219 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import abc
+import collections
+import zlib
+
+import six
+
+# Server selection policies for the stateless load balancer. A scheduler
+# is handed the servers reachable from the switch that saw the request
+# (a ReachableServers array of (server, outport) entries) and the client
+# 5-tuple, and returns the entry to use, or None if there is none.
+
+ROUND_ROBIN = 'round_robin'
+WEIGHTED_ROUND_ROBIN = 'weighted_round_robin'
+LEAST_CONNECTIONS = 'least_connections'
+CONSISTENT_HASH = 'consistent_hash'
+
+# Prime, and comfortably larger than 100x the expected pool size
+MAGLEV_TABLE_SIZE = 65537
+
+# Maglev tables kept around, one per set of servers. Switches that reach
+# the same servers share a table, and a server flapping up and down
+# switches between two tables without building either again.
+MAGLEV_TABLE_CACHE_SIZE = 8
+
+
+def server_weight(server):
+    return server.get('weight', 1)
+
+
+def server_key(server):
+    return server['mac'].lower()
+
+
+@six.add_metaclass(abc.ABCMeta)
+class Scheduler(object):
+
+    @abc.abstractmethod
+    def select(self, dpid, reachable, flow_key):
+        pass
+
+    # Called when servers join or leave the selection of a switch, out of
+    # the packet path, for schedulers that precompute per set of servers
+    def servers_changed(self, reachable):
+        pass
+
+    def connection_opened(self, server):
+        pass
+
+    def connection_closed(self, server):
+        pass
+
+
+class RoundRobinScheduler(Scheduler):
+
+    def __init__(self):
+        self.server_index = 0
+
+    def select(self, dpid, reachable, flow_key):
+        if not reachable:
+            return None
+
+        index = self.server_index % len(reachable)
+        self.server_index += 1
+        return reachable[index]
+
+
+# Smooth weighted round robin: every pick adds each server's weight to its
+# running score, picks the highest score and takes the total weight off
+# the winner. Picks are spread out instead of bunched per server.
+class WeightedRoundRobinScheduler(Scheduler):
+
+    def __init__(self):
+        self.current_weight = {}
+
+    def select(self, dpid, reachable, flow_key):
+        best = None
+        best_weight = None
+        total = 0
+
+        for entry in reachable.entries:
+            key = server_key(entry[0])
+            weight = server_weight(entry[0])
+            current = self.current_weight.get(key, 0) + weight
+            self.current_weight[key] = current
+            total += weight
+
+            if best is None or current > best_weight:
+                best = entry
+                best_weight = current
+
+        if best is not None:
+            self.current_weight[server_key(best[0])] -= total
+        return best
+
+
+# Connections are counted from the LB's own flows: opened when the
+# forward flow is installed, closed when its FlowRemoved comes back.
+class LeastConnectionScheduler(Scheduler):
+
+    def __init__(self):
+        self.connections = {}
+
+    def select(self, dpid, reachable, flow_key):
+        best = None
+        best_load = None
+
+        for entry in reachable.entries:
+            load = (float(self.connections.get(server_key(entry[0]), 0)) /
+                    server_weight(entry[0]))
+            if best is None or load < best_load:
+                best = entry
+                best_load = load
+
+        return best
+
+    def connection_opened(self, server):
+        key = server_key(server)
+        self.connections[key] = self.connections.get(key, 0) + 1
+
+    def connection_closed(self, server):
+        key = server_key(server)
+        count = self.connections.get(key, 0) - 1
+        if count > 0:
+            self.connections[key] = count
+        else:
+            self.connections.pop(key, None)
+
+
+# Maglev consistent hashing. Each set of servers gets a lookup table of
+# server MACs; a client 5-tuple always hashes to the same slot, and adding
+# or removing a server only moves the slots it gains or loses. Tables are
+# built when the servers change, and looked up by the set of servers
+# reachable from the switch.
+class MaglevScheduler(Scheduler):
+
+    def __init__(self, table_size=MAGLEV_TABLE_SIZE):
+        self.table_size = table_size
+        self.tables = collections.OrderedDict()
+
+    def build_table(self, macs):
+        size = self.table_size
+
+        # Servers take turns in MAC order, so that the table depends on
+        # the pool alone and not on the order its servers were learned
+        macs = sorted(macs)
+        permutations = []
+        for mac in macs:
+            name = mac.encode('ascii')
+            offset = zlib.crc32(name) % size
+            skip = zlib.adler32(name) % (size - 1) + 1
+            permutations.append((offset, skip))
+
+        table = [None] * size
+        if not macs:
+            return table
+
+        next_index = [0] * len(macs)
+        filled = 0
+        while True:
+            for i, (offset, skip) in enumerate(permutations):
+                slot = (offset + next_index[i] * skip) % size
+                while table[slot] is not None:
+                    next_index[i] += 1
+                    slot = (offset + next_index[i] * skip) % size
+
+                table[slot] = macs[i]
+                next_index[i] += 1
+                filled += 1
+                if filled == size:
+                    return table
+
+    def table(self, members):
+        table = self.tables.pop(members, None)
+        if table is None:
+            table = self.build_table(members)
+            if len(self.tables) >= MAGLEV_TABLE_CACHE_SIZE:
+                self.tables.popitem(last=False)
+        self.tables[members] = table
+        return table
+
+    def servers_changed(self, reachable):
+        if reachable:
+            self.table(reachable.members)
+
+    def select(self, dpid, reachable, flow_key):
+        if not reachable:
+            return None
+
+        # Only built here when a packet beats servers_changed to it
+        table = self.table(reachable.members)
+
+        key = '%s|%s|%s|%s|%s' % flow_key
+        slot = zlib.crc32(key.encode('ascii')) % self.table_size
+        return reachable[reachable.position[table[slot]]]
+
+
+SCHEDULERS = {
+    ROUND_ROBIN: RoundRobinScheduler,
+    WEIGHTED_ROUND_ROBIN: WeightedRoundRobinScheduler,
+    LEAST_CONNECTIONS: LeastConnectionScheduler,
+    CONSISTENT_HASH: MaglevScheduler,
+}
+
+
+def create_scheduler(name=ROUND_ROBIN):
+    return SCHEDULERS[name]()
@@ -11,8 +11,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
 # implied.
 
+import collections
 import logging
-import random
 
 from ryu.base import app_manager
 from ryu.controller import ofp_event
@@ -20,18 +20,132 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISP
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib import ofctl_v1_3
-from ryu.ofproto import ether, inet
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ipv4
-from ryu.lib.packet import tcp
-from ryu.lib.packet import arp
+from ryu.ofproto import ether
+from ryu.topology import event as topo_event
+from ryu.app.sdnhub_apps import cookie_allocator
+from ryu.app.sdnhub_apps import flow_writer
+from ryu.app.sdnhub_apps import packet_view
+from ryu.app.sdnhub_apps import path_engine
 
 DEFAULT_IDLE_TIMEOUT = 60
 DEFAULT_HARD_TIMEOUT = 300
 
+# Forwarding modes. The default programs one flow per (in_port, eth_dst)
+# pair, which grows as O(N^2) with the number of hosts on a switch. The
+# destination mode programs a single eth_dst flow per learned host, and
+# punts ARP to the controller so host_tracker keeps seeing every host.
+# Once the topology is known, a host learned on an edge port gets its
+# flow on every switch, pointing along the shortest path towards it, so
+# that its traffic does not punt once per hop.
+FORWARDING_MODE_IN_PORT_DST = 'in_port_dst'
+FORWARDING_MODE_DST = 'dst'
+
+DST_FLOW_PRIORITY = 1
+IN_PORT_DST_FLOW_PRIORITY = 2
+ARP_PUNT_PRIORITY = 3
+
 LOG = logging.getLogger('ryu.app.sdnhub_apps.learning_switch')
 
+# Barriers asked of flow_writer are answered through its own app
+app_manager.require_app('ryu.app.sdnhub_apps.flow_writer')
+
+# Fields used to bucket exemption rules, most selective first. A rule is
+# filed under the first of these fields it specifies; rules using none of
+# them end up in the wildcard list and are checked against every packet.
+EXEMPTION_INDEX_FIELDS = ['dl_dst', 'dl_src', 'nw_dst', 'nw_src',
+                          'tp_dst', 'tp_src', 'dl_type', 'nw_proto']
+
+
+class ExemptionClassifier(object):
+
+    def __init__(self):
+        self.buckets = {}
+        self.wildcard = []
+
+    def add(self, match):
+        for key in EXEMPTION_INDEX_FIELDS:
+            if key in match:
+                rules = self.buckets.setdefault((key, match[key]), [])
+                rules.append(list(match.items()))
+                return
+
+        self.wildcard.append(list(match.items()))
+
+    def clear(self):
+        self.buckets.clear()
+        del self.wildcard[:]
+
+    def lookup(self, fields):
+        # Only the buckets keyed on values present in the packet can
+        # possibly match, so the cost is bounded by the number of indexed
+        # fields rather than the number of rules.
+        buckets = self.buckets
+        if buckets:
+            for key in EXEMPTION_INDEX_FIELDS:
+                if key not in fields:
+                    continue
+                rules = buckets.get((key, fields[key]))
+                if rules is not None and self._any_superset(rules, fields):
+                    return True
+
+        return self._any_superset(self.wildcard, fields)
+
+    @staticmethod
+    def _any_superset(rules, fields):
+        # the match specified for exemption should be a
+        # superset of the flows to exclude processing.
+        for items in rules:
+            for key, val in items:
+                if key not in fields or fields[key] != val:
+                    break
+            else:
+                return True
+
+        return False
+
+
+FlowEntry = collections.namedtuple('FlowEntry',
+        ['cookie', 'match', 'actions', 'priority'])
+
+
+# Flows installed on one switch, indexed by cookie for FlowRemoved and by
+# (priority, match) so that a FlowMod overwriting an existing entry
+# replaces its record instead of leaving a stale one behind.
+class FlowTable(object):
+
+    def __init__(self):
+        self.by_cookie = {}
+        self.by_match = {}
+
+    def __len__(self):
+        return len(self.by_cookie)
+
+    @staticmethod
+    def _match_key(priority, match):
+        return (priority, tuple(sorted(match.items())))
+
+    def add(self, cookie, match, actions, priority):
+        key = self._match_key(priority, match)
+        replaced = self.by_match.get(key)
+        if replaced is not None:
+            del self.by_cookie[replaced]
+
+        self.by_match[key] = cookie
+        self.by_cookie[cookie] = FlowEntry(cookie, match, actions, priority)
+        return replaced
+
+    def remove(self, cookie):
+        entry = self.by_cookie.pop(cookie, None)
+        if entry is not None:
+            key = self._match_key(entry.priority, entry.match)
+            if self.by_match.get(key) == cookie:
+                del self.by_match[key]
+        return entry
+
+    def entries(self):
+        return [entry._asdict() for entry in self.by_cookie.values()]
+
+
 class L2LearningSwitch(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
@@ -39,20 +153,166 @@ class L2LearningSwitch(app_manager.RyuApp):
         super(L2LearningSwitch, self).__init__(*args, **kwargs)
         self.mac_to_port = {}
         self.exemption = []
+        self.exemption_classifier = ExemptionClassifier()
         self.switch_flows = {}
-
-    def get_switch_flows(self):
-        return self.switch_flows
+        self.datapaths = {}
+        self.forwarding_mode = FORWARDING_MODE_IN_PORT_DST
+        self.mac_listeners = []
+        self.cookies = cookie_allocator.CookieAllocator(
+                cookie_allocator.APP_LEARNING_SWITCH)
+
+        # Topology, for pushing destination flows along the tree: switch
+        # ports facing other switches, and the edge port of each host
+        self.paths = path_engine.ShortestPathCache()
+        self.link_ports = set()
+        self.host_ports = {}
+
+    def close(self):
+        # Take our flows with us when the app is unloaded
+        for datapath in self.datapaths.values():
+            self.cookies.delete_flows(datapath)
+            flow_writer.flush(datapath)
 
     def get_switch_flows(self, dpid):
-        return self.switch_flows[dpid]
+        return self.switch_flows[dpid].entries()
+
+    def get_forwarding_mode(self):
+        return self.forwarding_mode
+
+    def set_forwarding_mode(self, mode):
+        if mode not in (FORWARDING_MODE_IN_PORT_DST, FORWARDING_MODE_DST):
+            raise ValueError('Unknown forwarding mode %s' % mode)
+
+        if self.forwarding_mode == mode:
+            return
+
+        for datapath in self.datapaths.values():
+            if mode == FORWARDING_MODE_DST:
+                self.install_arp_punt(datapath)
+            else:
+                self.remove_arp_punt(datapath)
+            flow_writer.flush(datapath)
+
+        self.forwarding_mode = mode
+
+    def install_arp_punt(self, datapath):
+        # Keep ARP visible to the controller (and hence to host_tracker)
+        # even when the destination MAC has a flow on the switch
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        match = ofp_parser.OFPMatch(eth_type=ether.ETH_TYPE_ARP)
+        actions = [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
+        self.add_flow(datapath=datapath, priority=ARP_PUNT_PRIORITY,
+                match=match, actions=actions)
+
+    def remove_arp_punt(self, datapath):
+        # The FlowRemoved of the rule clears it from switch_flows
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        cookie, cookie_mask = self.cookies.owner_match()
+        match = ofp_parser.OFPMatch(eth_type=ether.ETH_TYPE_ARP)
+        mod = ofp_parser.OFPFlowMod(datapath=datapath, command=ofp.OFPFC_DELETE_STRICT,
+                priority=ARP_PUNT_PRIORITY, match=match,
+                cookie=cookie, cookie_mask=cookie_mask,
+                out_port=ofp.OFPP_ANY, out_group=ofp.OFPG_ANY)
+        flow_writer.send_msg(datapath, mod)
+
+    def add_dst_flow(self, datapath, dst, out_port, buffer_id=ofproto_v1_3.OFP_NO_BUFFER):
+        ofp_parser = datapath.ofproto_parser
+
+        match = ofp_parser.OFPMatch(eth_dst=dst)
+        actions = [ofp_parser.OFPActionOutput(out_port)]
+        self.add_flow(datapath=datapath, priority=DST_FLOW_PRIORITY,
+                match=match, actions=actions,
+                idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                hard_timeout=DEFAULT_HARD_TIMEOUT,
+                buffer_id=buffer_id)
+
+    # Installs the flow for a host on every switch that has a path to the
+    # switch it is attached to
+    def push_dst_flows(self, mac):
+        dpid, port = self.host_ports[mac]
+        for other_dpid, datapath in self.datapaths.items():
+            if other_dpid == dpid:
+                continue
+
+            hops = self.paths.hops(other_dpid, None, dpid, port)
+            if hops is not None:
+                self.add_dst_flow(datapath, mac, hops[0][2])
+                flow_writer.flush(datapath)
+
+    # Installs the flow for a host on the switches from this one to the
+    # host, when it expired along the way. The first hop releases the
+    # buffered packet, if any. Returns the out port on this switch, or
+    # None if the path is not known.
+    def add_dst_flows_to(self, datapath, mac, buffer_id=ofproto_v1_3.OFP_NO_BUFFER):
+        if mac not in self.host_ports:
+            return None
+
+        dpid, port = self.host_ports[mac]
+        hops = self.paths.hops(datapath.id, None, dpid, port)
+        if hops is None:
+            return None
+
+        self.add_dst_flow(datapath, mac, hops[0][2], buffer_id=buffer_id)
+        for hop_dpid, _in_port, out_port in hops[1:]:
+            hop_datapath = self.datapaths.get(hop_dpid)
+            if hop_datapath is not None:
+                self.add_dst_flow(hop_datapath, mac, out_port)
+                flow_writer.flush(hop_datapath)
+        return hops[0][2]
+
+    @set_ev_cls(topo_event.EventSwitchEnter)
+    def switch_enter_handler(self, ev):
+        self.paths.add_switch(ev.switch.dp.id)
+
+    @set_ev_cls(topo_event.EventSwitchLeave)
+    def switch_leave_handler(self, ev):
+        dpid = ev.switch.dp.id
+        self.paths.remove_switch(dpid)
+        self.link_ports = set(link_port for link_port in self.link_ports
+                              if link_port[0] != dpid)
+
+    @set_ev_cls(topo_event.EventLinkAdd)
+    def link_add_handler(self, ev):
+        link = ev.link
+        self.paths.add_link(link.src.dpid, link.src.port_no,
+                            link.dst.dpid, link.dst.port_no)
+        link_port = (link.src.dpid, link.src.port_no)
+        self.link_ports.add(link_port)
+
+        # Hosts learned there before the link was known were seen from
+        # the other switch
+        for mac, host_port in list(self.host_ports.items()):
+            if host_port == link_port:
+                del self.host_ports[mac]
+
+    @set_ev_cls(topo_event.EventLinkDelete)
+    def link_delete_handler(self, ev):
+        link = ev.link
+        self.paths.remove_link(link.src.dpid, link.dst.dpid)
+        self.link_ports.discard((link.src.dpid, link.src.port_no))
+
+    # Listeners are called as listener(dpid, mac, port) whenever a MAC is
+    # learned on a new port, and with port None when it is forgotten
+    def add_mac_listener(self, listener):
+        if listener not in self.mac_listeners:
+            self.mac_listeners.append(listener)
+
+    def notify_mac_listeners(self, dpid, mac, port):
+        for listener in self.mac_listeners:
+            listener(dpid, mac, port)
 
     def add_exemption(self, match=None):
         if match != None:
             self.exemption.append(match)
+            self.exemption_classifier.add(match)
 
     def clear_exemption(self):
         del self.exemption[:]
+        self.exemption_classifier.clear()
 
     def get_attachment_port(self, dpid, mac):
         if dpid in self.mac_to_port:
@@ -62,50 +322,12 @@ class L2LearningSwitch(app_manager.RyuApp):
 
         return None
 
-    def is_packet_exempted(self, pkt):
-        fields = {}
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-
-        fields['dl_src'] = eth.src
-        fields['dl_dst'] = eth.dst
-        fields['dl_type'] = eth.ethertype
-
-        if eth.ethertype == ether.ETH_TYPE_ARP:
-            arp_hdr = pkt.get_protocols(arp.arp)[0]
-            fields['nw_src'] = arp_hdr.src_ip
-            fields['nw_dst'] = arp_hdr.dst_ip
-
-        elif eth.ethertype == ether.ETH_TYPE_IP:
-            ip_hdr = pkt.get_protocols(ipv4.ipv4)[0]
-            fields['nw_src'] = ip_hdr.src
-            fields['nw_dst'] = ip_hdr.dst
-            fields['nw_proto'] = ip_hdr.proto
-
-            if ip_hdr.proto == inet.IPPROTO_TCP:
-                tcp_hdr = pkt.get_protocols(tcp.tcp)[0]
-                fields['tp_src'] = tcp_hdr.src_port
-                fields['tp_dst'] = tcp_hdr.dst_port
-            elif ip_hdr.proto == inet.IPPROTO_UDP:
-                tcp_hdr = pkt.get_protocols(tcp.tcp)[0]
-                fields['tp_src'] = tcp_hdr.src_port
-                fields['tp_dst'] = tcp_hdr.dst_port
-
-        for match in self.exemption:
-            # the match specified for exemption should be a
-            # superset of the flows to exclude processing.
-            superset = True
-
-            for key,val in match.items():
-                if key not in fields:
-                    superset = False
-                    break
-                elif val != fields[key]:
-                    superset = False
-                    break
+    def is_packet_exempted(self, headers):
+        if not self.exemption:
+            return False
 
-            # This exemption rule matched
-            if superset:
-                return True
+        fields = headers.match_fields()
+        return self.exemption_classifier.lookup(fields)
 
 
     def add_flow(self, datapath, priority=ofproto_v1_3.OFP_DEFAULT_PRIORITY, match=None,
@@ -118,7 +340,7 @@ class L2LearningSwitch(app_manager.RyuApp):
         else:
             inst = []
 
-        cookie = random.randint(0, 0xffffffffffffffff)
+        cookie = self.cookies.next_cookie()
 
         mod = ofp_parser.OFPFlowMod(datapath=datapath, priority=priority,
                 buffer_id=buffer_id,cookie=cookie,
@@ -126,13 +348,10 @@ class L2LearningSwitch(app_manager.RyuApp):
                 hard_timeout=hard_timeout, instructions=inst,
                 flags=ofp.OFPFF_SEND_FLOW_REM)
 
-        datapath.send_msg(mod)
+        flow_writer.send_msg(datapath, mod)
 
-        match_str = ofctl_v1_3.match_to_str(match),
-        self.switch_flows[datapath.id].append({'cookie':cookie,
-                                               'match':match_str,
-                                               'actions':actions,
-                                               'priority':priority})
+        match_str = ofctl_v1_3.match_to_str(match)
+        self.switch_flows[datapath.id].add(cookie, match_str, actions, priority)
 
         LOG.debug("Flow inserted to switch %x: cookie=%s, match=%s, actions=%s, priority=%d",
                                   datapath.id, str(cookie), match_str, str(actions), priority)
@@ -149,17 +368,35 @@ class L2LearningSwitch(app_manager.RyuApp):
             ofp_parser = datapath.ofproto_parser
 
             self.mac_to_port.setdefault(datapath.id, {})
-            self.switch_flows.setdefault(datapath.id, [])
+            self.switch_flows.setdefault(datapath.id, FlowTable())
+            self.datapaths[datapath.id] = datapath
+
+            # Flush flows left behind by a previous run of this app. The
+            # barrier keeps the switch from reordering the delete after
+            # the flows added below.
+            self.cookies.delete_flows(datapath)
+            flow_writer.flush(datapath, barrier=True)
 
             # install table-miss flow entry
             match = ofp_parser.OFPMatch()
             actions = [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER, ofp.OFPCML_NO_BUFFER)]
             self.add_flow(datapath=datapath, priority=0, match=match, actions=actions)
 
+            if self.forwarding_mode == FORWARDING_MODE_DST:
+                self.install_arp_punt(datapath)
+
         elif ev.state == DEAD_DISPATCHER:
             if datapath.id != None:
+                if self.mac_listeners:
+                    for mac in self.mac_to_port[datapath.id]:
+                        self.notify_mac_listeners(datapath.id, mac, None)
                 del self.mac_to_port[datapath.id]
                 del self.switch_flows[datapath.id]
+                for mac, host_port in list(self.host_ports.items()):
+                    if host_port[0] == datapath.id:
+                        del self.host_ports[mac]
+                self.datapaths.pop(datapath.id, None)
+                flow_writer.remove_writer(datapath.id)
 
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
@@ -170,47 +407,66 @@ class L2LearningSwitch(app_manager.RyuApp):
         ofp_parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
 
-        pkt = packet.Packet(msg.data)
-        if self.is_packet_exempted(pkt):
+        headers = packet_view.get_headers(msg)
+        if headers is None or self.is_packet_exempted(headers):
             return
 
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
-        dst = eth.dst
-        src = eth.src
+        dst = headers.eth_dst
+        src = headers.eth_src
 
         # Skip processing LLDP packets. Leave it to the topology module
-        if eth.ethertype == ether.ETH_TYPE_LLDP:
+        if headers.ethertype == ether.ETH_TYPE_LLDP:
             return
 
         dpid = datapath.id
 
         # Learn a mac address to avoid FLOOD next time.
-        self.mac_to_port[dpid][src] = in_port
-
-        # Following is an optimization to stop troubling the controller
-        # too often. But, it has an effect of preventing the controller
-        # from seeing a few hosts because the ARP reply matches this
-        # rule and goes hidden from controller.
-
-        # On packet_in for any packet, program a low priority rule for
-        # the destination MAC so that we don't keep troubling controller
-        # actions = [ofp_parser.OFPActionOutput(in_port)]
-        # match = ofp_parser.OFPMatch(eth_dst=src)
-        # self.add_flow(datapath=datapath, priority=1,
-        #              match=match, actions=actions)
+        table = self.mac_to_port[dpid]
+        moved = table.get(src) != in_port
+        table[src] = in_port
+        if moved and self.mac_listeners:
+            self.notify_mac_listeners(dpid, src, in_port)
 
         # Learning switch logic below
-        if dst in self.mac_to_port[dpid]:
-            out_port = self.mac_to_port[dpid][dst]
+        if dst in table:
+            out_port = table[dst]
         else:
             out_port = ofp.OFPP_FLOOD
 
         actions = [ofp_parser.OFPActionOutput(out_port)]
 
+        if self.forwarding_mode == FORWARDING_MODE_DST:
+            # On learning (or re-learning) a host, program a low priority
+            # rule for its MAC so that traffic towards it no longer
+            # troubles the controller. ARP is punted by a higher priority
+            # rule, so hosts stay visible to the controller.
+            if moved and not headers.eth_src_is_multicast():
+                self.add_dst_flow(datapath, src, in_port)
+                if (dpid, in_port) not in self.link_ports:
+                    self.host_ports[src] = (dpid, in_port)
+                    self.push_dst_flows(src)
+
+            # A known destination only reaches us once its rule expired,
+            # possibly on the next switches as well. A host pushed to this
+            # switch need not be in its own table.
+            if headers.ethertype != ether.ETH_TYPE_ARP:
+                path_port = self.add_dst_flows_to(datapath, dst,
+                                                  buffer_id=msg.buffer_id)
+                if path_port is not None:
+                    out_port = path_port
+                    actions = [ofp_parser.OFPActionOutput(out_port)]
+                elif out_port != ofp.OFPP_FLOOD:
+                    self.add_dst_flow(datapath, dst, out_port,
+                            buffer_id=msg.buffer_id)
+
+                if (out_port != ofp.OFPP_FLOOD and
+                        msg.buffer_id != ofp.OFP_NO_BUFFER):
+                    return
+
         # install a flow to avoid packet_in next time
-        if out_port != ofp.OFPP_FLOOD:
+        elif out_port != ofp.OFPP_FLOOD:
             match = ofp_parser.OFPMatch(in_port=in_port, eth_dst=dst)
-            self.add_flow(datapath=datapath, priority=2,
+            self.add_flow(datapath=datapath, priority=IN_PORT_DST_FLOW_PRIORITY,
                     match=match, actions=actions,
                     idle_timeout=DEFAULT_IDLE_TIMEOUT,
                     hard_timeout=DEFAULT_HARD_TIMEOUT,
@@ -228,26 +484,19 @@ class L2LearningSwitch(app_manager.RyuApp):
 
         out = ofp_parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
                                   in_port=in_port, actions=actions, data=data)
-        datapath.send_msg(out)
+        flow_writer.send_msg(datapath, out)
 
     @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
     def flow_removed_handler(self, ev):
         msg = ev.msg
         dpid = msg.datapath.id
         cookie = msg.cookie
-        match_str = ofctl_v1_3.match_to_str(msg.match)
-        index_to_delete = None
 
         # Ensure that the flow removed is for a known switch
         if dpid not in self.switch_flows:
             return
 
-        for index, flow in enumerate(self.switch_flows[dpid]):
-            if flow['cookie'] == cookie:
-                index_to_delete = index
-                break
-
-        if index_to_delete is not None:
-            del self.switch_flows[dpid][index_to_delete]
+        if self.switch_flows[dpid].remove(cookie) is not None:
+            match_str = ofctl_v1_3.match_to_str(msg.match)
             LOG.debug("Flow removed on switch %d: match=%s, cookie=%s",
                     dpid, match_str, cookie)
@@ -0,0 +1,85 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+# REST API
+#
+############# Learning switch ##############
+#
+# get the forwarding mode
+# GET /v1.0/learning_switch/forwarding_mode
+#
+# change the forwarding mode, e.g. with {"mode": "dst"}
+# PUT /v1.0/learning_switch/forwarding_mode
+#
+#  "mode" is in_port_dst (default), with one flow per (in_port, eth_dst)
+#  pair, or dst, with one flow per destination MAC and ARP punted to the
+#  controller so that the host tracker keeps seeing every host.
+#
+#
+
+import logging
+import json
+from webob import Response
+
+from ryu.base import app_manager
+from ryu.app.wsgi import ControllerBase, WSGIApplication, route
+from ryu.ofproto import ofproto_v1_3
+from ryu.app.sdnhub_apps import learning_switch
+from ryu.app.sdnhub_apps import rest_body
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.learning_switch_rest')
+
+FORWARDING_MODE = rest_body.obj({
+    'mode': rest_body.one_of(learning_switch.FORWARDING_MODE_IN_PORT_DST,
+                             learning_switch.FORWARDING_MODE_DST),
+}, required=('mode',))
+
+class LearningSwitchController(ControllerBase):
+    def __init__(self, req, link, data, **config):
+        super(LearningSwitchController, self).__init__(req, link, data, **config)
+        self.learning_switch = data['learning_switch']
+
+    @route('learning_switch', '/v1.0/learning_switch/forwarding_mode', methods=['GET'])
+    def get_forwarding_mode(self, req, **_kwargs):
+        return Response(status=200,content_type='application/json',
+                body=json.dumps({'mode': self.learning_switch.get_forwarding_mode()}))
+
+    @route('learning_switch', '/v1.0/learning_switch/forwarding_mode', methods=['PUT'])
+    def set_forwarding_mode(self, req, **_kwargs):
+        try:
+            config = rest_body.parse_body(req, FORWARDING_MODE)
+        except rest_body.BodyError as err:
+            LOG.error('Invalid forwarding mode: %s', err.message)
+            return rest_body.error_response(err)
+
+        self.learning_switch.set_forwarding_mode(config['mode'])
+        return Response(status=200,content_type='application/json',
+                body=json.dumps({'status':'success'}))
+
+
+class LearningSwitchRestApi(app_manager.RyuApp):
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    _CONTEXTS = {
+            'wsgi': WSGIApplication,
+            'learning_switch': learning_switch.L2LearningSwitch
+            }
+
+    def __init__(self, *args, **kwargs):
+        super(LearningSwitchRestApi, self).__init__(*args, **kwargs)
+        wsgi = kwargs['wsgi']
+
+        self.data = {}
+        self.data['learning_switch'] = kwargs['learning_switch']
+
+        wsgi.register(LearningSwitchController, self.data)
@@ -0,0 +1,184 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import collections
+import socket
+import struct
+
+from ryu.ofproto import ether, inet
+
+# Ryu delivers the same PacketIn event object to every app observing
+# it. Rather than have learning_switch, host_tracker and stateless_lb
+# each run the full ryu.lib.packet decoder over msg.data, the first app
+# to look at a message builds a PacketHeaders view and leaves it on the
+# message for the others. The view only unpacks the fixed-offset header
+# fields the sdnhub apps care about, and only when they are asked for.
+#
+# VLAN tags (802.1Q and 802.1ad, stacked or not) are skipped: ethertype
+# is the one after the tags, as an OpenFlow 1.3 eth_type match sees it,
+# and vlan_vid is the VID of the outer tag, or None for untagged frames.
+
+ETH_HEADER_LEN = 14
+VLAN_TAG_LEN = 4
+ARP_HEADER_LEN = 28
+IPV4_MIN_HEADER_LEN = 20
+L4_PORTS_LEN = 4
+
+_ETH = struct.Struct('!6s6sH')
+_VLAN = struct.Struct('!HH')
+_ARP = struct.Struct('!HHBBH6s4s6s4s')
+_IPV4 = struct.Struct('!BBHHHBBH4s4s')
+_PORTS = struct.Struct('!HH')
+
+_CACHE_ATTR = '_sdnhub_headers'
+_UNPARSED = object()
+
+VLAN_ETHERTYPES = (ether.ETH_TYPE_8021Q, ether.ETH_TYPE_8021AD)
+VLAN_VID_MASK = 0x0fff
+
+# Same attribute names as the ryu.lib.packet classes, so callers can
+# switch between the two without touching field accesses.
+ArpHeader = collections.namedtuple('ArpHeader',
+        ['opcode', 'src_mac', 'src_ip', 'dst_mac', 'dst_ip'])
+Ipv4Header = collections.namedtuple('Ipv4Header',
+        ['header_length', 'proto', 'src', 'dst'])
+L4Header = collections.namedtuple('L4Header', ['src_port', 'dst_port'])
+
+
+def mac_to_str(buf):
+    return ':'.join('%02x' % b for b in bytearray(buf))
+
+
+def ipv4_to_str(buf):
+    return socket.inet_ntoa(bytes(buf))
+
+
+class PacketHeaders(object):
+    __slots__ = ('data', 'eth_dst', 'eth_src', 'ethertype', 'vlan_vid',
+                 'l3_offset', '_arp', '_ipv4', '_l4')
+
+    def __init__(self, data):
+        dst, src, ethertype = _ETH.unpack_from(data, 0)
+        self.data = data
+        self.eth_dst = mac_to_str(dst)
+        self.eth_src = mac_to_str(src)
+        self.vlan_vid = None
+
+        # A tag cut short leaves ethertype at the TPID, and nothing past
+        # it is parsed
+        offset = ETH_HEADER_LEN
+        while (ethertype in VLAN_ETHERTYPES and
+               len(data) >= offset + VLAN_TAG_LEN):
+            tci, ethertype = _VLAN.unpack_from(data, offset)
+            if self.vlan_vid is None:
+                self.vlan_vid = tci & VLAN_VID_MASK
+            offset += VLAN_TAG_LEN
+
+        self.ethertype = ethertype
+        self.l3_offset = offset
+        self._arp = _UNPARSED
+        self._ipv4 = _UNPARSED
+        self._l4 = _UNPARSED
+
+    def eth_src_is_multicast(self):
+        return bool(bytearray(self.data[6:7])[0] & 0x01)
+
+    @property
+    def arp(self):
+        if self._arp is _UNPARSED:
+            self._arp = None
+            if (self.ethertype == ether.ETH_TYPE_ARP and
+                    len(self.data) >= self.l3_offset + ARP_HEADER_LEN):
+                (_hwtype, _proto, _hlen, _plen, opcode,
+                 src_mac, src_ip, dst_mac, dst_ip) = \
+                    _ARP.unpack_from(self.data, self.l3_offset)
+                self._arp = ArpHeader(opcode,
+                                      mac_to_str(src_mac), ipv4_to_str(src_ip),
+                                      mac_to_str(dst_mac), ipv4_to_str(dst_ip))
+        return self._arp
+
+    @property
+    def ipv4(self):
+        if self._ipv4 is _UNPARSED:
+            self._ipv4 = None
+            if (self.ethertype == ether.ETH_TYPE_IP and
+                    len(self.data) >= self.l3_offset + IPV4_MIN_HEADER_LEN):
+                (version_ihl, _tos, _total_length, _identification, _flags,
+                 _ttl, proto, _csum, src, dst) = \
+                    _IPV4.unpack_from(self.data, self.l3_offset)
+                self._ipv4 = Ipv4Header((version_ihl & 0xf) * 4, proto,
+                                        ipv4_to_str(src), ipv4_to_str(dst))
+        return self._ipv4
+
+    def _l4_ports(self, proto):
+        if self._l4 is _UNPARSED:
+            self._l4 = None
+            ip = self.ipv4
+            if ip is not None and ip.proto in (inet.IPPROTO_TCP, inet.IPPROTO_UDP):
+                offset = self.l3_offset + ip.header_length
+                if len(self.data) >= offset + L4_PORTS_LEN:
+                    self._l4 = L4Header(*_PORTS.unpack_from(self.data, offset))
+
+        if self._l4 is not None and self.ipv4.proto == proto:
+            return self._l4
+        return None
+
+    @property
+    def tcp(self):
+        return self._l4_ports(inet.IPPROTO_TCP)
+
+    @property
+    def udp(self):
+        return self._l4_ports(inet.IPPROTO_UDP)
+
+    def match_fields(self):
+        # ofctl style field names, as used by exemptions and tap filters
+        fields = {'dl_src': self.eth_src,
+                  'dl_dst': self.eth_dst,
+                  'dl_type': self.ethertype}
+        if self.vlan_vid is not None:
+            fields['dl_vlan'] = self.vlan_vid
+
+        if self.ethertype == ether.ETH_TYPE_ARP:
+            arp_hdr = self.arp
+            if arp_hdr is not None:
+                fields['nw_src'] = arp_hdr.src_ip
+                fields['nw_dst'] = arp_hdr.dst_ip
+
+        elif self.ethertype == ether.ETH_TYPE_IP:
+            ip_hdr = self.ipv4
+            if ip_hdr is not None:
+                fields['nw_src'] = ip_hdr.src
+                fields['nw_dst'] = ip_hdr.dst
+                fields['nw_proto'] = ip_hdr.proto
+
+                l4_hdr = self.tcp or self.udp
+                if l4_hdr is not None:
+                    fields['tp_src'] = l4_hdr.src_port
+                    fields['tp_dst'] = l4_hdr.dst_port
+
+        return fields
+
+
+def get_headers(msg):
+    # Returns None for frames too short to carry an Ethernet header
+    headers = getattr(msg, _CACHE_ATTR, _UNPARSED)
+    if headers is _UNPARSED:
+        data = msg.data
+        if data is None or len(data) < ETH_HEADER_LEN:
+            headers = None
+        else:
+            headers = PacketHeaders(memoryview(data))
+        setattr(msg, _CACHE_ATTR, headers)
+
+    return headers
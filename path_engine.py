@@ -0,0 +1,111 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import logging
+
+import networkx as nx
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.path_engine')
+
+# Shortest paths between switches, fed by the topology discovery events.
+# The switch graph is directed, each edge carrying the ports of the link
+# at both ends. Paths from a switch are computed on first use as one BFS
+# tree, and then served from the cache until a topology change touches
+# that tree:
+#  - a new link u->v only matters to trees that reach u and are made
+#    shorter through it, i.e. that do not reach v or reach it in more
+#    than one hop past u
+#  - a removed link u->v only matters to trees that use it, which is
+#    exactly when v was reached through u
+#  - a removed switch only matters to trees that reach it
+# Everything else keeps its cached paths across the change.
+
+
+class ShortestPathCache(object):
+
+    def __init__(self):
+        self.graph = nx.DiGraph()
+
+        # Source dpid -> {dpid: [source, ..., dpid]}
+        self.trees = {}
+
+    def add_switch(self, dpid):
+        self.graph.add_node(dpid)
+
+    def remove_switch(self, dpid):
+        if dpid not in self.graph:
+            return
+
+        self.graph.remove_node(dpid)
+        for source, paths in list(self.trees.items()):
+            if dpid in paths:
+                del self.trees[source]
+
+    def add_link(self, src, src_port, dst, dst_port):
+        edge = self.graph.get_edge_data(src, dst)
+        if edge is not None and edge['src_port'] == src_port and \
+                edge['dst_port'] == dst_port:
+            return
+
+        # Cached paths only record switches, so a change of ports on an
+        # existing link invalidates nothing
+        self.graph.add_edge(src, dst, src_port=src_port, dst_port=dst_port)
+        if edge is not None:
+            return
+
+        for source, paths in list(self.trees.items()):
+            src_path = paths.get(src)
+            if src_path is None:
+                continue
+
+            dst_path = paths.get(dst)
+            if dst_path is None or len(src_path) + 1 < len(dst_path):
+                del self.trees[source]
+
+    def remove_link(self, src, dst):
+        if not self.graph.has_edge(src, dst):
+            return
+
+        self.graph.remove_edge(src, dst)
+        for source, paths in list(self.trees.items()):
+            dst_path = paths.get(dst)
+            if dst_path is not None and len(dst_path) > 1 and \
+                    dst_path[-2] == src:
+                del self.trees[source]
+
+    def path(self, src, dst):
+        paths = self.trees.get(src)
+        if paths is None:
+            if src not in self.graph:
+                return None
+            paths = self.trees[src] = nx.single_source_shortest_path(self.graph, src)
+
+        return paths.get(dst)
+
+    # The switches from (src, in_port) to (dst, out_port) as a list of
+    # (dpid, in_port, out_port) hops, or None if dst cannot be reached
+    def hops(self, src, in_port, dst, out_port):
+        if src == dst:
+            return [(src, in_port, out_port)]
+
+        path = self.path(src, dst)
+        if path is None:
+            return None
+
+        hops = []
+        for i in range(len(path) - 1):
+            edge = self.graph[path[i]][path[i + 1]]
+            hops.append((path[i], in_port, edge['src_port']))
+            in_port = edge['dst_port']
+        hops.append((dst, in_port, out_port))
+        return hops
@@ -0,0 +1,173 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import json
+import re
+
+from webob import Response
+
+try:
+    STRING_TYPES = (str, unicode)
+except NameError:
+    STRING_TYPES = (str,)
+
+# Request bodies of the REST controllers are JSON documents, checked
+# against a schema before they are used. A schema is a validator built
+# once, at import, out of the functions below; calling it with a value
+# and its path in the document raises BodyError on the first problem.
+
+MAX_BODY_SIZE = 64 * 1024
+MAX_ITEMS = 1024
+
+MAC_PATTERN = re.compile(r'[0-9a-f]{2}([-:])[0-9a-f]{2}(\1[0-9a-f]{2}){4}\Z',
+                         re.IGNORECASE)
+
+_OCTET = r'(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+_DOTTED = r'%s(\.%s){3}' % (_OCTET, _OCTET)
+IP_PATTERN = re.compile(r'%s(/(3[0-2]|[12]?[0-9]|%s))?\Z' % (_DOTTED, _DOTTED))
+ADDRESS_PATTERN = re.compile(r'%s\Z' % _DOTTED)
+
+
+def is_mac_valid(x):
+    return MAC_PATTERN.match(x) is not None
+
+
+# An IPv4 address, optionally with a prefix length or a netmask
+def is_ip_valid(x):
+    return IP_PATTERN.match(x) is not None
+
+
+# A single IPv4 address, without prefix
+def is_address_valid(x):
+    return ADDRESS_PATTERN.match(x) is not None
+
+
+class BodyError(Exception):
+
+    def __init__(self, message, status=400):
+        super(BodyError, self).__init__(message)
+        self.message = message
+        self.status = status
+
+
+def error_response(err):
+    return Response(status=err.status, content_type='application/json',
+                    charset='utf-8',
+                    body=json.dumps({'status': 'error', 'message': err.message}))
+
+
+def parse_body(req, schema):
+    length = req.content_length
+    if length is not None and length > MAX_BODY_SIZE:
+        raise BodyError('Request body over %d bytes' % MAX_BODY_SIZE, 413)
+
+    body = req.body
+    if len(body) > MAX_BODY_SIZE:
+        raise BodyError('Request body over %d bytes' % MAX_BODY_SIZE, 413)
+
+    try:
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        data = json.loads(body)
+    except ValueError:
+        raise BodyError('Request body is not valid JSON')
+
+    schema(data, 'body')
+    return data
+
+
+def _is_integer(value):
+    # JSON true and false come out as bool, which is an int subclass
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def integer(minimum=None, maximum=None):
+    def validate(value, path):
+        if not _is_integer(value):
+            raise BodyError('%s must be an integer' % path)
+        if minimum is not None and value < minimum:
+            raise BodyError('%s must be at least %d' % (path, minimum))
+        if maximum is not None and value > maximum:
+            raise BodyError('%s must be at most %d' % (path, maximum))
+    return validate
+
+
+def positive_number():
+    def validate(value, path):
+        if not (_is_integer(value) or isinstance(value, float)) or value <= 0:
+            raise BodyError('%s must be a positive number' % path)
+    return validate
+
+
+def string(check=None, description='valid'):
+    def validate(value, path):
+        if not isinstance(value, STRING_TYPES):
+            raise BodyError('%s must be a string' % path)
+        if check is not None and not check(value):
+            raise BodyError('%s is not %s' % (path, description))
+    return validate
+
+
+def one_of(*choices):
+    def validate(value, path):
+        if value not in choices:
+            raise BodyError('%s must be one of %s' %
+                            (path, ', '.join(str(choice) for choice in choices)))
+    return validate
+
+
+def any_of(*schemas):
+    def validate(value, path):
+        for schema in schemas:
+            try:
+                schema(value, path)
+                return
+            except BodyError:
+                pass
+        raise BodyError('%s is not valid' % path)
+    return validate
+
+
+def array(items, max_items=MAX_ITEMS):
+    def validate(value, path):
+        if not isinstance(value, list):
+            raise BodyError('%s must be a list' % path)
+        if len(value) > max_items:
+            raise BodyError('%s has more than %d items' % (path, max_items))
+        for index, item in enumerate(value):
+            items(item, '%s[%d]' % (path, index))
+    return validate
+
+
+# Fields without a schema are let through as they are, unless the
+# object is closed
+def obj(fields, required=(), closed=False):
+    def validate(value, path):
+        if not isinstance(value, dict):
+            raise BodyError('%s must be an object' % path)
+        for name in required:
+            if name not in value:
+                raise BodyError('%s.%s is missing' % (path, name))
+        for name, item in value.items():
+            schema = fields.get(name)
+            if schema is not None:
+                schema(item, '%s.%s' % (path, name))
+            elif closed:
+                raise BodyError('%s.%s is not one of %s' %
+                                (path, name, ', '.join(sorted(fields))))
+    return validate
+
+
+MAC = string(is_mac_valid, 'a MAC address')
+IP = string(is_ip_valid, 'an IPv4 address or prefix')
+ADDRESS = string(is_address_valid, 'an IPv4 address')
@@ -2,4 +2,4 @@
 
 #export PYTHONPATH=$PYTHONPATH:.
 
-PYTHONPATH=. ryu-manager --observe-links ryu.app.sdnhub_apps.fileserver ryu.app.sdnhub_apps.host_tracker_rest  ryu.app.rest_topology ryu.app.sdnhub_apps.stateless_lb_rest ryu.app.sdnhub_apps.tap_rest ryu.app.ofctl_rest
+PYTHONPATH=. ryu-manager --observe-links ryu.app.sdnhub_apps.fileserver ryu.app.sdnhub_apps.host_tracker_rest  ryu.app.rest_topology ryu.app.sdnhub_apps.stateless_lb_rest ryu.app.sdnhub_apps.learning_switch_rest ryu.app.sdnhub_apps.tap_rest ryu.app.sdnhub_apps.fabric_stats_rest ryu.app.sdnhub_apps.flow_writer_rest ryu.app.sdnhub_apps.topology_push_rest ryu.app.ofctl_rest
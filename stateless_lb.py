@@ -11,109 +11,693 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
 # implied.
 
+import collections
 import logging
-import json
-import random
+import socket
+import struct
+import time
 
 from ryu.lib import mac as mac_lib
-from ryu.lib import ip as ip_lib
 from ryu.base import app_manager
 from ryu.controller import ofp_event
-from ryu.controller.handler import MAIN_DISPATCHER, CONFIG_DISPATCHER
+from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ipv4
-from ryu.lib.packet import tcp
 from ryu.lib.packet import arp
 from ryu.ofproto import ether, inet
-from ryu.ofproto import ofproto_v1_0, ofproto_v1_3
-from ryu.lib import dpid as dpid_lib
-from ryu.app.sdnhub_apps import learning_switch
+from ryu.ofproto import ofproto_v1_3
+from ryu.lib import hub
+from ryu.app.sdnhub_apps import cookie_allocator
+from ryu.app.sdnhub_apps import flow_writer
+from ryu.app.sdnhub_apps import lb_health
+from ryu.app.sdnhub_apps import lb_scheduler
+from ryu.app.sdnhub_apps import packet_view
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.stateless_lb')
+
+# Barriers asked of flow_writer are answered through its own app
+app_manager.require_app('ryu.app.sdnhub_apps.flow_writer')
 
 UINT32_MAX = 0xffffffff
 
+DEFAULT_VIRTUAL_MAC = "A6:63:DD:D7:C0:C8" # Pick something dummy
+
+# In the reactive mode every new connection to the virtual IP comes to the
+# controller, which picks a server and installs an exact-match flow for
+# each direction. In the group mode each switch gets an OpenFlow select
+# group with one bucket per reachable server and a single rule sending
+# the virtual IP to it, so the switch spreads connections by itself. The
+# return path is rewritten by one flow per (server, client) pair, set up
+# from the first reply punted to the controller. Replies are told apart
+# from the connections the servers open themselves by their source: the
+# virtual IP when the servers have it as an alias, and otherwise the
+# service ports, which group mode then needs to be given.
+LB_MODE_REACTIVE = 'reactive'
+LB_MODE_GROUP = 'group'
+
+# Group ids are carved out of their own range, one per service
+LB_GROUP_ID_BASE = cookie_allocator.APP_STATELESS_LB << 24
+LB_FLOW_PRIORITY = ofproto_v1_3.OFP_DEFAULT_PRIORITY
+REVERSE_PUNT_PRIORITY = LB_FLOW_PRIORITY - 1
+REVERSE_IDLE_TIMEOUT = 60
+
+# ARP replies for a virtual IP are stamped out of a prebuilt frame, and
+# the result is kept per requester up to this many entries
+ARP_REPLY_FRAME = struct.Struct('!6s6sHHHBBH6s4s6s4s')
+ARP_REPLY_CACHE_SIZE = 4096
+
+# Optional connection affinity, reactive mode only: a client (by source
+# IP) or a single connection (by 5-tuple) goes back to the server it got
+# last time, as long as that was within the affinity timeout.
+AFFINITY_NONE = 'none'
+AFFINITY_CLIENT_IP = 'client_ip'
+AFFINITY_FLOW = 'flow'
+DEFAULT_AFFINITY_TIMEOUT = 300
+DEFAULT_AFFINITY_SIZE = 65536
+
+FLOW_IDLE_TIMEOUT = 10
+
 ################ Main ###################
 
-# The stateless server load balancer picks a different server for each
-# request. For making the assignment, it only uses the servers it
-# already knows the location of. The clients or the gateway sents along
-# a request for the Virtual IP of the load-balancer. The first switch
-# intercepting the request will rewrite the headers to match the actual
-# server picked. So all other switches will only have to do simple
-# L2 forwarding. It is possible to avoid IP header writing if alias IP
-# is set on the servers. The call skip_ip_header_rewriting() will handle
-# the appropriate flag setting.
+# The stateless server load balancer fronts any number of services, each
+# a virtual IP with its own pool of servers. It picks a different server
+# for each request, using the scheduler chosen for the service (round
+# robin by default, see lb_scheduler). For making the assignment, it only
+# uses the servers it already knows the location of. The clients or the
+# gateway sents along a request for the Virtual IP of the load-balancer.
+# The first switch intercepting the request will rewrite the headers to
+# match the actual server picked. So all other switches will only have
+# to do simple L2 forwarding. It is possible to avoid IP header writing
+# if alias IP is set on the servers. The rewrite_ip flag of each service
+# controls this.
+
+# Pool servers whose attachment port is known on one switch. Entries are
+# (server, outport) tuples, and removal swaps the last entry into the
+# freed slot so that both updates and indexed selection are O(1). The
+# MACs of the servers are kept apart as members, which only change when
+# a server joins or leaves, not when it moves.
+class ReachableServers(object):
+
+    def __init__(self):
+        self.entries = []
+        self.position = {}
+        self.members = frozenset()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    # Both return whether the members changed
+    def update(self, mac, server, outport):
+        index = self.position.get(mac)
+        if index is not None:
+            self.entries[index] = (server, outport)
+            return False
+
+        self.position[mac] = len(self.entries)
+        self.entries.append((server, outport))
+        self.members = self.members | frozenset([mac])
+        return True
+
+    def remove(self, mac):
+        index = self.position.pop(mac, None)
+        if index is None:
+            return False
+
+        self.members = self.members - frozenset([mac])
+        last = self.entries.pop()
+        if index < len(self.entries):
+            self.entries[index] = last
+            self.position[last[0]['mac'].lower()] = index
+        return True
+
+
+# Bounded LRU of affinity key -> (server MAC, expiry time). Lookups
+# refresh the entry, and the least recently used one makes room when full.
+class AffinityTable(object):
+
+    def __init__(self, timeout=DEFAULT_AFFINITY_TIMEOUT,
+                 size=DEFAULT_AFFINITY_SIZE):
+        self.timeout = timeout
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key, now):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+
+        mac, expiry = entry
+        if expiry < now:
+            return None
+
+        self.entries[key] = (mac, now + self.timeout)
+        return mac
+
+    def record(self, key, mac, now):
+        self.entries.pop(key, None)
+        if len(self.entries) >= self.size:
+            self.entries.popitem(last=False)
+        self.entries[key] = (mac, now + self.timeout)
+
+    def forget_server(self, mac):
+        for key, entry in list(self.entries.items()):
+            if entry[0] == mac:
+                del self.entries[key]
+
+
+# One virtual IP: its server pool and how connections to it are handled
+class VirtualService(object):
+
+    def __init__(self, service_id, virtual_ip, servers, rewrite_ip=True,
+                 scheduler=lb_scheduler.ROUND_ROBIN, mode=LB_MODE_REACTIVE,
+                 virtual_mac=DEFAULT_VIRTUAL_MAC, arp_responder=False,
+                 health_check=None, affinity=AFFINITY_NONE,
+                 affinity_timeout=DEFAULT_AFFINITY_TIMEOUT,
+                 affinity_size=DEFAULT_AFFINITY_SIZE, ports=None, cookies=None):
+        self.service_id = service_id
+        self.virtual_ip = virtual_ip
+        self.virtual_mac = virtual_mac
+        self.servers = servers or []
+        self.rewrite_ip_header = rewrite_ip
+        self.mode = mode
+        self.scheduler_name = scheduler
+        self.scheduler = lb_scheduler.create_scheduler(scheduler)
+        self.group_id = LB_GROUP_ID_BASE | service_id
+        self.arp_responder = arp_responder
+        self.health_check = health_check
+        self.health = None
+        self.cookies = cookies
+
+        # TCP ports balanced by the service; all of them when empty
+        self.ports = sorted(set(ports or []))
+
+        self.affinity = affinity
+        self.affinity_table = None
+        if affinity != AFFINITY_NONE:
+            self.affinity_table = AffinityTable(affinity_timeout, affinity_size)
+
+        # Server MAC -> traffic counted from the FlowRemoved of its flows
+        self.server_stats = {}
+
+        vmac = mac_lib.haddr_to_bin(virtual_mac.lower())
+        self.arp_template = bytearray(ARP_REPLY_FRAME.pack(
+                b'\x00' * 6, vmac, ether.ETH_TYPE_ARP,
+                1, ether.ETH_TYPE_IP, 6, 4, arp.ARP_REPLY,
+                vmac, socket.inet_aton(virtual_ip),
+                b'\x00' * 6, socket.inet_aton('0.0.0.0')))
+        self.arp_replies = {}
+
+        self.servers_by_mac = {}
+        for server in self.servers:
+            self.servers_by_mac[server['mac'].lower()] = server
+        self.reachable_servers = {}
+        self.installed_groups = set()
+
+    def to_dict(self):
+        return {'virtual_ip': self.virtual_ip,
+                'virtual_mac': self.virtual_mac,
+                'servers': self.servers,
+                'rewrite_ip': 1 if self.rewrite_ip_header else 0,
+                'scheduler': self.scheduler_name,
+                'mode': self.mode,
+                'arp_responder': 1 if self.arp_responder else 0,
+                'health_check': self.health_check,
+                'affinity': self.affinity,
+                'affinity_timeout': self.affinity_table.timeout if self.affinity_table else None,
+                'ports': self.ports,
+                'server_stats': self.server_stats,
+                'unhealthy_servers': [mac for mac in self.servers_by_mac
+                                      if not self.is_server_healthy(mac)]}
+
+    def serves_port(self, port):
+        return not self.ports or port in self.ports
+
+    # Extra match fields, one set per flow to program, that restrict a
+    # flow to the service ports
+    def port_fields(self, field):
+        if not self.ports:
+            return [{}]
+        return [{field: port} for port in self.ports]
+
+    def is_server_healthy(self, mac):
+        return self.health is None or self.health.is_healthy(mac)
+
+    def affinity_key(self, flow_key):
+        if self.affinity == AFFINITY_CLIENT_IP:
+            return flow_key[0]
+        return flow_key
+
+    def count_flow(self, server, msg):
+        stats = self.server_stats.setdefault(server['mac'].lower(),
+                {'connections': 0, 'packets': 0, 'bytes': 0})
+        stats['packets'] += msg.packet_count
+        stats['bytes'] += msg.byte_count
+        return stats
+
+    def arp_reply(self, dst_mac, dst_ip):
+        key = (dst_mac, dst_ip)
+        frame = self.arp_replies.get(key)
+        if frame is None:
+            target_mac = mac_lib.haddr_to_bin(dst_mac)
+            reply = bytearray(self.arp_template)
+            reply[0:6] = target_mac
+            reply[32:38] = target_mac
+            reply[38:42] = socket.inet_aton(dst_ip)
+            frame = bytes(reply)
+
+            if len(self.arp_replies) >= ARP_REPLY_CACHE_SIZE:
+                self.arp_replies.clear()
+            self.arp_replies[key] = frame
+
+        return frame
+
+    def arp_probe(self, server):
+        # ARP request for the server's address, sent on behalf of the
+        # virtual IP so that the answer is punted back to the controller
+        server_mac = mac_lib.haddr_to_bin(server['mac'].lower())
+        probe = bytearray(self.arp_template)
+        probe[0:6] = server_mac
+        probe[20:22] = struct.pack('!H', arp.ARP_REQUEST)
+        probe[38:42] = socket.inet_aton(server['ip'])
+        return bytes(probe)
+
+    def arp_responder_actions(self, ofp, ofp_parser):
+        # Turns the request around in the switch. The register moves are
+        # Nicira extensions; without them there is no responder flow.
+        if not hasattr(ofp_parser, 'NXActionRegMove'):
+            return None
+
+        return [ofp_parser.NXActionRegMove(src_field='eth_src',
+                        dst_field='eth_dst', n_bits=48),
+                ofp_parser.OFPActionSetField(eth_src=self.virtual_mac),
+                ofp_parser.OFPActionSetField(arp_op=arp.ARP_REPLY),
+                ofp_parser.NXActionRegMove(src_field='arp_sha',
+                        dst_field='arp_tha', n_bits=48),
+                ofp_parser.OFPActionSetField(arp_sha=self.virtual_mac),
+                ofp_parser.NXActionRegMove(src_field='arp_spa',
+                        dst_field='arp_tpa', n_bits=32),
+                ofp_parser.OFPActionSetField(arp_spa=self.virtual_ip),
+                ofp_parser.OFPActionOutput(ofp.OFPP_IN_PORT)]
+
+    def reply_source_ip(self, server):
+        if self.rewrite_ip_header:
+            return server['ip']
+        return self.virtual_ip
+
+    def server_actions(self, ofp_parser, server, outport):
+        if self.rewrite_ip_header:
+            return [ofp_parser.OFPActionSetField(eth_dst=server['mac']),
+                    ofp_parser.OFPActionSetField(ipv4_dst=server['ip']),
+                    ofp_parser.OFPActionOutput(outport) ]
+        else:
+            return [ofp_parser.OFPActionSetField(eth_dst=server['mac']),
+                    ofp_parser.OFPActionOutput(outport) ]
+
+    def client_actions(self, ofp_parser, outport):
+        if self.rewrite_ip_header:
+            return [ofp_parser.OFPActionSetField(eth_src=self.virtual_mac),
+                    ofp_parser.OFPActionSetField(ipv4_src=self.virtual_ip),
+                    ofp_parser.OFPActionOutput(outport) ]
+        else:
+            return [ofp_parser.OFPActionSetField(eth_src=self.virtual_mac),
+                    ofp_parser.OFPActionOutput(outport) ]
+
 
 class StatelessLB(app_manager.RyuApp):
 
     def __init__(self, *args, **kwargs):
         super(StatelessLB, self).__init__(*args, **kwargs)
-        self.rewrite_ip_header = True
-        self.server_index = 0
-        self.servers = []
+        self.learning_switch = None
+        self.cookies = cookie_allocator.CookieAllocator(
+                cookie_allocator.APP_STATELESS_LB)
 
-        self.virtual_ip = None
-        #self.virtual_ip = "10.0.0.5"
-        self.virtual_mac = "A6:63:DD:D7:C0:C8" # Pick something dummy and
+        # Virtual IP -> VirtualService, and server MAC -> services using it
+        self.services = {}
+        self.services_by_server_mac = {}
+        self.free_service_ids = []
+        self.next_service_id = 1
 
-        #self.servers.append({'ip':"10.0.0.2", 'mac':"00:00:00:00:00:02"})
-        #self.servers.append({'ip':"10.0.0.3", 'mac':"00:00:00:00:00:03"})
-        #self.servers.append({'ip':"10.0.0.4", 'mac':"00:00:00:00:00:04"})
+        # Flow cookie -> (service, server, is forward flow, dpid), for
+        # connection and traffic accounting
+        self.connections = {}
 
         #self.learning_switch = kwargs['learning_switch']
         #self.learning_switch.add_exemption({'dl_type': ether.ETH_TYPE_LLDP})
-        #self.learning_switch.add_exemption({'dl_dst': self.virtual_mac})
+
+    def close(self):
+        for service in self.services.values():
+            if service.health is not None:
+                service.health.stop()
+
+        if self.learning_switch is None:
+            return
+
+        for datapath in self.learning_switch.datapaths.values():
+            self.cookies.delete_flows(datapath)
+            flow_writer.flush(datapath)
 
     def set_learning_switch(self, learning_switch):
         self.learning_switch = learning_switch
-        self.learning_switch.clear_exemption()
-        self.learning_switch.add_exemption({'dl_dst': self.virtual_mac})
+        self.learning_switch.add_mac_listener(self.mac_learned)
+        self.update_exemptions()
+
+    def get_services(self):
+        return [service.to_dict() for service in self.services.values()]
+
+    def allocate_service_id(self):
+        if self.free_service_ids:
+            return self.free_service_ids.pop()
+
+        if self.next_service_id > cookie_allocator.MAX_INSTANCE:
+            return None
+
+        service_id = self.next_service_id
+        self.next_service_id += 1
+        return service_id
+
+    def add_service(self, virtual_ip, servers, rewrite_ip=True,
+                    scheduler=lb_scheduler.ROUND_ROBIN, mode=LB_MODE_REACTIVE,
+                    virtual_mac=None, arp_responder=False, health_check=None,
+                    affinity=AFFINITY_NONE, affinity_timeout=DEFAULT_AFFINITY_TIMEOUT,
+                    affinity_size=DEFAULT_AFFINITY_SIZE, ports=None):
+        if mode not in (LB_MODE_REACTIVE, LB_MODE_GROUP):
+            raise ValueError('Unknown load balancer mode %s' % mode)
+        if affinity not in (AFFINITY_NONE, AFFINITY_CLIENT_IP, AFFINITY_FLOW):
+            raise ValueError('Unknown affinity %s' % affinity)
+        if mode == LB_MODE_GROUP and rewrite_ip and not ports:
+            raise ValueError('Group mode with IP rewriting needs the service ports')
+
+        service_id = self.allocate_service_id()
+        if service_id is None:
+            LOG.error('Out of service ids, cannot add virtual IP %s', virtual_ip)
+            return None
+
+        try:
+            service = VirtualService(service_id, virtual_ip, servers,
+                    rewrite_ip=rewrite_ip, scheduler=scheduler, mode=mode,
+                    virtual_mac=virtual_mac or DEFAULT_VIRTUAL_MAC,
+                    arp_responder=arp_responder, health_check=health_check,
+                    affinity=affinity, affinity_timeout=affinity_timeout,
+                    affinity_size=affinity_size, ports=ports,
+                    cookies=self.cookies.for_instance(service_id))
+        except (ValueError, socket.error) as err:
+            self.free_service_ids.append(service_id)
+            raise ValueError('Invalid configuration for virtual IP %s: %s' %
+                             (virtual_ip, err))
+
+        # Creating an existing virtual IP replaces its configuration, once
+        # the new one is known to be good
+        self.remove_service(virtual_ip)
+        self.services[virtual_ip] = service
+
+        for mac in service.servers_by_mac:
+            self.services_by_server_mac.setdefault(mac, []).append(service)
+
+        if self.learning_switch is not None:
+            for dpid, table in self.learning_switch.mac_to_port.items():
+                reachable = service.reachable_servers.setdefault(dpid, ReachableServers())
+                for mac, server in service.servers_by_mac.items():
+                    if mac in table and service.is_server_healthy(mac):
+                        reachable.update(mac, server, table[mac])
+                self.servers_changed(service, reachable)
+
+            self.update_exemptions()
+            for datapath in self.learning_switch.datapaths.values():
+                self.program_service(datapath, service)
+
+        if health_check is not None:
+            self.start_health_check(service)
+
+        return service
+
+    def start_health_check(self, service):
+        config = service.health_check
+        service.health = lb_health.HealthChecker(
+                lambda mac: self.send_health_probe(service, mac),
+                lambda mac, healthy: self.server_health_changed(service, mac, healthy),
+                interval=config.get('interval', lb_health.DEFAULT_INTERVAL),
+                timeout=config.get('timeout', lb_health.DEFAULT_TIMEOUT),
+                fall=config.get('fall', lb_health.DEFAULT_FALL),
+                rise=config.get('rise', lb_health.DEFAULT_RISE))
+        service.health.set_targets(service.servers_by_mac)
+        service.health.start()
+
+    def send_health_probe(self, service, mac):
+        server = service.servers_by_mac[mac]
+        method = service.health_check.get('method', lb_health.HEALTH_CHECK_ARP)
+
+        if method == lb_health.HEALTH_CHECK_TCP:
+            hub.spawn(lb_health.tcp_probe, service.health, mac, server['ip'],
+                      service.health_check['port'])
+            return
 
-    # Users can skip doing header rewriting by setting the virtual IP
-    # as an alias IP on all the servers. This works well in single subnet
-    def set_rewrite_ip_flag(self, rewrite_ip):
-        if rewrite_ip == 1:
-            self.rewrite_ip_header = True
-        else:
-            self.rewrite_ip_header = False
+        # ARP probes go out of the port the server was last seen on. A
+        # server no switch knows about gets no probe, and so fails it.
+        if self.learning_switch is None:
+            return
 
-    def set_virtual_ip(self, virtual_ip=None):
-        self.virtual_ip = virtual_ip
+        for dpid, table in self.learning_switch.mac_to_port.items():
+            datapath = self.learning_switch.datapaths.get(dpid)
+            if mac not in table or datapath is None:
+                continue
+
+            ofp = datapath.ofproto
+            ofp_parser = datapath.ofproto_parser
+            actions = [ofp_parser.OFPActionOutput(table[mac])]
+            out = ofp_parser.OFPPacketOut(datapath=datapath,
+                       in_port=ofp.OFPP_CONTROLLER, data=service.arp_probe(server),
+                       actions=actions, buffer_id=UINT32_MAX)
+            flow_writer.send_msg(datapath, out)
+            return
+
+    def server_health_changed(self, service, mac, healthy):
+        server = service.servers_by_mac.get(mac)
+        if server is None or self.learning_switch is None:
+            return
 
-    def set_server_pool(self, servers=None):
-        self.servers = servers
+        LOG.info('Server %s of %s is %s', server['ip'], service.virtual_ip,
+                 'up' if healthy else 'down')
+
+        if not healthy and service.affinity_table is not None:
+            service.affinity_table.forget_server(mac)
+
+        # Pull the server out of (or put it back into) the selection of
+        # every switch right away, instead of waiting for it to age out
+        for dpid, table in self.learning_switch.mac_to_port.items():
+            reachable = service.reachable_servers.setdefault(dpid, ReachableServers())
+            if healthy and mac in table:
+                changed = reachable.update(mac, server, table[mac])
+            else:
+                changed = reachable.remove(mac)
+            if changed:
+                self.servers_changed(service, reachable)
+
+            if service.mode == LB_MODE_GROUP:
+                datapath = self.learning_switch.datapaths.get(dpid)
+                if datapath is not None:
+                    self.program_group(datapath, service)
+
+    # Schedulers that precompute per set of servers (Maglev) do so in their
+    # own thread, rather than in the handler that saw the change or in the
+    # next PacketIn
+    def servers_changed(self, service, reachable):
+        hub.spawn(service.scheduler.servers_changed, reachable)
+
+    def remove_service(self, virtual_ip):
+        service = self.services.pop(virtual_ip, None)
+        if service is None:
+            return False
+
+        if service.health is not None:
+            service.health.stop()
+
+        for mac in service.servers_by_mac:
+            services = self.services_by_server_mac.get(mac)
+            if services is not None:
+                services.remove(service)
+                if not services:
+                    del self.services_by_server_mac[mac]
+
+        # The FlowRemoved of its deleted flows are of no interest anymore
+        for cookie, connection in list(self.connections.items()):
+            if connection[0] is service:
+                del self.connections[cookie]
+
+        if self.learning_switch is not None:
+            self.update_exemptions()
+            for datapath in self.learning_switch.datapaths.values():
+                service.cookies.delete_flows(datapath,
+                        service.cookies.instance_match())
+                if datapath.id in service.installed_groups:
+                    self.delete_group(datapath, service)
+
+        self.free_service_ids.append(service.service_id)
+        return True
+
+    def update_exemptions(self):
+        if self.learning_switch is None:
+            return
 
-    def formulate_arp_reply(self, dst_mac, dst_ip):
-        if self.virtual_ip == None:
+        self.learning_switch.clear_exemption()
+
+        virtual_macs = set()
+        for service in self.services.values():
+            virtual_macs.add(service.virtual_mac.lower())
+
+            # In group mode, replies from the servers are punted to us
+            # for the return path rewrite and must not be forwarded as is
+            if service.mode == LB_MODE_GROUP:
+                for mac, server in service.servers_by_mac.items():
+                    for fields in service.port_fields('tp_src'):
+                        fields.update({'dl_src': mac,
+                                'nw_src': service.reply_source_ip(server),
+                                'nw_proto': inet.IPPROTO_TCP})
+                        self.learning_switch.add_exemption(fields)
+
+        for virtual_mac in virtual_macs:
+            self.learning_switch.add_exemption({'dl_dst': virtual_mac})
+
+    def mac_learned(self, dpid, mac, port):
+        services = self.services_by_server_mac.get(mac)
+        if services is None:
             return
 
-        src_mac = self.virtual_mac
-        src_ip = self.virtual_ip
-        arp_opcode = arp.ARP_REPLY
-        arp_target_mac = dst_mac
+        for service in services:
+            server = service.servers_by_mac[mac]
+            if port is None or not service.is_server_healthy(mac):
+                reachable = service.reachable_servers.get(dpid)
+                changed = reachable is not None and reachable.remove(mac)
+            else:
+                reachable = service.reachable_servers.setdefault(dpid, ReachableServers())
+                changed = reachable.update(mac, server, port)
+            if changed:
+                self.servers_changed(service, reachable)
+
+            if service.mode == LB_MODE_GROUP:
+                datapath = self.learning_switch.datapaths.get(dpid)
+                if datapath is not None:
+                    self.program_group(datapath, service)
+
+    def program_service(self, datapath, service):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        if service.arp_responder:
+            actions = service.arp_responder_actions(ofp, ofp_parser)
+            if actions is None:
+                LOG.info('Switch %x cannot answer ARP for %s by itself',
+                         datapath.id, service.virtual_ip)
+            else:
+                match = ofp_parser.OFPMatch(eth_type=ether.ETH_TYPE_ARP,
+                        arp_op=arp.ARP_REQUEST, arp_tpa=service.virtual_ip)
+                self.add_flow(datapath, service, LB_FLOW_PRIORITY, match, actions)
+
+        if service.mode != LB_MODE_GROUP:
+            return
+
+        self.program_group(datapath, service)
+
+        actions = [ofp_parser.OFPActionGroup(service.group_id)]
+        for fields in service.port_fields('tcp_dst'):
+            match = ofp_parser.OFPMatch(eth_type=ether.ETH_TYPE_IP,
+                    ip_proto=inet.IPPROTO_TCP, ipv4_dst=service.virtual_ip,
+                    **fields)
+            self.add_flow(datapath, service, LB_FLOW_PRIORITY, match, actions)
+
+        actions = [ofp_parser.OFPActionOutput(ofp.OFPP_CONTROLLER,
+                                              ofp.OFPCML_NO_BUFFER)]
+        for mac, server in service.servers_by_mac.items():
+            for fields in service.port_fields('tcp_src'):
+                match = ofp_parser.OFPMatch(eth_type=ether.ETH_TYPE_IP,
+                        ip_proto=inet.IPPROTO_TCP, eth_src=mac,
+                        ipv4_src=service.reply_source_ip(server), **fields)
+                self.add_flow(datapath, service, REVERSE_PUNT_PRIORITY,
+                              match, actions)
+
+    def add_flow(self, datapath, service, priority, match, actions,
+                 idle_timeout=0, buffer_id=UINT32_MAX, flags=0):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        cookie = service.cookies.next_cookie()
+        inst = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        mod = ofp_parser.OFPFlowMod(datapath=datapath, priority=priority,
+                match=match, idle_timeout=idle_timeout, instructions=inst,
+                buffer_id=buffer_id, cookie=cookie, flags=flags)
+        flow_writer.send_msg(datapath, mod)
+        return cookie
+
+    def program_group(self, datapath, service):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+
+        buckets = []
+        reachable = service.reachable_servers.get(datapath.id)
+        for server, outport in (reachable.entries if reachable else []):
+            buckets.append(ofp_parser.OFPBucket(
+                    weight=lb_scheduler.server_weight(server),
+                    watch_port=ofp.OFPP_ANY, watch_group=ofp.OFPG_ANY,
+                    actions=service.server_actions(ofp_parser, server, outport)))
+
+        if datapath.id in service.installed_groups:
+            command = ofp.OFPGC_MODIFY
+        else:
+            # Clear out a group a previous run may have left behind
+            self.delete_group(datapath, service)
+            command = ofp.OFPGC_ADD
+            service.installed_groups.add(datapath.id)
 
-        ether_proto = ether.ETH_TYPE_ARP
-        hwtype = 1
-        arp_proto = ether.ETH_TYPE_IP
-        hlen = 6
-        plen = 4
+        mod = ofp_parser.OFPGroupMod(datapath, command, ofp.OFPGT_SELECT,
+                                     service.group_id, buckets)
+        flow_writer.send_msg(datapath, mod)
 
-        pkt = packet.Packet()
-        e = ethernet.ethernet(dst_mac, src_mac, ether_proto)
-        a = arp.arp(hwtype, arp_proto, hlen, plen, arp_opcode,
-                    src_mac, src_ip, arp_target_mac, dst_ip)
-        pkt.add_protocol(e)
-        pkt.add_protocol(a)
-        pkt.serialize()
+    def delete_group(self, datapath, service):
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
 
-        return pkt
+        service.installed_groups.discard(datapath.id)
+        mod = ofp_parser.OFPGroupMod(datapath, ofp.OFPGC_DELETE,
+                                     ofp.OFPGT_SELECT, service.group_id)
+        flow_writer.send_msg(datapath, mod)
 
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def state_change_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is None:
+            return
+
+        for service in self.services.values():
+            service.installed_groups.discard(datapath.id)
+
+        if ev.state == MAIN_DISPATCHER:
+            # Flush flows left behind by a previous run, then lay down the
+            # group mode state of every service, with a barrier so that the
+            # delete cannot be applied after them
+            self.cookies.delete_flows(datapath)
+            flow_writer.flush(datapath, barrier=True)
+            for service in self.services.values():
+                self.program_service(datapath, service)
+
+        elif ev.state == DEAD_DISPATCHER:
+            # No FlowRemoved will come for the connections of the switch
+            for cookie, connection in list(self.connections.items()):
+                service, server, forward, dpid = connection
+                if dpid != datapath.id:
+                    continue
+
+                del self.connections[cookie]
+                if forward:
+                    service.scheduler.connection_closed(server)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def packet_in_handler(self, ev):
-        if self.virtual_ip == None or self.servers == None:
+        if not self.services:
             return
 
         msg = ev.msg
@@ -123,102 +707,186 @@ class StatelessLB(app_manager.RyuApp):
         in_port = msg.match['in_port']
         dpid = datapath.id
 
-        pkt = packet.Packet(msg.data)
-        eth = pkt.get_protocols(ethernet.ethernet)[0]
+        headers = packet_view.get_headers(msg)
+        if headers is None:
+            return
 
-        if eth.ethertype == ether.ETH_TYPE_ARP:
-            arp_hdr = pkt.get_protocols(arp.arp)[0]
+        if headers.ethertype == ether.ETH_TYPE_ARP:
+            arp_hdr = headers.arp
+            if arp_hdr is None:
+                return
 
-            if arp_hdr.dst_ip == self.virtual_ip and arp_hdr.opcode == arp.ARP_REQUEST:
+            # Answer to one of our health probes
+            if arp_hdr.opcode == arp.ARP_REPLY:
+                service = self.services.get(arp_hdr.dst_ip)
+                if service is not None and service.health is not None:
+                    service.health.report(arp_hdr.src_mac)
+                return
 
-                reply_pkt = self.formulate_arp_reply(arp_hdr.src_mac,
-                        arp_hdr.src_ip)
+            if arp_hdr.opcode != arp.ARP_REQUEST:
+                return
+
+            service = self.services.get(arp_hdr.dst_ip)
+            if service is not None:
+                reply = service.arp_reply(arp_hdr.src_mac, arp_hdr.src_ip)
 
                 actions = [ofp_parser.OFPActionOutput(in_port)]
                 out = ofp_parser.OFPPacketOut(datapath=datapath,
-                           in_port=ofp.OFPP_ANY, data=reply_pkt.data,
+                           in_port=ofp.OFPP_ANY, data=reply,
                            actions=actions, buffer_id = UINT32_MAX)
-                datapath.send_msg(out)
+                flow_writer.send_msg(datapath, out)
 
             return
 
         # Only handle IPv4 traffic going forward
-        elif eth.ethertype != ether.ETH_TYPE_IP:
+        elif headers.ethertype != ether.ETH_TYPE_IP:
             return
 
-        iphdr = pkt.get_protocols(ipv4.ipv4)[0]
+        iphdr = headers.ipv4
 
-        # Only handle traffic destined to virtual IP
-        if (iphdr.dst != self.virtual_ip):
+        # Only handle TCP traffic
+        if iphdr is None or iphdr.proto != inet.IPPROTO_TCP:
             return
 
-        # Only handle TCP traffic
-        if iphdr.proto != inet.IPPROTO_TCP:
+        service = self.services.get(iphdr.dst)
+
+        # Not for a virtual IP, but possibly a server reply punted to us
+        # by a group mode service for the return path rewrite
+        if service is None:
+            self.handle_server_reply(msg, headers, iphdr)
             return
 
-        tcphdr = pkt.get_protocols(tcp.tcp)[0]
+        # The switches balance group mode services by themselves
+        if service.mode == LB_MODE_GROUP:
+            return
 
-        valid_servers = []
-        for server in self.servers:
-            outport = self.learning_switch.get_attachment_port(dpid, server['mac'])
-            if outport != None:
-                server['outport'] = outport
-                valid_servers.append(server)
+        tcphdr = headers.tcp
+        if tcphdr is None or not service.serves_port(tcphdr.dst_port):
+            return
 
-        total_servers = len(valid_servers)
+        valid_servers = service.reachable_servers.get(dpid)
 
         # If we there are no servers with location known, then skip
-        if total_servers == 0:
+        if not valid_servers:
             return
 
-        # Round robin selection of servers
-        index = self.server_index % total_servers
-        selected_server_ip = valid_servers[index]['ip']
-        selected_server_mac = valid_servers[index]['mac']
-        selected_server_outport = valid_servers[index]['outport']
-        self.server_index += 1
-        print("Selected server %s" % selected_server_ip)
+        flow_key = (iphdr.src, iphdr.dst, iphdr.proto,
+                    tcphdr.src_port, tcphdr.dst_port)
+
+        # A client with affinity goes back to its server if that is
+        # still reachable from here, otherwise the scheduler picks anew
+        selected = None
+        if service.affinity_table is not None:
+            now = time.time()
+            affinity_key = service.affinity_key(flow_key)
+            mac = service.affinity_table.lookup(affinity_key, now)
+            index = valid_servers.position.get(mac)
+            if index is not None:
+                selected = valid_servers[index]
+
+        if selected is None:
+            selected = service.scheduler.select(dpid, valid_servers, flow_key)
+            if selected is None:
+                return
+
+            if service.affinity_table is not None:
+                service.affinity_table.record(affinity_key,
+                        selected[0]['mac'].lower(), now)
+
+        server, selected_server_outport = selected
+        selected_server_ip = server['ip']
+        selected_server_mac = server['mac']
+        LOG.debug('Selected server %s of %s for %s:%d', selected_server_ip,
+                  service.virtual_ip, iphdr.src, tcphdr.src_port)
 
         ########### Setup route to server
         match = ofp_parser.OFPMatch(in_port=in_port,
-                eth_type=eth.ethertype,  eth_src=eth.src,    eth_dst=eth.dst,
+                eth_type=headers.ethertype,  eth_src=headers.eth_src, eth_dst=headers.eth_dst,
                 ip_proto=iphdr.proto,    ipv4_src=iphdr.src, ipv4_dst=iphdr.dst,
                 tcp_src=tcphdr.src_port, tcp_dst=tcphdr.dst_port)
 
-        if self.rewrite_ip_header:
-            actions = [ofp_parser.OFPActionSetField(eth_dst=selected_server_mac),
-                       ofp_parser.OFPActionSetField(ipv4_dst=selected_server_ip),
-                       ofp_parser.OFPActionOutput(selected_server_outport) ]
-        else:
-            actions = [ofp_parser.OFPActionSetField(eth_dst=selected_server_mac),
-                       ofp_parser.OFPActionOutput(selected_server_outport) ]
-
-        inst = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        actions = service.server_actions(ofp_parser, server, selected_server_outport)
 
-        cookie = random.randint(0, 0xffffffffffffffff)
+        cookie = self.add_flow(datapath, service, LB_FLOW_PRIORITY, match,
+                actions, idle_timeout=FLOW_IDLE_TIMEOUT, buffer_id=msg.buffer_id,
+                flags=ofp.OFPFF_SEND_FLOW_REM)
 
-        mod = ofp_parser.OFPFlowMod(datapath=datapath, match=match, idle_timeout=10,
-                instructions=inst, buffer_id = msg.buffer_id, cookie=cookie)
-        datapath.send_msg(mod)
+        self.connections[cookie] = (service, server, True, dpid)
+        service.scheduler.connection_opened(server)
 
         ########### Setup reverse route from server
         match = ofp_parser.OFPMatch(in_port=selected_server_outport,
-                eth_type=eth.ethertype,  eth_src=selected_server_mac, eth_dst=eth.src,
+                eth_type=headers.ethertype,  eth_src=selected_server_mac, eth_dst=headers.eth_src,
                 ip_proto=iphdr.proto,    ipv4_src=selected_server_ip, ipv4_dst=iphdr.src,
                 tcp_src=tcphdr.dst_port, tcp_dst=tcphdr.src_port)
 
-        if self.rewrite_ip_header:
-            actions = ([ofp_parser.OFPActionSetField(eth_src=self.virtual_mac),
-                       ofp_parser.OFPActionSetField(ipv4_src=self.virtual_ip),
-                       ofp_parser.OFPActionOutput(in_port) ])
-        else:
-            actions = ([ofp_parser.OFPActionSetField(eth_src=self.virtual_mac),
-                       ofp_parser.OFPActionOutput(in_port) ])
+        actions = service.client_actions(ofp_parser, in_port)
 
-        inst = [ofp_parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, actions)]
+        cookie = self.add_flow(datapath, service, LB_FLOW_PRIORITY, match,
+                actions, idle_timeout=FLOW_IDLE_TIMEOUT,
+                flags=ofp.OFPFF_SEND_FLOW_REM)
 
-        cookie = random.randint(0, 0xffffffffffffffff)
+        self.connections[cookie] = (service, server, False, dpid)
+
+    def handle_server_reply(self, msg, headers, iphdr):
+        tcphdr = headers.tcp
+        if tcphdr is None:
+            return
+
+        reply_service = None
+        for service in self.services_by_server_mac.get(headers.eth_src, ()):
+            server = service.servers_by_mac[headers.eth_src]
+            if (service.mode == LB_MODE_GROUP and
+                    iphdr.src == service.reply_source_ip(server) and
+                    service.serves_port(tcphdr.src_port)):
+                reply_service = service
+                break
+
+        if reply_service is None:
+            return
+
+        datapath = msg.datapath
+        ofp = datapath.ofproto
+        ofp_parser = datapath.ofproto_parser
+        in_port = msg.match['in_port']
+
+        outport = self.learning_switch.get_attachment_port(datapath.id,
+                                                           headers.eth_dst)
+        if outport is None:
+            actions = reply_service.client_actions(ofp_parser, ofp.OFPP_FLOOD)
+        else:
+            actions = reply_service.client_actions(ofp_parser, outport)
+            fields = {}
+            if reply_service.ports:
+                fields['tcp_src'] = tcphdr.src_port
+            match = ofp_parser.OFPMatch(in_port=in_port,
+                    eth_type=ether.ETH_TYPE_IP, ip_proto=inet.IPPROTO_TCP,
+                    eth_src=headers.eth_src, ipv4_src=iphdr.src,
+                    ipv4_dst=iphdr.dst, **fields)
+            self.add_flow(datapath, reply_service, LB_FLOW_PRIORITY, match,
+                    actions, idle_timeout=REVERSE_IDLE_TIMEOUT,
+                    buffer_id=msg.buffer_id)
+
+            if msg.buffer_id != ofp.OFP_NO_BUFFER:
+                return
+
+        data = None
+        if msg.buffer_id == ofp.OFP_NO_BUFFER:
+            data = msg.data
+
+        out = ofp_parser.OFPPacketOut(datapath=datapath, buffer_id=msg.buffer_id,
+                                      in_port=in_port, actions=actions, data=data)
+        flow_writer.send_msg(datapath, out)
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def flow_removed_handler(self, ev):
+        msg = ev.msg
+        connection = self.connections.pop(msg.cookie, None)
+        if connection is None:
+            return
 
-        mod = ofp_parser.OFPFlowMod(datapath=datapath, match=match, idle_timeout=10,
-                instructions=inst, cookie=cookie)
-        datapath.send_msg(mod)
+        service, server, forward, _dpid = connection
+        stats = service.count_flow(server, msg)
+        if forward:
+            stats['connections'] += 1
+            service.scheduler.connection_closed(server)
@@ -29,6 +29,9 @@ from ryu.lib import ofctl_v1_0
 from ryu.lib import ofctl_v1_3
 from ryu.app.wsgi import ControllerBase, WSGIApplication
 from ryu.app.sdnhub_apps import stateless_lb, learning_switch
+from ryu.app.sdnhub_apps import lb_health
+from ryu.app.sdnhub_apps import lb_scheduler
+from ryu.app.sdnhub_apps import rest_body
 from ryu.ofproto import inet
 
 LOG = logging.getLogger('ryu.app.sdnhub_apps.stateless_lb_rest')
@@ -40,72 +43,149 @@ LOG = logging.getLogger('ryu.app.sdnhub_apps.stateless_lb_rest')
 # create loadbalancer filter
 # POST /v1.0/loadbalancer/create
 #
-# delete loadbalancer filter
-# DELETE /v1.0/loadbalancer/delete
+#  The optional "mode" is reactive (default) or group, which has the
+#  switches balance connections through an OpenFlow select group.
+#  The optional "scheduler" is one of round_robin (default),
+#  weighted_round_robin, least_connections or consistent_hash. Servers
+#  take an optional positive integer "weight" (default 1). Setting
+#  "arp_responder" to 1 has the switches answer ARP for the virtual IP
+#  themselves (needs Nicira extension support, e.g. Open vSwitch).
+#  The optional "health_check" probes the servers and takes those that
+#  stop answering out of the pool, e.g.
+#    {"method": "tcp", "port": 80, "interval": 5, "timeout": 1}
+#  "method" is arp (default) or tcp, which needs a "port". "interval"
+#  and "timeout" are in seconds; "fall" and "rise" are the number of
+#  failed or passed probes in a row that mark a server down or up.
+#  The optional "affinity" (reactive mode only) is none (default),
+#  client_ip or flow, and sends a returning client or connection to the
+#  server it used before; "affinity_timeout" (seconds) and
+#  "affinity_size" (entries) bound the table.
+#  The optional "ports" lists the TCP ports balanced (all by default).
+#  Group mode with "rewrite_ip" set needs them, to tell the replies of
+#  the servers apart from the connections they open themselves.
+#
+# delete loadbalancer filter (only the virtual_ip of the body is used)
+# POST /v1.0/loadbalancer/delete
+#
+# list all virtual IPs and their pools
+# GET /v1.0/loadbalancer/list
+#
+# delete one virtual IP
+# DELETE /v1.0/loadbalancer/{virtual_ip}
+#
+# Each virtual IP is an independent service. Creating a virtual IP that
+# already exists replaces its configuration.
 #
 
-import re, socket
-
-def is_mac_valid(x):
-    if re.match("[0-9a-f]{2}([-:])[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$", x.lower()):
-        return True
-    else:
-        return False
+# Bodies of the POST requests are JSON, e.g.
+#   {"virtual_ip": "10.0.0.100", "rewrite_ip": 1,
+#    "servers": [{"ip": "10.0.0.1", "mac": "00:00:00:00:00:01"}]}
+# and are rejected with a 4xx and a JSON error message when malformed.
+#
 
-def is_ip_valid(x):
-    y = x.split('/')
-    if len(y) > 2:
-        return False
-    try:
-        socket.inet_aton(y[0])
-        return True
-    except socket.error:
-       return False
+HEALTH_CHECK = rest_body.obj({
+    'method': rest_body.one_of(lb_health.HEALTH_CHECK_ARP,
+                               lb_health.HEALTH_CHECK_TCP),
+    'port': rest_body.integer(1, 65535),
+    'interval': rest_body.positive_number(),
+    'timeout': rest_body.positive_number(),
+    'fall': rest_body.integer(1),
+    'rise': rest_body.integer(1),
+})
+
+LB_SERVER = rest_body.obj({
+    'ip': rest_body.ADDRESS,
+    'mac': rest_body.MAC,
+    'weight': rest_body.integer(1),
+}, required=('ip', 'mac'))
+
+LB_CONFIG = rest_body.obj({
+    'virtual_ip': rest_body.ADDRESS,
+    'virtual_mac': rest_body.MAC,
+    'servers': rest_body.array(LB_SERVER),
+    'rewrite_ip': rest_body.one_of(0, 1),
+    'arp_responder': rest_body.one_of(0, 1),
+    'scheduler': rest_body.one_of(*lb_scheduler.SCHEDULERS),
+    'mode': rest_body.one_of(stateless_lb.LB_MODE_REACTIVE,
+                             stateless_lb.LB_MODE_GROUP),
+    'health_check': HEALTH_CHECK,
+    'affinity': rest_body.one_of(stateless_lb.AFFINITY_NONE,
+                                 stateless_lb.AFFINITY_CLIENT_IP,
+                                 stateless_lb.AFFINITY_FLOW),
+    'affinity_timeout': rest_body.integer(1),
+    'affinity_size': rest_body.integer(1),
+    'ports': rest_body.array(rest_body.integer(1, 65535)),
+}, required=('virtual_ip', 'servers'))
+
+LB_DELETE = rest_body.obj({
+    'virtual_ip': rest_body.ADDRESS,
+}, required=('virtual_ip',))
 
 class StatelessLBController(ControllerBase):
     def __init__(self, req, link, data, **config):
         super(StatelessLBController, self).__init__(req, link, data, **config)
         self.stateless_lb = data['stateless_lb']
-        self.stateless_lb.set_learning_switch(data['learning_switch'])
-
-    def is_config_data_valid(self, lb_config):
-        if not is_ip_valid(lb_config['virtual_ip']):
-            return False
-        for server in lb_config['servers']:
-            if not is_ip_valid(server['ip']) or not is_mac_valid(server['mac']):
-                return False
-        return True
 
     def create_loadbalancer(self, req, **_kwargs):
         try:
-            lb_config = eval(req.body)
-            if not self.is_config_data_valid(lb_config):
-                return Response(status=400)
+            lb_config = rest_body.parse_body(req, LB_CONFIG)
+            health_check = lb_config.get('health_check')
+            if health_check is not None and 'port' not in health_check and \
+                    health_check.get('method') == lb_health.HEALTH_CHECK_TCP:
+                raise rest_body.BodyError('body.health_check.port is missing')
+            if lb_config.get('mode') == stateless_lb.LB_MODE_GROUP and \
+                    lb_config.get('rewrite_ip', 1) == 1 and not lb_config.get('ports'):
+                raise rest_body.BodyError('body.ports is needed in group mode '
+                                          'with rewrite_ip')
+        except rest_body.BodyError as err:
+            LOG.error('Invalid loadbalancer config: %s', err.message)
+            return rest_body.error_response(err)
 
-            self.stateless_lb.set_virtual_ip(lb_config['virtual_ip'])
-            self.stateless_lb.set_server_pool(lb_config['servers'])
-            self.stateless_lb.set_rewrite_ip_flag(lb_config['rewrite_ip'])
-
-        except SyntaxError:
-            LOG.error('Invalid syntax %s', req.body)
-            return Response(status=400)
+        try:
+            service = self.stateless_lb.add_service(lb_config['virtual_ip'],
+                    lb_config['servers'],
+                    rewrite_ip=(lb_config.get('rewrite_ip', 1) == 1),
+                    scheduler=lb_config.get('scheduler', lb_scheduler.ROUND_ROBIN),
+                    mode=lb_config.get('mode', stateless_lb.LB_MODE_REACTIVE),
+                    virtual_mac=lb_config.get('virtual_mac'),
+                    arp_responder=(lb_config.get('arp_responder', 0) == 1),
+                    health_check=health_check,
+                    affinity=lb_config.get('affinity', stateless_lb.AFFINITY_NONE),
+                    affinity_timeout=lb_config.get('affinity_timeout',
+                            stateless_lb.DEFAULT_AFFINITY_TIMEOUT),
+                    affinity_size=lb_config.get('affinity_size',
+                            stateless_lb.DEFAULT_AFFINITY_SIZE),
+                    ports=lb_config.get('ports'))
+        except ValueError as err:
+            LOG.error('Invalid loadbalancer config: %s', err)
+            return rest_body.error_response(rest_body.BodyError(str(err)))
+
+        if service is None:
+            return Response(status=503)
 
         return Response(status=200,content_type='application/json',
                     body=json.dumps({'status':'success'}))
 
     def delete_loadbalancer(self, req, **_kwargs):
         try:
-            lb_config = eval(req.body)
-            print(lb_config)
-            if not self.is_config_data_valid(lb_config):
-                return Response(status=400)
+            lb_config = rest_body.parse_body(req, LB_DELETE)
+        except rest_body.BodyError as err:
+            LOG.error('Invalid loadbalancer config: %s', err.message)
+            return rest_body.error_response(err)
 
-            self.stateless_lb.set_virtual_ip()
-            self.stateless_lb.set_server_pool()
+        if not self.stateless_lb.remove_service(lb_config['virtual_ip']):
+            return Response(status=404)
 
-        except SyntaxError:
-            LOG.error('Invalid syntax %s', req.body)
-            return Response(status=400)
+        return Response(status=200,content_type='application/json',
+                    body=json.dumps({'status':'success'}))
+
+    def list_loadbalancers(self, req, **_kwargs):
+        return Response(status=200,content_type='application/json',
+                    body=json.dumps(self.stateless_lb.get_services()))
+
+    def delete_virtual_ip(self, req, virtual_ip, **_kwargs):
+        if not self.stateless_lb.remove_service(virtual_ip):
+            return Response(status=404)
 
         return Response(status=200,content_type='application/json',
                     body=json.dumps({'status':'success'}))
@@ -131,6 +211,8 @@ class StatelessLBRestApi(app_manager.RyuApp):
         self.data['stateless_lb'] = stateless_lb
         self.data['learning_switch'] = learning_switch
 
+        stateless_lb.set_learning_switch(learning_switch)
+
         wsgi.registory['StatelessLBController'] = self.data
         mapper = wsgi.mapper
 
@@ -141,3 +223,11 @@ class StatelessLBRestApi(app_manager.RyuApp):
         mapper.connect('loadbalancer', '/v1.0/loadbalancer/delete',
                        controller=StatelessLBController, action='delete_loadbalancer',
                        conditions=dict(method=['POST']))
+
+        mapper.connect('loadbalancer', '/v1.0/loadbalancer/list',
+                       controller=StatelessLBController, action='list_loadbalancers',
+                       conditions=dict(method=['GET']))
+
+        mapper.connect('loadbalancer', '/v1.0/loadbalancer/{virtual_ip}',
+                       controller=StatelessLBController, action='delete_virtual_ip',
+                       conditions=dict(method=['DELETE']))
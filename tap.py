@@ -13,14 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import copy
+import itertools
+import json
 import logging
-import struct
-import random
 import ryu.utils
 
 from ryu.base import app_manager
 from ryu.topology import event as topo_event
-from ryu.controller import mac_to_port
 from ryu.controller import ofp_event
 from ryu.controller.handler import HANDSHAKE_DISPATCHER
 from ryu.controller.handler import CONFIG_DISPATCHER
@@ -28,18 +29,77 @@ from ryu.controller.handler import MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.lib import ofctl_v1_3
-from ryu.lib.mac import haddr_to_bin
-from ryu.lib.packet import packet
-from ryu.lib.packet import ethernet
-from ryu.lib.packet import ipv4
+from ryu.lib import dpid as dpid_lib
 
 from ryu.ofproto import ether
-from ryu.controller import dpset
 
-import networkx as nx
+from ryu.app.sdnhub_apps import cookie_allocator
+from ryu.app.sdnhub_apps import flow_writer
+from ryu.app.sdnhub_apps import path_engine
 
 LOG = logging.getLogger('ryu.app.sdnhub_apps.tap')
 
+# Barriers asked of flow_writer are answered through its own app
+app_manager.require_app('ryu.app.sdnhub_apps.flow_writer')
+
+# A port mirrored to several sinks on a switch goes through an ALL group
+# holding one bucket per sink. Group ids are carved out of their own
+# range, per tap id and then per sink set on the switch. A tap gets at
+# most MAX_TAP_GROUPS groups on a switch, past which its group ids would
+# run into those of the next tap.
+TAP_GROUP_ID_BASE = cookie_allocator.APP_TAP << 24
+TAP_GROUP_ID_SHIFT = 12
+MAX_TAP_GROUPS = 1 << TAP_GROUP_ID_SHIFT
+
+# Taps can be made safe to leave on. A "rate_limit" of {"pps": n} or
+# {"kbps": n} puts a meter, numbered after the tap, in front of the
+# mirrored traffic, dropping whatever goes over the rate. A "sample" of n
+# sends one in n through a select group whose other buckets are empty.
+# Switches pick a select bucket per flow, not per packet, so this samples
+# flows. Both apply where the traffic enters the tap, at the source
+# switches.
+RATE_LIMIT_UNITS = ('pps', 'kbps')
+
+# Traffic mirrored across switches is tagged at the source switch with a
+# VLAN numbered after the tap, and popped at the sink switch. The other
+# hops match the tag rather than the filter, so they only ever pick up
+# the mirrored copies, not production traffic that happens to match the
+# filter on the same links. Tagged hops take precedence over the filters
+# of taps sniffing on all ports. Tap ids are capped to the valid VLAN ids.
+MAX_TAP_ID = min(cookie_allocator.MAX_INSTANCE, 4094)
+TAP_FLOW_PRIORITY = ofproto_v1_3.OFP_DEFAULT_PRIORITY
+TAP_TAGGED_FLOW_PRIORITY = TAP_FLOW_PRIORITY + 1
+
+# Expands the broadened fields of a filter (dl_host, nw_host, tp_port)
+# into the exact matches to program: one per combination of the concrete
+# fields each stands for, without duplicates. The given fields are left
+# untouched.
+def expand_fields(fields, broadened_field):
+    choices = []
+    for key in sorted(fields):
+        if key in broadened_field:
+            choices.append([(new_key, fields[key]) for new_key in broadened_field[key]])
+        else:
+            choices.append([(key, fields[key])])
+
+    matches = []
+    seen = set()
+    for combination in itertools.product(*choices):
+        match = dict(combination)
+
+        # Two broadened fields can land on the same concrete field, and
+        # then only the combinations that agree on its value make sense
+        if len(set(combination)) != len(match):
+            continue
+
+        key = frozenset(match.items())
+        if key not in seen:
+            seen.add(key)
+            matches.append(match)
+
+    return matches
+
+
 class StarterTap(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
@@ -49,7 +109,23 @@ class StarterTap(app_manager.RyuApp):
         self.broadened_field = {'dl_host': ['dl_src', 'dl_dst'],
                                 'nw_host': ['nw_src', 'nw_dst'],
                                 'tp_port': ['tp_src', 'tp_dst']}
+        self.cookies = cookie_allocator.CookieAllocator(cookie_allocator.APP_TAP)
+        self.paths = path_engine.ShortestPathCache()
+
+        # Tap id -> tap, and normalized filter -> tap id
+        self.taps = {}
+        self.tap_ids = {}
+        self.free_tap_ids = []
+        self.next_tap_id = 1
 
+    def close(self):
+        dpset = getattr(self, 'dpset', None)
+        if dpset is None:
+            return
+
+        for _dpid, datapath in dpset.get_all():
+            self.cookies.delete_flows(datapath)
+            flow_writer.flush(datapath)
 
     @set_ev_cls(ofp_event.EventOFPErrorMsg, [HANDSHAKE_DISPATCHER, CONFIG_DISPATCHER, MAIN_DISPATCHER])
     def error_msg_handler(self, ev):
@@ -62,46 +138,134 @@ class StarterTap(app_manager.RyuApp):
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
-        ofproto = datapath.ofproto
-        ofproto_parser = datapath.ofproto_parser
 
-        # Delete all existing rules on the switch
-        mod = ofproto_parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE,
-                             out_port=ofproto.OFPP_ANY,out_group=ofproto.OFPG_ANY)
-        datapath.send_msg(mod)
-
-
-    def change_field(self, old_attrs, original, new):
-        new_attrs = {}
-        for key, val in old_attrs.items():
-            if (key == original):
-                new_attrs[new] = val
-            else:
-                new_attrs[key] = val
-        return new_attrs
+        # Delete all tap rules left on the switch by a previous run, ahead
+        # of any tap programmed later
+        self.cookies.delete_flows(datapath)
+        flow_writer.flush(datapath, barrier=True)
+
+    @set_ev_cls(topo_event.EventSwitchEnter)
+    def switch_enter_handler(self, ev):
+        self.paths.add_switch(ev.switch.dp.id)
+
+    @set_ev_cls(topo_event.EventSwitchLeave)
+    def switch_leave_handler(self, ev):
+        self.paths.remove_switch(ev.switch.dp.id)
+
+    @set_ev_cls(topo_event.EventLinkAdd)
+    def link_add_handler(self, ev):
+        link = ev.link
+        self.paths.add_link(link.src.dpid, link.src.port_no,
+                            link.dst.dpid, link.dst.port_no)
+
+    @set_ev_cls(topo_event.EventLinkDelete)
+    def link_delete_handler(self, ev):
+        link = ev.link
+        self.paths.remove_link(link.src.dpid, link.dst.dpid)
+
+
+    def get_taps(self):
+        return [self.tap_to_dict(tap) for tap in self.taps.values()]
+
+    def tap_to_dict(self, tap):
+        flows = {}
+        for dpid, cookies in tap['flows'].items():
+            flows[dpid_lib.dpid_to_str(dpid)] = len(cookies)
+        groups = {}
+        for dpid, sink_groups in tap['groups'].items():
+            groups[dpid_lib.dpid_to_str(dpid)] = len(sink_groups)
+        return {'id': tap['id'], 'filter': tap['filter'], 'flows': flows,
+                'groups': groups,
+                'meters': [dpid_lib.dpid_to_str(dpid) for dpid in tap['meters']]}
+
+    # Filters that only differ in the order of their sources and sinks,
+    # or in extra attributes of those, are the same tap
+    def tap_key(self, filter_data):
+        def endpoints(points):
+            return sorted(json.dumps([point['dpid'], point['port_no']])
+                          for point in points)
+
+        return json.dumps({'sources': endpoints(filter_data['sources']),
+                           'sinks': endpoints(filter_data['sinks']),
+                           'fields': filter_data.get('fields', {})},
+                          sort_keys=True)
+
+    def allocate_tap_id(self):
+        if self.free_tap_ids:
+            return self.free_tap_ids.pop()
+
+        if self.next_tap_id > MAX_TAP_ID:
+            return None
+
+        tap_id = self.next_tap_id
+        self.next_tap_id += 1
+        return tap_id
 
     def create_tap(self, filter_data):
         LOG.debug("Creating tap with filter = %s", str(filter_data))
 
-        # If dl_host, nw_host or tp_port are used, the recursively call the individual filters.
-        # This causes the match to expand and more rules to be programmed.
-        result = True
         filter_data.setdefault('fields', {})
-        filter_fields = filter_data['fields']
-
-        for key, val in self.broadened_field.items():
-            if key in filter_fields:
-                for new_val in val:
-                    filter_data['fields'] = self.change_field(filter_fields, key, new_val)
-                    result = result and self.create_tap(filter_data)
-
-                return result
+        key = self.tap_key(filter_data)
+
+        # Checked before anything is programmed, so that a bad unit cannot
+        # leave part of the tap behind
+        rate_limit = filter_data.get('rate_limit')
+        if rate_limit and (len(rate_limit) != 1 or
+                           not set(rate_limit) <= set(RATE_LIMIT_UNITS)):
+            LOG.error("Invalid rate limit %s", str(rate_limit))
+            return False
+
+        # Resubmitting a filter that is already in place changes nothing,
+        # unless its rate limit or sampling changed
+        tap_id = self.tap_ids.get(key)
+        if tap_id is not None:
+            old_filter = self.taps[tap_id]['filter']
+            if (old_filter.get('rate_limit') == filter_data.get('rate_limit') and
+                    old_filter.get('sample', 1) == filter_data.get('sample', 1)):
+                LOG.debug("Tap %d already exists", tap_id)
+                return True
+
+            self.delete_tap_by_id(tap_id)
+
+        tap_id = self.allocate_tap_id()
+        if tap_id is None:
+            LOG.error("Out of tap ids")
+            return False
+
+        # Every flow of the tap carries its id in the cookie, so it can be
+        # removed with one masked delete per switch
+        tap = {'id': tap_id, 'key': key, 'filter': copy.deepcopy(filter_data),
+               'cookies': self.cookies.for_instance(tap_id), 'flows': {},
+               'groups': {}, 'meters': set()}
+
+        try:
+            programmed = self.program_tap(tap, filter_data)
+        except ValueError as err:
+            LOG.error("Cannot program tap %d: %s", tap_id, err)
+            programmed = False
+
+        if not programmed:
+            self.remove_tap_flows(tap)
+            self.free_tap_ids.append(tap_id)
+            return False
+
+        self.taps[tap_id] = tap
+        self.tap_ids[key] = tap_id
+
+        LOG.info("Created tap %d with filter = %s", tap_id, str(tap['filter']))
+        return True
 
-        # If match fields are exact, then proceed programming switches
+    def program_tap(self, tap, filter_data):
+        # If dl_host, nw_host or tp_port are used, the match expands to
+        # the individual fields and more rules are to be programmed
+        matches = expand_fields(filter_data['fields'], self.broadened_field)
 
         # Iterate over all the sources and sinks, and collect the individual
         # hop information. It is possible that a switch is both a source,
-        # a sink and an intermediate hop.
+        # a sink and an intermediate hop. Hops are told apart by whether
+        # the traffic comes in tagged, and each out port records whether
+        # the traffic leaves tagged, that is towards another switch.
+        hops_by_dpid = collections.OrderedDict()
         for source in filter_data['sources']:
             for sink in filter_data['sinks']:
 
@@ -109,89 +273,235 @@ class StarterTap(app_manager.RyuApp):
                 if source == sink:
                     continue
 
-                # In basic version, source and sink are same switch
-                if source['dpid'] != sink['dpid']:
-                    LOG.debug("Mismatching source and sink switch")
+                hops = self.paths.hops(source['dpid'], source['port_no'],
+                                       sink['dpid'], sink['port_no'])
+                if hops is None:
+                    LOG.debug("No path from switch %s to switch %s",
+                              str(source['dpid']), str(sink['dpid']))
                     return False
 
-                datapath = self.dpset.get(source['dpid'])
+                last = len(hops) - 1
+                for index, (dpid, in_port, out_port) in enumerate(hops):
+                    ports = hops_by_dpid.setdefault(dpid, collections.OrderedDict())
+                    out_ports = ports.setdefault((in_port, index > 0),
+                                                 collections.OrderedDict())
+                    out_ports.setdefault(out_port, index < last)
+
+        # Then program each switch in one go. Untagged traffic is matched
+        # against the filter on the source port, tagged traffic against
+        # the tag of the tap on the port the previous hop sent to. A port
+        # with several out ports gets one flow per match to an ALL group
+        # rather than one flow per out port, which would only overwrite
+        # each other.
+        vlan_vid = tap['id']
+        for dpid, ports in hops_by_dpid.items():
+            datapath = self.dpset.get(dpid)
 
-                # If dpid is invalid, return
-                if datapath is None:
-                    LOG.debug("Unable to get datapath for id = %s", str(source['dpid']))
-                    return False
+            # If dpid is invalid, return
+            if datapath is None:
+                LOG.debug("Unable to get datapath for id = %s", str(dpid))
+                return False
 
-                ofproto = datapath.ofproto
-                ofproto_parser = datapath.ofproto_parser
+            ofproto = datapath.ofproto
+            ofproto_parser = datapath.ofproto_parser
+            cookies = tap['flows'].setdefault(dpid, [])
+            for (in_port, tagged), out_ports in ports.items():
+                sinks = tuple(sorted(out_ports.items()))
+                port_actions = [self.hop_actions(datapath, vlan_vid, tagged,
+                                                 out_port, tagged_out)
+                                for out_port, tagged_out in sinks]
+                if len(sinks) == 1:
+                    actions = port_actions[0]
+                else:
+                    buckets = [ofproto_parser.OFPBucket(actions=bucket_actions)
+                               for bucket_actions in port_actions]
+                    group_id = self.program_group(datapath, tap, (tagged, sinks),
+                                                  ofproto.OFPGT_ALL, buckets)
+                    actions = [ofproto_parser.OFPActionGroup(group_id)]
+
+                if tagged:
+                    cookies.append(self.program_hop(datapath, tap['cookies'],
+                            {'dl_vlan': vlan_vid}, in_port, actions,
+                            priority=TAP_TAGGED_FLOW_PRIORITY))
+                    continue
 
-                in_port = source['port_no']
-                out_port = sink['port_no']
-                filter_fields = filter_data['fields'].copy()
+                # The traffic enters the tap here, and is limited here
+                meter_id = None
+                sample = filter_data.get('sample', 1)
+                if sample > 1:
+                    buckets = [ofproto_parser.OFPBucket(weight=1, actions=actions),
+                               ofproto_parser.OFPBucket(weight=sample - 1, actions=[])]
+                    group_id = self.program_group(datapath, tap,
+                            ('sample', sinks), ofproto.OFPGT_SELECT, buckets)
+                    actions = [ofproto_parser.OFPActionGroup(group_id)]
+
+                if filter_data.get('rate_limit'):
+                    meter_id = self.program_meter(datapath, tap,
+                                                  filter_data['rate_limit'])
+
+                for fields in matches:
+                    cookies.append(self.program_hop(datapath, tap['cookies'],
+                            fields, in_port, actions, meter_id))
+            flow_writer.flush(datapath)
 
-                ######## Create action list
-                actions = [ofproto_parser.OFPActionOutput(out_port)]
+        return True
 
-                ######## Create match
-                if in_port != 'all':  # If not sniffing on all in_ports
-                    filter_fields['in_port'] = in_port
-                match = ofctl_v1_3.to_match(datapath, filter_fields)
+    def hop_actions(self, datapath, vlan_vid, tagged_in, out_port, tagged_out):
+        ofproto = datapath.ofproto
+        ofproto_parser = datapath.ofproto_parser
+
+        actions = []
+        if tagged_out and not tagged_in:
+            actions.append(ofproto_parser.OFPActionPushVlan(ether.ETH_TYPE_8021Q))
+            actions.append(ofproto_parser.OFPActionSetField(
+                    vlan_vid=(ofproto.OFPVID_PRESENT | vlan_vid)))
+        elif tagged_in and not tagged_out:
+            actions.append(ofproto_parser.OFPActionPopVlan())
+        actions.append(ofproto_parser.OFPActionOutput(out_port))
+        return actions
+
+    def program_group(self, datapath, tap, key, group_type, buckets):
+        ofproto = datapath.ofproto
+        ofproto_parser = datapath.ofproto_parser
 
-                ######## Cookie might come handy
-                cookie = random.randint(0, 0xffffffffffffffff)
+        sink_groups = tap['groups'].setdefault(datapath.id, {})
+        group_id = sink_groups.get(key)
+        if group_id is not None:
+            return group_id
 
-                inst = [ofproto_parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if len(sink_groups) >= MAX_TAP_GROUPS:
+            raise ValueError("tap %d needs more than %d groups on switch %x" %
+                             (tap['id'], MAX_TAP_GROUPS, datapath.id))
 
-                # install the flow in the switch
-                mod = ofproto_parser.OFPFlowMod(
-                            datapath=datapath, match=match,
-                            command=ofproto.OFPFC_ADD, idle_timeout=0, hard_timeout=0,
-                            instructions=inst, cookie=cookie)
+        group_id = (TAP_GROUP_ID_BASE | tap['id'] << TAP_GROUP_ID_SHIFT |
+                    len(sink_groups))
+        sink_groups[key] = group_id
 
-                datapath.send_msg(mod)
+        # Clear out a group a previous run may have left behind
+        self.delete_group(datapath, group_id)
+        mod = ofproto_parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD,
+                                         group_type, group_id, buckets)
+        flow_writer.send_msg(datapath, mod)
 
-                LOG.debug("Flow inserted to switch %x: cookie=%s, out_port=%d, match=%s",
-                                  datapath.id, str(cookie), out_port, str(filter_fields))
+        LOG.debug("Group %x inserted to switch %x: key=%s",
+                          group_id, datapath.id, str(key))
+        return group_id
 
-        LOG.info("Created tap with filter = %s", str(filter_data))
-        return True
+    def program_meter(self, datapath, tap, rate_limit):
+        ofproto = datapath.ofproto
+        ofproto_parser = datapath.ofproto_parser
 
+        meter_id = tap['id']
+        if datapath.id in tap['meters']:
+            return meter_id
+
+        tap['meters'].add(datapath.id)
+        if 'pps' in rate_limit:
+            flags = ofproto.OFPMF_PKTPS
+            rate = rate_limit['pps']
+        else:
+            flags = ofproto.OFPMF_KBPS
+            rate = rate_limit['kbps']
+
+        # Clear out a meter a previous run may have left behind
+        self.delete_meter(datapath, meter_id)
+        bands = [ofproto_parser.OFPMeterBandDrop(rate=rate, burst_size=0)]
+        mod = ofproto_parser.OFPMeterMod(datapath, command=ofproto.OFPMC_ADD,
+                                         flags=flags, meter_id=meter_id, bands=bands)
+        flow_writer.send_msg(datapath, mod)
+
+        LOG.debug("Meter %d inserted to switch %x: rate_limit=%s",
+                          meter_id, datapath.id, str(rate_limit))
+        return meter_id
+
+    def delete_meter(self, datapath, meter_id):
+        ofproto = datapath.ofproto
+        ofproto_parser = datapath.ofproto_parser
 
-    def delete_tap(self, filter_data):
-        LOG.debug("Deleting tap with filter %s", str(filter_data))
+        mod = ofproto_parser.OFPMeterMod(datapath, command=ofproto.OFPMC_DELETE,
+                                         flags=0, meter_id=meter_id)
+        flow_writer.send_msg(datapath, mod)
 
-        # If dl_host, nw_host or tp_port are used, the recursively call the individual filters.
-        # This causes the match to expand and more rules to be programmed.
-        filter_data.setdefault('fields', {})
-        filter_fields = filter_data['fields']
+    def delete_group(self, datapath, group_id):
+        ofproto = datapath.ofproto
+        ofproto_parser = datapath.ofproto_parser
 
-        for key, val in self.broadened_field.items():
-            if key in filter_fields:
+        mod = ofproto_parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE,
+                                         ofproto.OFPGT_ALL, group_id)
+        flow_writer.send_msg(datapath, mod)
 
-                for new_val in val:
-                    filter_data['fields'] = self.change_field(filter_fields, key, new_val)
-                    self.delete_tap(filter_data)
+    def program_hop(self, datapath, cookies, fields, in_port, actions, meter_id=None,
+                    priority=TAP_FLOW_PRIORITY):
+        ofproto = datapath.ofproto
+        ofproto_parser = datapath.ofproto_parser
 
-                return
+        filter_fields = fields.copy()
+
+        ######## Create match
+        if in_port != 'all':  # If not sniffing on all in_ports
+            filter_fields['in_port'] = in_port
+        match = ofctl_v1_3.to_match(datapath, filter_fields)
+
+        ######## Cookie identifies the flow as ours
+        cookie = cookies.next_cookie()
+
+        inst = [ofproto_parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        if meter_id is not None:
+            inst.insert(0, ofproto_parser.OFPInstructionMeter(meter_id))
+
+        # install the flow in the switch
+        mod = ofproto_parser.OFPFlowMod(
+                    datapath=datapath, match=match, priority=priority,
+                    command=ofproto.OFPFC_ADD, idle_timeout=0, hard_timeout=0,
+                    instructions=inst, cookie=cookie)
+
+        flow_writer.send_msg(datapath, mod)
+
+        LOG.debug("Flow inserted to switch %x: cookie=%s, actions=%s, match=%s",
+                          datapath.id, str(cookie), str(actions), str(filter_fields))
+        return cookie
+
+    def remove_tap_flows(self, tap):
+        cookies = tap['cookies']
+        for dpid in tap['flows']:
+            datapath = self.dpset.get(dpid)
+            if datapath is not None:
+                cookies.delete_flows(datapath, cookies.instance_match())
+        tap['flows'] = {}
+
+        for dpid, sink_groups in tap['groups'].items():
+            datapath = self.dpset.get(dpid)
+            if datapath is not None:
+                for group_id in sink_groups.values():
+                    self.delete_group(datapath, group_id)
+        tap['groups'] = {}
+
+        for dpid in tap['meters']:
+            datapath = self.dpset.get(dpid)
+            if datapath is not None:
+                self.delete_meter(datapath, tap['id'])
+        tap['meters'] = set()
 
-        # If match fields are exact, then proceed programming switches
-        for source in filter_data['sources']:
-            in_port = source['port_no']
-            filter_fields = filter_data['fields'].copy()
-            if in_port != 'all':  # If not sniffing on all in_ports
-                filter_fields['in_port'] = in_port
+    def delete_tap(self, filter_data):
+        LOG.debug("Deleting tap with filter %s", str(filter_data))
 
-            datapath = self.dpset.get(source['dpid'])
+        filter_data.setdefault('fields', {})
+        tap_id = self.tap_ids.get(self.tap_key(filter_data))
 
-            # If dpid is invalid, return
-            if datapath is None:
-                continue
+        # Deleting a tap that is not there is not an error
+        if tap_id is None:
+            return False
 
-            ofproto = datapath.ofproto
-            ofproto_parser = datapath.ofproto_parser
+        return self.delete_tap_by_id(tap_id)
 
-            match = ofctl_v1_3.to_match(datapath, filter_fields)
+    def delete_tap_by_id(self, tap_id):
+        tap = self.taps.pop(tap_id, None)
+        if tap is None:
+            return False
 
-            mod = ofproto_parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE,
-                          match = match, out_port=ofproto.OFPP_ANY,out_group=ofproto.OFPG_ANY)
+        del self.tap_ids[tap['key']]
+        self.remove_tap_flows(tap)
+        self.free_tap_ids.append(tap_id)
 
-            datapath.send_msg(mod)
+        LOG.info("Deleted tap %d", tap_id)
+        return True
@@ -29,6 +29,7 @@ from ryu.lib import ofctl_v1_0
 from ryu.lib import ofctl_v1_3
 from ryu.app.wsgi import ControllerBase, WSGIApplication
 from ryu.app.sdnhub_apps import tap
+from ryu.app.sdnhub_apps import rest_body
 from ryu.ofproto import inet
 
 LOG = logging.getLogger('ryu.app.sdnhub_apps.tap_rest')
@@ -38,31 +39,59 @@ LOG = logging.getLogger('ryu.app.sdnhub_apps.tap_rest')
 ############# Configure tap
 #
 # get all taps
-# GET /tap
+# GET /v1.0/tap
 #
 # create tap filter
 # POST /v1.0/tap/create
 #
 # delete tap filter
-# DELETE /v1.0/tap/delete
+# POST /v1.0/tap/delete
+#
+# delete tap by the id returned by the listing
+# DELETE /v1.0/tap/{tap_id}
+#
+# Taps are identified by their filter, regardless of the order of the
+# sources and sinks. Creating a tap that exists or deleting one that
+# does not is a no-op.
+#
+# A filter can also limit the mirrored traffic, with an optional
+# "rate_limit" of {"pps": n} or {"kbps": n}, and an optional "sample"
+# of n to mirror one flow in n.
+#
+
+# Bodies of the POST requests are JSON, e.g.
+#   {"sources": [{"dpid": 1, "port_no": 1}],
+#    "sinks": [{"dpid": 2, "port_no": 3}],
+#    "fields": {"dl_type": 2048, "nw_src": "10.0.0.1"}}
+# and are rejected with a 4xx and a JSON error message when malformed.
 #
 
-import re, socket
-def is_mac_valid(x):
-    if re.match("[0-9a-f]{2}([-:])[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$", x.lower()):
-        return True
-    else:
-        return False
-
-def is_ip_valid(x):
-    y = x.split('/')
-    if len(y) > 2:
-        return False
-    try:
-        socket.inet_aton(y[0])
-        return True
-    except socket.error:
-       return False
+TAP_POINT = rest_body.obj({
+    'dpid': rest_body.integer(0),
+    'port_no': rest_body.any_of(rest_body.integer(0), rest_body.one_of('all')),
+}, required=('dpid', 'port_no'))
+
+TAP_FILTER = rest_body.obj({
+    'sources': rest_body.array(TAP_POINT),
+    'sinks': rest_body.array(TAP_POINT),
+    'fields': rest_body.obj({
+        'dl_src': rest_body.MAC,
+        'dl_dst': rest_body.MAC,
+        'dl_host': rest_body.MAC,
+        'dl_type': rest_body.integer(0, 0xffff),
+        'nw_src': rest_body.IP,
+        'nw_dst': rest_body.IP,
+        'nw_host': rest_body.IP,
+        'nw_proto': rest_body.integer(0, 0xff),
+        'tp_src': rest_body.integer(0, 0xffff),
+        'tp_dst': rest_body.integer(0, 0xffff),
+        'tp_port': rest_body.integer(0, 0xffff),
+    }),
+    'rate_limit': rest_body.obj(dict((unit, rest_body.integer(1))
+                                     for unit in tap.RATE_LIMIT_UNITS),
+                                closed=True),
+    'sample': rest_body.integer(1),
+}, required=('sources', 'sinks'))
 
 class TapController(ControllerBase):
     def __init__(self, req, link, data, **config):
@@ -70,55 +99,32 @@ class TapController(ControllerBase):
         self.tap = data['tap']
         self.tap.dpset = data['dpset']
 
+    # Checks across fields, on top of the TAP_FILTER schema
     def is_filter_data_valid(self, filter_data):
-        if 'sources' not in filter_data:
-            LOG.error('missing sources %s', filter_data)
-            return False
-        else:
-            for source in filter_data['sources']:
-                if 'dpid' not in source or 'port_no' not in source:
-                    LOG.error('Invalid source description %s', source)
-                    return False
-
-        if 'sinks' not in filter_data:
-            LOG.error('missing sinks %s', filter_data)
-            return False
-        else:
-            for sink in filter_data['sinks']:
-                if 'dpid' not in sink or 'port_no' not in sink:
-                    LOG.error('Invalid source description %s', sink)
-                    return False
-
-        if 'fields' in filter_data:
-            for key, val in filter_data['fields'].items():
-                if key == 'dl_src' or key == 'dl_dst' or key == 'dl_host':
-                    if not is_mac_valid(val):
-                        LOG.error('Invalid MAC address in filter field %s=%s', key, val)
-                        return False
-                if key == 'nw_src' or key == 'nw_dst' or key == 'nw_host':
-                    if 'dl_type' not in filter_data['fields']:
-                        LOG.error('Ethertype is not set, but IP fields specified')
-                        return False
-                    if not is_ip_valid(val):
-                        LOG.error('Invalid IP address in filter field %s=%s', key, val)
-                        return False
-                if key == 'tp_src' or key == 'tp_dst' or key == 'tp_port':
-                    nw_proto = filter_data['fields']['nw_proto']
-                    if nw_proto != inet.IPPROTO_TCP and nw_proto != inet.IPPROTO_UDP:
-                        LOG.error('Non TCP/UDP packet specifies TP fields')
-                        return False
-
-        return True
+        rate_limit = filter_data.get('rate_limit')
+        if rate_limit is not None and len(rate_limit) != 1:
+            raise rest_body.BodyError('body.rate_limit must have one of %s' %
+                                      ', '.join(tap.RATE_LIMIT_UNITS))
+
+        fields = filter_data.get('fields', {})
+        for key in fields:
+            if key in ('nw_src', 'nw_dst', 'nw_host') and 'dl_type' not in fields:
+                raise rest_body.BodyError('Ethertype is not set, but IP fields specified')
+            if key in ('tp_src', 'tp_dst', 'tp_port') and \
+                    fields.get('nw_proto') not in (inet.IPPROTO_TCP, inet.IPPROTO_UDP):
+                raise rest_body.BodyError('Non TCP/UDP packet specifies TP fields')
+
+    def parse_filter(self, req):
+        filter_data = rest_body.parse_body(req, TAP_FILTER)
+        self.is_filter_data_valid(filter_data)
+        return filter_data
 
     def create_tap(self, req, **_kwargs):
         try:
-            filter_data = eval(req.body)
-            print(filter_data)
-            if not self.is_filter_data_valid(filter_data):
-                return Response(status=400)
-        except SyntaxError:
-            LOG.error('Invalid syntax %s', req.body)
-            return Response(status=400)
+            filter_data = self.parse_filter(req)
+        except rest_body.BodyError as err:
+            LOG.error('Invalid tap filter: %s', err.message)
+            return rest_body.error_response(err)
 
         if self.tap.create_tap(filter_data):
             return Response(status=200,content_type='application/json',
@@ -129,16 +135,29 @@ class TapController(ControllerBase):
 
     def delete_tap(self, req, **_kwargs):
         try:
-            filter_data = eval(req.body)
-            if not self.is_filter_data_valid(filter_data):
-                return Response(status=400)
-        except SyntaxError:
-            LOG.error('Invalid syntax %s', req.body)
+            filter_data = self.parse_filter(req)
+        except rest_body.BodyError as err:
+            LOG.error('Invalid tap filter: %s', err.message)
+            return rest_body.error_response(err)
 
         self.tap.delete_tap(filter_data)
         return Response(status=200,content_type='application/json',
                     body=json.dumps({'status':'success'}))
 
+    def list_taps(self, req, **_kwargs):
+        return Response(status=200,content_type='application/json',
+                    body=json.dumps(self.tap.get_taps()))
+
+    def delete_tap_by_id(self, req, tap_id, **_kwargs):
+        try:
+            tap_id = int(tap_id)
+        except ValueError:
+            return Response(status=400)
+
+        self.tap.delete_tap_by_id(tap_id)
+        return Response(status=200,content_type='application/json',
+                    body=json.dumps({'status':'success'}))
+
 class TapRestApi(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_0.OFP_VERSION,
                     ofproto_v1_3.OFP_VERSION]
@@ -169,3 +188,11 @@ class TapRestApi(app_manager.RyuApp):
         mapper.connect('tap', '/v1.0/tap/delete',
                        controller=TapController, action='delete_tap',
                        conditions=dict(method=['POST']))
+
+        mapper.connect('tap', '/v1.0/tap',
+                       controller=TapController, action='list_taps',
+                       conditions=dict(method=['GET']))
+
+        mapper.connect('tap', '/v1.0/tap/{tap_id}',
+                       controller=TapController, action='delete_tap_by_id',
+                       conditions=dict(method=['DELETE']))
@@ -0,0 +1,148 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+from ryu.lib.packet import arp, ethernet, packet
+from ryu.ofproto import ether
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+# Stand-ins for the switch side of the apps, so that they can be driven
+# without a controller or any switches. Messages go out through
+# flow_writer, which hands each of them to set_xid() before queueing it,
+# so that is where the fake datapath records them.
+
+
+class FakeDatapath(object):
+
+    def __init__(self, dpid):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.xid = 0
+        self.messages = []
+        self.writes = []
+
+        # Called with every message sent, e.g. to play a host answering
+        self.listeners = []
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        self.messages.append(msg)
+        for listener in self.listeners:
+            listener(self, msg)
+
+    def send(self, buf):
+        self.writes.append(buf)
+
+    def sent(self, msg_type, command=None):
+        return [msg for msg in self.messages if isinstance(msg, msg_type) and
+                (command is None or msg.command == command)]
+
+    def flow_mods(self, command=ofproto_v1_3.OFPFC_ADD):
+        return self.sent(ofproto_v1_3_parser.OFPFlowMod, command)
+
+    def group_mods(self, command=ofproto_v1_3.OFPGC_ADD):
+        return self.sent(ofproto_v1_3_parser.OFPGroupMod, command)
+
+    def packet_outs(self):
+        return self.sent(ofproto_v1_3_parser.OFPPacketOut)
+
+    # The flow a packet with the given match fields would hit, going by
+    # the flows added so far; timeouts and deletes are not modelled
+    def lookup(self, fields):
+        best = None
+        for mod in self.flow_mods():
+            if best is not None and mod.priority <= best.priority:
+                continue
+            for key, value in mod.match.items():
+                if key not in fields or str(fields[key]).lower() != str(value).lower():
+                    break
+            else:
+                best = mod
+        return best
+
+    def clear(self):
+        del self.messages[:]
+        del self.writes[:]
+
+
+class FakeDPSet(object):
+
+    def __init__(self, datapaths):
+        self.datapaths = dict((datapath.id, datapath) for datapath in datapaths)
+
+    def get(self, dpid):
+        return self.datapaths.get(dpid)
+
+    def get_all(self):
+        return list(self.datapaths.items())
+
+
+# Patched over the time module of the app under test
+class FakeClock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeEvent(object):
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+# Hosts behind a fake datapath that answer the ARP requests packet out to
+# them. Each answer comes back as a PacketIn event through deliver(ev),
+# from the port the request went out of. Hosts whose IP is in self.down
+# stay silent.
+class ArpResponder(object):
+
+    def __init__(self, hosts, deliver):
+        self.hosts = dict(hosts)
+        self.deliver = deliver
+        self.down = set()
+        self.requests = 0
+
+    def __call__(self, datapath, msg):
+        if not isinstance(msg, ofproto_v1_3_parser.OFPPacketOut) or not msg.data:
+            return
+
+        request = packet.Packet(bytes(msg.data)).get_protocol(arp.arp)
+        if request is None or request.opcode != arp.ARP_REQUEST:
+            return
+
+        self.requests += 1
+        mac = self.hosts.get(request.dst_ip)
+        if mac is None or request.dst_ip in self.down:
+            return
+
+        reply = packet.Packet()
+        reply.add_protocol(ethernet.ethernet(dst=request.src_mac, src=mac,
+                                             ethertype=ether.ETH_TYPE_ARP))
+        reply.add_protocol(arp.arp(opcode=arp.ARP_REPLY, src_mac=mac,
+                                   src_ip=request.dst_ip,
+                                   dst_mac=request.src_mac,
+                                   dst_ip=request.src_ip))
+        reply.serialize()
+
+        in_port = [action.port for action in msg.actions
+                   if isinstance(action, ofproto_v1_3_parser.OFPActionOutput)][0]
+        self.deliver(FakeEvent(msg=ofproto_v1_3_parser.OFPPacketIn(datapath,
+                buffer_id=ofproto_v1_3.OFP_NO_BUFFER, total_len=len(reply.data),
+                reason=ofproto_v1_3.OFPR_ACTION, table_id=0, cookie=0,
+                match=ofproto_v1_3_parser.OFPMatch(in_port=in_port),
+                data=bytes(reply.data))))
@@ -0,0 +1,122 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import unittest
+
+from ryu.app.sdnhub_apps import cookie_allocator
+from ryu.app.sdnhub_apps import flow_writer
+from ryu.app.sdnhub_apps.cookie_allocator import (
+        APP_MASK, GENERATION_MASK, INSTANCE_MASK, SEQUENCE_MASK)
+
+from .fakes import FakeDatapath
+
+
+def matches(cookie_match, cookie):
+    value, mask = cookie_match
+    return cookie & mask == value & mask
+
+
+class TestCookieLayout(unittest.TestCase):
+
+    def test_fields_cover_64_bits_without_overlap(self):
+        masks = [APP_MASK, GENERATION_MASK, INSTANCE_MASK, SEQUENCE_MASK]
+        for i, mask in enumerate(masks):
+            for other in masks[i + 1:]:
+                self.assertEqual(mask & other, 0)
+        self.assertEqual(APP_MASK | GENERATION_MASK | INSTANCE_MASK | SEQUENCE_MASK,
+                         (1 << 64) - 1)
+
+    def test_fields_round_trip(self):
+        allocator = cookie_allocator.CookieAllocator(
+                cookie_allocator.APP_TAP, instance=0xabc, generation=0x1234)
+        cookie = allocator.next_cookie()
+        self.assertEqual(cookie_allocator.cookie_app_id(cookie), cookie_allocator.APP_TAP)
+        self.assertEqual(cookie_allocator.cookie_generation(cookie), 0x1234)
+        self.assertEqual(cookie_allocator.cookie_instance(cookie), 0xabc)
+        self.assertEqual(cookie & SEQUENCE_MASK, 1)
+        self.assertEqual(cookie, 0x031234abc0000001)
+
+    def test_fields_do_not_spill(self):
+        allocator = cookie_allocator.CookieAllocator(0x1ff, instance=0x1fff,
+                                                     generation=0x1ffff)
+        self.assertEqual(allocator.app_id, 0xff)
+        self.assertEqual(allocator.generation, 0xffff)
+        self.assertEqual(allocator.instance, 0xfff)
+
+        # The sequence wraps within its own bits
+        allocator._sequence = iter([SEQUENCE_MASK + 2])
+        cookie = allocator.next_cookie()
+        self.assertEqual(cookie & ~SEQUENCE_MASK & ((1 << 64) - 1), allocator.prefix)
+        self.assertEqual(cookie & SEQUENCE_MASK, 1)
+
+    def test_unique_cookies(self):
+        allocator = cookie_allocator.CookieAllocator(cookie_allocator.APP_STATELESS_LB)
+        first = allocator.for_instance(1)
+        cookies = [first.next_cookie() for _ in range(100)]
+
+        # A reused instance id continues the sequence of the app
+        second = allocator.for_instance(1)
+        cookies += [second.next_cookie() for _ in range(100)]
+        cookies += [allocator.next_cookie() for _ in range(100)]
+        self.assertEqual(len(set(cookies)), 300)
+
+
+class TestCookieMatches(unittest.TestCase):
+
+    def setUp(self):
+        self.lb = cookie_allocator.CookieAllocator(
+                cookie_allocator.APP_STATELESS_LB, generation=7)
+        self.service = self.lb.for_instance(5)
+        self.other_service = self.lb.for_instance(6)
+        self.old_run = cookie_allocator.CookieAllocator(
+                cookie_allocator.APP_STATELESS_LB, instance=5, generation=6)
+        self.tap = cookie_allocator.CookieAllocator(
+                cookie_allocator.APP_TAP, instance=5, generation=7)
+
+    def test_owner_match(self):
+        match = self.lb.owner_match()
+        for allocator in (self.lb, self.service, self.other_service, self.old_run):
+            self.assertTrue(matches(match, allocator.next_cookie()))
+            self.assertTrue(self.lb.owns(allocator.next_cookie()))
+        self.assertFalse(matches(match, self.tap.next_cookie()))
+        self.assertFalse(self.lb.owns(self.tap.next_cookie()))
+
+    def test_generation_match(self):
+        match = self.lb.generation_match()
+        self.assertTrue(matches(match, self.service.next_cookie()))
+        self.assertFalse(matches(match, self.old_run.next_cookie()))
+        self.assertFalse(matches(match, self.tap.next_cookie()))
+
+    def test_instance_match(self):
+        match = self.service.instance_match()
+        self.assertTrue(matches(match, self.service.next_cookie()))
+        for allocator in (self.lb, self.other_service, self.old_run, self.tap):
+            self.assertFalse(matches(match, allocator.next_cookie()))
+
+    def test_delete_flows(self):
+        datapath = FakeDatapath(1)
+        self.service.delete_flows(datapath, self.service.instance_match())
+        flow_writer.remove_writer(datapath.id)
+
+        mod = datapath.flow_mods(datapath.ofproto.OFPFC_DELETE)[0]
+        self.assertEqual((mod.cookie, mod.cookie_mask), self.service.instance_match())
+        self.assertEqual(mod.table_id, datapath.ofproto.OFPTT_ALL)
+
+    def test_flow_stats_request(self):
+        datapath = FakeDatapath(1)
+        req = self.lb.flow_stats_request(datapath)
+        self.assertEqual((req.cookie, req.cookie_mask), self.lb.owner_match())
+
+
+if __name__ == '__main__':
+    unittest.main()
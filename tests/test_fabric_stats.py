@@ -0,0 +1,300 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import json
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ryu.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER
+from ryu.lib import hub
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+from ryu.app.sdnhub_apps import fabric_stats
+from ryu.app.sdnhub_apps import flow_writer
+
+from .fakes import FakeClock, FakeDatapath, FakeEvent
+
+START = 1000.0
+
+
+def flow_stat(in_port, packets, priority=1):
+    parser = ofproto_v1_3_parser
+    return parser.OFPFlowStats(table_id=0, duration_sec=10, duration_nsec=0,
+            priority=priority, idle_timeout=0, hard_timeout=0, flags=0,
+            cookie=0, packet_count=packets, byte_count=packets * 100,
+            match=parser.OFPMatch(in_port=in_port), instructions=[])
+
+
+def port_stat(port_no, packets):
+    return ofproto_v1_3_parser.OFPPortStats(port_no, packets, packets,
+            packets * 100, packets * 100, 0, 0, 0, 0, 0, 0, 0, 0, 10, 0)
+
+
+class FabricStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(START)
+        patcher = mock.patch.object(fabric_stats, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.stats = fabric_stats.FabricStats()
+        self.datapaths = dict((dpid, FakeDatapath(dpid)) for dpid in (1, 2))
+        for datapath in self.datapaths.values():
+            flow_writer.remove_writer(datapath.id)
+            self.stats.state_change_handler(
+                    FakeEvent(datapath=datapath, state=MAIN_DISPATCHER))
+
+    def tearDown(self):
+        for thread in self.stats.threads:
+            hub.kill(thread)
+        for datapath in self.datapaths.values():
+            flow_writer.remove_writer(datapath.id)
+
+    def poll(self, dpid=1):
+        self.stats.poll_switch(self.datapaths[dpid], self.clock.now)
+
+    def requests(self, dpid=1):
+        datapath = self.datapaths[dpid]
+        return (datapath.sent(ofproto_v1_3_parser.OFPFlowStatsRequest),
+                datapath.sent(ofproto_v1_3_parser.OFPPortStatsRequest))
+
+    def reply(self, request, body, more=False, dpid=1):
+        datapath = self.datapaths[dpid]
+        if isinstance(request, ofproto_v1_3_parser.OFPFlowStatsRequest):
+            msg = ofproto_v1_3_parser.OFPFlowStatsReply(datapath)
+            handler = self.stats.flow_stats_reply_handler
+        else:
+            msg = ofproto_v1_3_parser.OFPPortStatsReply(datapath)
+            handler = self.stats.port_stats_reply_handler
+        msg.xid = request.xid
+        msg.flags = ofproto_v1_3.OFPMPF_REPLY_MORE if more else 0
+        msg.body = body
+        handler(FakeEvent(msg=msg))
+
+    # Polls switch 1 and answers both requests in full
+    def sample(self, flows, ports):
+        self.poll()
+        flow_reqs, port_reqs = self.requests()
+        self.reply(flow_reqs[-1], flows)
+        self.reply(port_reqs[-1], ports)
+        sample = self.stats.samples[1]
+        self.assertEqual(sample['timestamp'], self.clock.now)
+        return sample
+
+    def interval(self, dpid=1):
+        return self.stats.poll_state[dpid]['interval']
+
+
+class TestPollLoop(FabricStatsTestCase):
+
+    def test_connected_switches_polled(self):
+        hub.sleep(0)
+        for dpid in self.datapaths:
+            flow_reqs, port_reqs = self.requests(dpid)
+            self.assertEqual((len(flow_reqs), len(port_reqs)), (1, 1))
+            self.assertEqual(self.stats.poll_state[dpid]['next_poll'],
+                             START + fabric_stats.DEFAULT_POLL_INTERVAL)
+
+    def test_polled_once_per_interval(self):
+        self.poll()
+        self.clock.now += fabric_stats.DEFAULT_POLL_INTERVAL - 1
+        self.poll()
+        self.assertEqual(len(self.requests()[0]), 1)
+
+        self.clock.now += 1
+        self.poll()
+        self.assertEqual(len(self.requests()[0]), 2)
+
+    def test_disconnected_switch_dropped(self):
+        self.sample([flow_stat(1, 10)], [port_stat(1, 10)])
+        version = self.stats.version
+
+        self.stats.state_change_handler(
+                FakeEvent(datapath=self.datapaths[1], state=DEAD_DISPATCHER))
+        self.assertNotIn(1, self.stats.samples)
+        self.assertNotIn(1, self.stats.poll_state)
+        self.assertGreater(self.stats.version, version)
+
+        self.poll()
+        self.assertEqual(len(self.requests()[0]), 1)
+
+
+class TestReplies(FabricStatsTestCase):
+
+    def test_sample_after_both_replies(self):
+        self.poll()
+        flow_reqs, port_reqs = self.requests()
+
+        self.reply(flow_reqs[0], [flow_stat(1, 10)])
+        self.assertNotIn(1, self.stats.samples)
+        self.reply(port_reqs[0], [port_stat(2, 5), port_stat(1, 7)])
+
+        sample = self.stats.samples[1]
+        self.assertEqual(sample['dpid'], '0000000000000001')
+        self.assertEqual(sample['timestamp'], START)
+        self.assertEqual(sample['flows'][0]['packet_count'], 10)
+        self.assertEqual([port['port_no'] for port in sample['ports']], [1, 2])
+        self.assertIsNone(self.stats.poll_state[1]['pending'])
+
+    def test_multipart_replies_collected(self):
+        self.poll()
+        flow_reqs, port_reqs = self.requests()
+
+        self.reply(flow_reqs[0], [flow_stat(1, 10)], more=True)
+        self.reply(port_reqs[0], [port_stat(1, 7)])
+        self.assertNotIn(1, self.stats.samples)
+        self.reply(flow_reqs[0], [flow_stat(2, 20)])
+
+        self.assertEqual([flow['packet_count']
+                          for flow in self.stats.samples[1]['flows']], [10, 20])
+
+    def test_unknown_xid_ignored(self):
+        self.poll()
+        flow_reqs, port_reqs = self.requests()
+
+        # The port request answered as if it were a flow request
+        self.reply(flow_reqs[0], [flow_stat(1, 10)])
+        self.reply(port_reqs[0], [port_stat(1, 7)])
+        msg = ofproto_v1_3_parser.OFPFlowStatsReply(self.datapaths[1])
+        msg.xid, msg.flags, msg.body = port_reqs[0].xid, 0, [flow_stat(3, 1)]
+        self.stats.flow_stats_reply_handler(FakeEvent(msg=msg))
+        self.assertEqual(len(self.stats.samples[1]['flows']), 1)
+
+    def test_late_reply_not_mixed_into_next_poll(self):
+        self.poll()
+        self.clock.now += fabric_stats.DEFAULT_POLL_INTERVAL
+        self.poll()
+        flow_reqs, port_reqs = self.requests()
+
+        self.reply(flow_reqs[0], [flow_stat(1, 10)])
+        self.reply(port_reqs[0], [port_stat(1, 7)])
+        self.assertNotIn(1, self.stats.samples)
+
+        self.reply(flow_reqs[1], [flow_stat(1, 20)])
+        self.reply(port_reqs[1], [port_stat(1, 8)])
+        sample = self.stats.samples[1]
+        self.assertEqual(sample['timestamp'], self.clock.now)
+        self.assertEqual([flow['packet_count'] for flow in sample['flows']], [20])
+
+    def test_reply_from_other_switch_ignored(self):
+        self.poll()
+        flow_reqs, port_reqs = self.requests()
+        self.reply(flow_reqs[0], [flow_stat(1, 10)], dpid=2)
+        self.reply(port_reqs[0], [port_stat(1, 7)], dpid=2)
+        self.assertEqual(self.stats.samples, {})
+
+
+class TestBackoff(FabricStatsTestCase):
+
+    def test_interval_doubles_until_answered(self):
+        intervals = []
+        for i in range(6):
+            self.poll()
+            intervals.append(self.interval())
+            self.clock.now += self.interval()
+        self.assertEqual(intervals, [5, 10, 20, 40, 60, 60])
+        self.assertEqual(len(self.requests()[0]), 6)
+
+        flow_reqs, port_reqs = self.requests()
+        self.reply(flow_reqs[-1], [])
+        self.reply(port_reqs[-1], [])
+        self.assertEqual(self.interval(), fabric_stats.DEFAULT_POLL_INTERVAL)
+
+    def test_other_switches_unaffected(self):
+        for i in range(3):
+            self.poll(1)
+            self.poll(2)
+            flow_reqs, port_reqs = self.requests(2)
+            self.reply(flow_reqs[-1], [], dpid=2)
+            self.reply(port_reqs[-1], [], dpid=2)
+            self.clock.now += 20
+
+        self.assertEqual(self.interval(1), 20)
+        self.assertEqual(self.interval(2), fabric_stats.DEFAULT_POLL_INTERVAL)
+
+    def test_answered_interval_follows_setting(self):
+        self.stats.set_poll_interval(2)
+        self.sample([], [])
+        self.assertEqual(self.interval(), 2)
+
+
+class TestRates(FabricStatsTestCase):
+
+    def test_none_on_first_sample(self):
+        sample = self.sample([flow_stat(1, 10)], [port_stat(1, 10)])
+        self.assertIsNone(sample['flows'][0]['packet_count_rate'])
+        self.assertIsNone(sample['ports'][0]['rx_bytes_rate'])
+
+    def test_per_second_since_previous_sample(self):
+        self.sample([flow_stat(1, 10), flow_stat(2, 10)], [port_stat(1, 10)])
+        self.clock.now += fabric_stats.DEFAULT_POLL_INTERVAL
+        sample = self.sample([flow_stat(1, 30), flow_stat(2, 10)],
+                             [port_stat(1, 50)])
+
+        rates = [(flow['packet_count_rate'], flow['byte_count_rate'])
+                 for flow in sample['flows']]
+        self.assertEqual(rates, [(4.0, 400.0), (0.0, 0.0)])
+
+        port = sample['ports'][0]
+        self.assertEqual(port['rx_packets_rate'], 8.0)
+        self.assertEqual(port['tx_bytes_rate'], 800.0)
+        self.assertEqual(port['rx_errors_rate'], 0.0)
+
+    def test_flows_told_apart_by_priority(self):
+        self.sample([flow_stat(1, 10, priority=1)], [])
+        self.clock.now += fabric_stats.DEFAULT_POLL_INTERVAL
+        sample = self.sample([flow_stat(1, 60, priority=2)], [])
+        self.assertIsNone(sample['flows'][0]['packet_count_rate'])
+
+    def test_none_after_counter_reset(self):
+        self.sample([flow_stat(1, 100)], [port_stat(1, 100)])
+        self.clock.now += fabric_stats.DEFAULT_POLL_INTERVAL
+        sample = self.sample([flow_stat(1, 5)], [port_stat(1, 5)])
+        self.assertIsNone(sample['flows'][0]['packet_count_rate'])
+        self.assertIsNone(sample['ports'][0]['rx_packets_rate'])
+
+    def test_new_port_has_no_rate(self):
+        self.sample([], [port_stat(1, 10)])
+        self.clock.now += fabric_stats.DEFAULT_POLL_INTERVAL
+        sample = self.sample([], [port_stat(1, 20), port_stat(2, 20)])
+        self.assertEqual([port['rx_packets_rate'] for port in sample['ports']],
+                         [2.0, None])
+
+
+class TestSnapshot(FabricStatsTestCase):
+
+    def test_json_cached_per_version(self):
+        self.sample([flow_stat(1, 10)], [port_stat(1, 10)])
+        first = self.stats.get_snapshot_json()
+        self.clock.now += 1
+        self.assertIs(self.stats.get_snapshot_json(), first)
+        self.assertEqual([switch['dpid'] for switch in json.loads(first)['switches']],
+                         ['0000000000000001'])
+
+        self.clock.now += 4
+        self.sample([flow_stat(1, 20)], [port_stat(1, 20)])
+        self.assertIsNot(self.stats.get_snapshot_json(), first)
+
+    def test_since(self):
+        self.sample([], [])
+        self.assertEqual(len(self.stats.get_snapshot(since=START - 1)['switches']), 1)
+        self.assertEqual(self.stats.get_snapshot(since=START)['switches'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from webob import Request
+
+from ryu.app.sdnhub_apps import fileserver
+
+PAGE = b'<html><body>' + b'<p>sdnhub</p>' * 100 + b'</body></html>'
+SCRIPT = b'var hosts = [];\n' * 200
+IMAGE = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+# Just past the in-memory limit, so that it is streamed from disk
+LARGE_FILE_SIZE = fileserver.LARGE_FILE_SIZE + 1
+
+
+class FakeFileWrapper(object):
+    def __init__(self, f, block_size):
+        self.f = f
+        self.block_size = block_size
+
+
+class FileServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.write('index.html', PAGE)
+        self.write('js/hosts.js', SCRIPT)
+        self.write('img/logo.png', IMAGE)
+        self.large = b''.join(
+                os.urandom(1024) for i in range(LARGE_FILE_SIZE // 1024 + 1))
+        self.large = self.large[:LARGE_FILE_SIZE]
+        self.write('js/large.js', self.large)
+        self.assets = fileserver.load_assets(self.directory)
+
+    def write(self, filename, body):
+        path = os.path.join(self.directory, *filename.split('/'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(body)
+
+    def get(self, path, **headers):
+        req = Request.blank(path, headers=headers)
+        controller = fileserver.WebController(req, None,
+                                              {'assets': self.assets})
+        if path == '/':
+            return controller.get_root(req)
+        return controller.get_file(req, path[len('/web/'):])
+
+
+class TestFiles(FileServerTestCase):
+
+    def test_root_is_index(self):
+        res = self.get('/')
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(res.content_type, 'text/html')
+        self.assertEqual(res.body, PAGE)
+
+    def test_nested_file(self):
+        res = self.get('/web/img/logo.png')
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(res.content_type, 'image/png')
+        self.assertEqual(res.body, IMAGE)
+
+    def test_unknown_file(self):
+        self.assertEqual(self.get('/web/missing.js').status_int, 400)
+        self.assertEqual(self.get('/web/../fileserver.py').status_int, 400)
+
+
+class TestCaching(FileServerTestCase):
+
+    def test_etag_revalidation(self):
+        res = self.get('/web/img/logo.png')
+        self.assertTrue(res.etag)
+
+        res = self.get('/web/img/logo.png', **{'If-None-Match': '"%s"' % res.etag})
+        self.assertEqual(res.status_int, 304)
+        self.assertEqual(res.body, b'')
+
+        res = self.get('/web/img/logo.png', **{'If-None-Match': '"stale"'})
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(res.body, IMAGE)
+
+    def test_etag_follows_content(self):
+        etag = self.get('/web/img/logo.png').etag
+        self.write('img/logo.png', IMAGE + b'\x01')
+        self.assets = fileserver.load_assets(self.directory)
+        self.assertNotEqual(self.get('/web/img/logo.png').etag, etag)
+
+    def test_cache_control(self):
+        self.assertEqual(self.get('/').cache_control.no_cache, '*')
+        res = self.get('/web/js/hosts.js')
+        self.assertTrue(res.cache_control.public)
+        self.assertEqual(res.cache_control.max_age, 300)
+
+        # Also on a 304, which refreshes the cached copy
+        res = self.get('/web/js/hosts.js', **{'If-None-Match': '"%s"' % res.etag})
+        self.assertEqual(res.status_int, 304)
+        self.assertEqual(res.cache_control.max_age, 300)
+
+
+class TestCompression(FileServerTestCase):
+
+    def test_gzip_when_accepted(self):
+        plain = self.get('/web/js/hosts.js')
+        self.assertIsNone(plain.content_encoding)
+        self.assertEqual(plain.body, SCRIPT)
+
+        res = self.get('/web/js/hosts.js', **{'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(res.content_encoding, 'gzip')
+        self.assertLess(len(res.body), len(SCRIPT))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(res.body)).read(),
+                         SCRIPT)
+        self.assertEqual(list(res.vary), ['Accept-Encoding'])
+        self.assertEqual(list(plain.vary), ['Accept-Encoding'])
+
+        # Each variant has its own ETag
+        self.assertNotEqual(res.etag, plain.etag)
+        res = self.get('/web/js/hosts.js', **{'Accept-Encoding': 'gzip',
+                                              'If-None-Match': '"%s"' % res.etag})
+        self.assertEqual(res.status_int, 304)
+        res = self.get('/web/js/hosts.js', **{'If-None-Match': '"%s"' % res.etag})
+        self.assertEqual(res.status_int, 200)
+
+    def test_gzip_not_accepted(self):
+        res = self.get('/web/js/hosts.js', **{'Accept-Encoding': 'identity'})
+        self.assertIsNone(res.content_encoding)
+        self.assertEqual(res.body, SCRIPT)
+
+        res = self.get('/web/js/hosts.js', **{'Accept-Encoding': 'gzip;q=0'})
+        self.assertIsNone(res.content_encoding)
+
+    def test_binary_not_compressed(self):
+        res = self.get('/web/img/logo.png', **{'Accept-Encoding': 'gzip'})
+        self.assertIsNone(res.content_encoding)
+        self.assertIsNone(res.vary)
+        self.assertEqual(res.body, IMAGE)
+
+
+class TestLargeFiles(FileServerTestCase):
+
+    def test_only_indexed(self):
+        asset = self.assets['js/large.js']
+        self.assertIsNone(asset['body'])
+        self.assertIsNone(asset['gzip_body'])
+        self.assertEqual(asset['size'], LARGE_FILE_SIZE)
+
+    def test_streamed_through_file_wrapper(self):
+        req = Request.blank('/web/js/large.js',
+                            environ={'wsgi.file_wrapper': FakeFileWrapper})
+        controller = fileserver.WebController(req, None,
+                                              {'assets': self.assets})
+        res = controller.get_file(req, 'js/large.js')
+
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(res.content_length, LARGE_FILE_SIZE)
+        wrapper = res.app_iter
+        self.assertIsInstance(wrapper, FakeFileWrapper)
+        self.assertEqual(wrapper.block_size, fileserver.FILE_CHUNK_SIZE)
+        with wrapper.f:
+            self.assertEqual(wrapper.f.read(), self.large)
+
+    def test_streamed_in_chunks(self):
+        res = self.get('/web/js/large.js', **{'Accept-Encoding': 'gzip'})
+        self.assertIsNone(res.content_encoding)
+        self.assertEqual(res.content_length, LARGE_FILE_SIZE)
+
+        chunks = list(res.app_iter)
+        self.assertEqual(len(chunks[0]), fileserver.FILE_CHUNK_SIZE)
+        self.assertEqual(b''.join(chunks), self.large)
+
+    def test_etag_revalidation(self):
+        etag = self.get('/web/js/large.js').etag
+        res = self.get('/web/js/large.js', **{'If-None-Match': '"%s"' % etag})
+        self.assertEqual(res.status_int, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
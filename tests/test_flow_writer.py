@@ -0,0 +1,114 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import json
+import unittest
+
+from webob import Request
+
+from ryu.base import app_manager
+from ryu.lib import hub
+from ryu.app.sdnhub_apps import flow_writer
+from ryu.app.sdnhub_apps import flow_writer_rest
+from ryu.app.sdnhub_apps import learning_switch
+from ryu.app.sdnhub_apps import stateless_lb
+from ryu.app.sdnhub_apps import tap
+
+from .fakes import FakeDatapath, FakeEvent
+
+
+class TestFlowWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.datapath = FakeDatapath(0x10)
+        flow_writer.remove_writer(self.datapath.id)
+
+    def tearDown(self):
+        flow_writer.remove_writer(self.datapath.id)
+
+    def send_flows(self, count):
+        parser = self.datapath.ofproto_parser
+        for port in range(1, count + 1):
+            flow_writer.send_msg(self.datapath, parser.OFPFlowMod(
+                    self.datapath, match=parser.OFPMatch(in_port=port)))
+
+    def test_batched_when_handler_yields(self):
+        self.send_flows(10)
+        self.assertEqual(self.datapath.writes, [])
+
+        hub.sleep(0)
+        self.assertEqual(len(self.datapath.writes), 1)
+        self.assertEqual(flow_writer.get_stats()[self.datapath.id],
+                         {'messages': 10, 'writes': 1, 'batching_ratio': 10.0})
+
+    def test_explicit_flush(self):
+        self.send_flows(3)
+        flow_writer.flush(self.datapath)
+        self.send_flows(1)
+        flow_writer.flush(self.datapath)
+        hub.sleep(0)
+
+        # The scheduled flushes find nothing left to write
+        self.assertEqual(len(self.datapath.writes), 2)
+        self.assertEqual(flow_writer.get_stats()[self.datapath.id],
+                         {'messages': 4, 'writes': 2, 'batching_ratio': 2.0})
+
+    def test_barrier(self):
+        self.send_flows(2)
+        done = flow_writer.flush(self.datapath, barrier=True)
+        self.assertFalse(done.is_set())
+
+        barrier = self.datapath.sent(self.datapath.ofproto_parser.OFPBarrierRequest)[0]
+        reply = self.datapath.ofproto_parser.OFPBarrierReply(self.datapath)
+        reply.xid = barrier.xid
+        flow_writer.barrier_reply(reply)
+        self.assertTrue(done.is_set())
+
+    def test_barrier_reply_app(self):
+        done = flow_writer.flush(self.datapath, barrier=True)
+        barrier = self.datapath.sent(self.datapath.ofproto_parser.OFPBarrierRequest)[0]
+        reply = self.datapath.ofproto_parser.OFPBarrierReply(self.datapath)
+        reply.xid = barrier.xid
+
+        flow_writer.FlowWriterBarriers().barrier_reply_handler(FakeEvent(msg=reply))
+        self.assertTrue(done.is_set())
+
+    def test_apps_asking_for_barriers_load_the_reply_app(self):
+        for app in (learning_switch.L2LearningSwitch, tap.StarterTap,
+                    stateless_lb.StatelessLB):
+            self.assertIn('ryu.app.sdnhub_apps.flow_writer',
+                          app_manager.get_dependent_services(app))
+
+    def test_rest_stats(self):
+        self.send_flows(4)
+        flow_writer.flush(self.datapath)
+
+        req = Request.blank('/v1.0/stats/flow_writer')
+        controller = flow_writer_rest.FlowWriterController(req, None, {})
+        res = controller.get_flow_writer_stats(req)
+        self.assertEqual(res.status_int, 200)
+
+        switches = json.loads(res.body.decode('utf-8'))['switches']
+        stats = [switch for switch in switches
+                 if switch['dpid'] == '%016x' % self.datapath.id]
+        self.assertEqual(stats, [{'dpid': '%016x' % self.datapath.id,
+                                  'messages': 4, 'writes': 1,
+                                  'batching_ratio': 4.0}])
+
+    def test_no_writes(self):
+        flow_writer.get_writer(self.datapath)
+        self.assertEqual(flow_writer.get_stats()[self.datapath.id]['batching_ratio'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
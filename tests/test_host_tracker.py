@@ -0,0 +1,203 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ryu.lib import hub
+from ryu.lib.packet import arp, ethernet, ipv4, packet
+from ryu.ofproto import ether
+from ryu.ofproto import ofproto_v1_3
+from ryu.app.sdnhub_apps import host_tracker
+
+from .fakes import FakeClock, FakeDatapath, FakeEvent
+
+HOST_MAC = '00:00:00:00:00:0a'
+HOST_IP = '10.0.0.1'
+ROUTER_MAC = '00:00:00:00:00:fe'
+
+
+def packet_in(datapath, in_port, src_mac, src_ip, use_arp=True):
+    pkt = packet.Packet()
+    if use_arp:
+        pkt.add_protocol(ethernet.ethernet(dst='ff:ff:ff:ff:ff:ff', src=src_mac,
+                                           ethertype=ether.ETH_TYPE_ARP))
+        pkt.add_protocol(arp.arp(src_mac=src_mac, src_ip=src_ip,
+                                 dst_ip='10.0.0.254'))
+    else:
+        pkt.add_protocol(ethernet.ethernet(dst='00:00:00:00:00:01', src=src_mac,
+                                           ethertype=ether.ETH_TYPE_IP))
+        pkt.add_protocol(ipv4.ipv4(src=src_ip, dst='10.0.0.254'))
+    pkt.serialize()
+
+    parser = datapath.ofproto_parser
+    msg = parser.OFPPacketIn(datapath, buffer_id=ofproto_v1_3.OFP_NO_BUFFER,
+            total_len=len(pkt.data), reason=ofproto_v1_3.OFPR_NO_MATCH,
+            table_id=0, cookie=0, match=parser.OFPMatch(in_port=in_port),
+            data=bytes(pkt.data))
+    return FakeEvent(msg=msg)
+
+
+class HostTrackerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        patcher = mock.patch.object(host_tracker, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.tracker = host_tracker.HostTracker()
+        self.changes = []
+        self.tracker.addHostListener(
+                lambda ip, entry: self.changes.append(
+                        (ip, None if entry is None else dict(entry))))
+        self.datapaths = dict((dpid, FakeDatapath(dpid)) for dpid in (1, 2))
+
+    def tearDown(self):
+        for thread in self.tracker.threads:
+            hub.kill(thread)
+
+    def see(self, dpid, port, mac=HOST_MAC, ip=HOST_IP, use_arp=True):
+        self.tracker.packet_in_handler(
+                packet_in(self.datapaths[dpid], port, mac, ip, use_arp))
+
+
+class TestHostMoves(HostTrackerTestCase):
+
+    def test_learned_from_arp_and_ip(self):
+        self.see(1, 3)
+        self.see(1, 4, ip='10.0.0.2', mac='00:00:00:00:00:0b', use_arp=False)
+        self.assertEqual(self.tracker.hosts[HOST_IP],
+                         {'mac': HOST_MAC, 'dpid': '0000000000000001',
+                          'port': 3, 'timestamp': 1000})
+        self.assertEqual(self.tracker.hosts['10.0.0.2']['port'], 4)
+
+    def test_move_between_ports(self):
+        self.see(1, 3)
+        self.clock.now += 5
+        self.see(1, 4)
+
+        entry = self.tracker.hosts[HOST_IP]
+        self.assertEqual((entry['port'], entry['timestamp']), (4, 1005))
+        self.assertEqual([change[1]['port'] for change in self.changes], [3, 4])
+
+    def test_move_between_switches(self):
+        self.see(1, 3)
+        version = self.tracker.structure_version
+        self.see(2, 3)
+
+        self.assertEqual(self.tracker.hosts[HOST_IP]['dpid'], '0000000000000002')
+        self.assertEqual(self.tracker.getHostsByDpid('0000000000000001'), {})
+        self.assertEqual(list(self.tracker.getHostsByDpid('0000000000000002')),
+                         [HOST_IP])
+        self.assertGreater(self.tracker.structure_version, version)
+        self.assertEqual(len(self.changes), 2)
+
+    def test_seen_again_is_not_a_change(self):
+        self.see(1, 3)
+        version = self.tracker.structure_version
+        self.clock.now += 5
+        self.see(1, 3)
+
+        self.assertEqual(self.tracker.hosts[HOST_IP]['timestamp'], 1005)
+        self.assertEqual(self.tracker.structure_version, version)
+        self.assertEqual(len(self.changes), 1)
+
+    def test_ip_taken_over_by_other_mac(self):
+        self.see(1, 3)
+        self.see(1, 5, mac='00:00:00:00:00:0b')
+
+        self.assertEqual(self.tracker.hosts[HOST_IP]['mac'], '00:00:00:00:00:0b')
+        self.assertEqual(self.tracker.getIpsByMac(HOST_MAC), [])
+        self.assertEqual(self.tracker.getIpsByMac('00:00:00:00:00:0b'), [HOST_IP])
+
+
+class TestRouterPromotion(HostTrackerTestCase):
+
+    def test_two_ips_on_one_mac(self):
+        self.see(1, 1, mac=ROUTER_MAC, ip='10.0.1.1', use_arp=False)
+        self.see(1, 1, mac=ROUTER_MAC, ip='10.0.2.1', use_arp=False)
+        self.assertEqual(sorted(self.tracker.getIpsByMac(ROUTER_MAC)),
+                         ['10.0.1.1', '10.0.2.1'])
+
+        # The next packet from the MAC gives it away as a router, and its
+        # IPs are dropped
+        self.see(1, 1, mac=ROUTER_MAC, ip='10.0.3.1', use_arp=False)
+        self.assertIn(ROUTER_MAC, self.tracker.routers)
+        self.assertEqual(self.tracker.hosts, {})
+        self.assertEqual(self.tracker.getIpsByMac(ROUTER_MAC), [])
+        self.assertEqual(sorted(ip for ip, entry in self.changes if entry is None),
+                         ['10.0.1.1', '10.0.2.1'])
+
+        # And it is ignored from then on
+        self.see(1, 1, mac=ROUTER_MAC, ip='10.0.4.1')
+        self.assertEqual(self.tracker.hosts, {})
+
+    def test_other_hosts_untouched(self):
+        self.see(1, 3)
+        self.see(1, 1, mac=ROUTER_MAC, ip='10.0.1.1')
+        self.see(1, 1, mac=ROUTER_MAC, ip='10.0.2.1')
+        self.see(1, 1, mac=ROUTER_MAC, ip='10.0.3.1')
+        self.assertEqual(list(self.tracker.hosts), [HOST_IP])
+
+
+class TestExpiry(HostTrackerTestCase):
+
+    def test_expired_after_idle_timeout(self):
+        self.see(1, 3)
+        self.clock.now += host_tracker.DEFAULT_IDLE_TIMEOUT
+        self.tracker.expireHostEntries()
+        self.assertIn(HOST_IP, self.tracker.hosts)
+
+        self.clock.now += 1
+        self.tracker.expireHostEntries()
+        self.assertEqual(self.tracker.hosts, {})
+        self.assertEqual(self.changes[-1], (HOST_IP, None))
+
+    def test_shorter_timeout_applies_to_every_host(self):
+        self.see(1, 3)
+        self.clock.now += 20
+        self.see(1, 4, mac='00:00:00:00:00:0b', ip='10.0.0.2')
+        self.clock.now += 20
+
+        # Setting the timeout expires what it already covers right away
+        self.tracker.setIdleTimeout(30)
+        self.assertEqual(self.tracker.getIdleTimeout(), 30)
+        self.assertEqual(list(self.tracker.hosts), ['10.0.0.2'])
+
+        self.clock.now += 11
+        self.tracker.expireHostEntries()
+        self.assertEqual(self.tracker.hosts, {})
+        self.assertEqual(self.tracker.getHostsByDpid('0000000000000001'), {})
+        self.assertEqual(self.tracker.getIpsSince(0), [])
+
+    def test_refreshed_host_kept(self):
+        self.tracker.setIdleTimeout(30)
+        self.see(1, 3)
+        self.clock.now += 25
+        self.see(1, 3)
+        self.clock.now += 25
+        self.tracker.expireHostEntries()
+        self.assertIn(HOST_IP, self.tracker.hosts)
+
+        self.clock.now += 6
+        self.tracker.expireHostEntries()
+        self.assertEqual(self.tracker.hosts, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import json
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from webob import Request
+
+from ryu.lib import hub
+from ryu.app.sdnhub_apps import host_tracker
+from ryu.app.sdnhub_apps import host_tracker_rest
+
+from .fakes import FakeClock, FakeDPSet
+
+MAC_A = '00:00:00:00:00:0a'
+MAC_B = '00:00:00:00:00:0b'
+DPID = '0000000000000001'
+
+
+class TestHostsListing(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        patchers = [mock.patch.object(host_tracker, 'time', self.clock),
+                    mock.patch.object(host_tracker_rest, 'time', self.clock)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.tracker = host_tracker.HostTracker()
+        self.data = {'host_tracker': self.tracker, 'dpset': FakeDPSet([]),
+                     'hosts_cache': {}}
+
+        # Five hosts behind MAC A, seen one second apart
+        for i in range(1, 6):
+            self.see('10.0.0.%d' % i, MAC_A)
+            self.clock.now += 1
+        self.see('10.0.1.1', MAC_B)
+
+    def tearDown(self):
+        for thread in self.tracker.threads:
+            hub.kill(thread)
+
+    def see(self, ip, mac, port=1):
+        self.tracker.updateHostTable(ip, mac, DPID, port)
+
+    def get(self, query='', etag=None):
+        req = Request.blank('/v1.0/hosts?' + query)
+        if etag is not None:
+            req.if_none_match = etag
+        controller = host_tracker_rest.HostTrackerController(req, None, self.data)
+        return controller.get_all_hosts(req)
+
+    def ips(self, res):
+        return sorted(json.loads(res.body.decode('utf-8')))
+
+    def test_all(self):
+        res = self.get()
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(self.ips(res), sorted(self.tracker.hosts))
+        self.assertEqual(res.headers['X-Total-Count'], '6')
+        self.assertEqual(json.loads(res.body.decode('utf-8'))['10.0.1.1'],
+                         self.tracker.hosts['10.0.1.1'])
+
+    def test_mac(self):
+        res = self.get('mac=' + MAC_B.upper())
+        self.assertEqual(self.ips(res), ['10.0.1.1'])
+        self.assertEqual(res.headers['X-Total-Count'], '1')
+
+        res = self.get('mac=00:00:00:00:00:ff')
+        self.assertEqual(self.ips(res), [])
+
+    def test_since(self):
+        res = self.get('since=1002')
+        self.assertEqual(self.ips(res), ['10.0.0.4', '10.0.0.5', '10.0.1.1'])
+        self.assertEqual(res.headers['X-Total-Count'], '3')
+
+        res = self.get('since=1002&mac=' + MAC_A)
+        self.assertEqual(self.ips(res), ['10.0.0.4', '10.0.0.5'])
+
+    def test_offset_limit(self):
+        res = self.get('offset=1&limit=2')
+        self.assertEqual(self.ips(res), ['10.0.0.2', '10.0.0.3'])
+        self.assertEqual(res.headers['X-Total-Count'], '6')
+
+        res = self.get('offset=4')
+        self.assertEqual(self.ips(res), ['10.0.0.5', '10.0.1.1'])
+        res = self.get('offset=10&limit=5')
+        self.assertEqual(self.ips(res), [])
+        self.assertEqual(res.headers['X-Total-Count'], '6')
+
+    def test_bad_parameters(self):
+        for query in ('limit=x', 'offset=-1', 'limit=-2', 'since=yesterday'):
+            self.assertEqual(self.get(query).status_int, 400, query)
+
+    def test_not_modified(self):
+        etag = self.get().etag
+        res = self.get(etag=etag)
+        self.assertEqual(res.status_int, 304)
+        self.assertEqual(res.etag, etag)
+
+        # Other queries have other tags
+        self.assertEqual(self.get('limit=2', etag=etag).status_int, 200)
+
+    def test_seen_again_keeps_tag(self):
+        etag = self.get().etag
+        sorted_ips = self.tracker.getSortedIps()
+
+        self.clock.now += 5
+        self.see('10.0.0.1', MAC_A)
+        self.assertEqual(self.get(etag=etag).status_int, 304)
+        self.assertIs(self.tracker.getSortedIps(), sorted_ips)
+
+        # Until the timestamps are due for a refresh
+        self.clock.now += host_tracker_rest.TIMESTAMP_REFRESH_INTERVAL
+        res = self.get(etag=etag)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(json.loads(res.body.decode('utf-8'))['10.0.0.1']['timestamp'],
+                         1010)
+
+    def test_changes_change_tag(self):
+        for change in (lambda: self.see('10.0.2.1', MAC_B),
+                       lambda: self.see('10.0.0.1', MAC_A, port=2),
+                       lambda: self.tracker.removeHost('10.0.0.2')):
+            etag = self.get().etag
+            change()
+            res = self.get(etag=etag)
+            self.assertEqual(res.status_int, 200)
+            self.assertNotEqual(res.etag, etag)
+
+        self.assertEqual(self.ips(self.get()), ['10.0.0.1', '10.0.0.3', '10.0.0.4',
+                                                '10.0.0.5', '10.0.1.1', '10.0.2.1'])
+
+    def test_since_follows_timestamps(self):
+        etag = self.get('since=1004').etag
+        self.assertEqual(self.get('since=1004', etag=etag).status_int, 304)
+
+        self.clock.now += 1
+        self.see('10.0.0.1', MAC_A)
+        res = self.get('since=1004', etag=etag)
+        self.assertEqual(res.status_int, 200)
+        self.assertEqual(self.ips(res), ['10.0.0.1', '10.0.1.1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
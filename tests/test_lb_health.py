@@ -0,0 +1,192 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import socket
+import unittest
+
+from ryu.app.sdnhub_apps import lb_health
+from ryu.app.sdnhub_apps import stateless_lb
+
+from .fakes import ArpResponder
+from .test_stateless_lb import LBTestbed, SERVERS
+
+# Servers are played by an ARP responder behind the fake switch, or by
+# TCP listeners on the loopback interface. Rounds are run one at a time
+# instead of on the checker's timer.
+
+TIMEOUT = 0.05
+
+
+def reachable_macs(service, dpid=1):
+    reachable = service.reachable_servers.get(dpid)
+    return sorted(server['mac'] for server, _outport in reachable.entries)
+
+
+class TestHealthChecker(unittest.TestCase):
+
+    def setUp(self):
+        self.alive = set(['a', 'b'])
+        self.changes = []
+        self.checker = lb_health.HealthChecker(self.probe,
+                lambda key, healthy: self.changes.append((key, healthy)),
+                interval=1, timeout=TIMEOUT, fall=3, rise=2)
+        self.checker.set_targets(['a', 'b'])
+
+    def probe(self, key):
+        if key in self.alive:
+            self.checker.report(key)
+
+    def test_fall_and_rise(self):
+        self.alive.discard('b')
+        for _ in range(2):
+            self.checker.run_round()
+        self.assertTrue(self.checker.is_healthy('b'))
+        self.checker.run_round()
+        self.assertFalse(self.checker.is_healthy('b'))
+        self.assertEqual(self.changes, [('b', False)])
+
+        self.alive.add('b')
+        self.checker.run_round()
+        self.assertFalse(self.checker.is_healthy('b'))
+        self.checker.run_round()
+        self.assertTrue(self.checker.is_healthy('b'))
+        self.assertEqual(self.changes, [('b', False), ('b', True)])
+        self.assertTrue(self.checker.is_healthy('a'))
+
+    def test_failures_must_be_consecutive(self):
+        for alive in (False, False, True, False, False):
+            if alive:
+                self.alive.add('b')
+            else:
+                self.alive.discard('b')
+            self.checker.run_round()
+        self.assertTrue(self.checker.is_healthy('b'))
+        self.assertEqual(self.changes, [])
+
+    def test_probe_error_counts_as_failure(self):
+        def probe(key):
+            raise socket.error('unreachable')
+        self.checker.send_probe = probe
+        for _ in range(3):
+            self.checker.run_round()
+        self.assertFalse(self.checker.is_healthy('a'))
+
+    def test_set_targets(self):
+        self.checker.set_targets(['b', 'c'])
+        self.assertEqual(sorted(self.checker.targets), ['b', 'c'])
+        self.assertTrue(self.checker.is_healthy('unknown'))
+
+
+class TestArpHealthCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = LBTestbed(stateless_lb.LB_MODE_GROUP,
+                health_check={'method': lb_health.HEALTH_CHECK_ARP,
+                              'interval': 1, 'timeout': TIMEOUT,
+                              'fall': 2, 'rise': 2})
+        self.service = self.testbed.service
+        self.service.health.stop()
+
+        self.responder = ArpResponder(
+                dict((server['ip'], server['mac']) for server in SERVERS),
+                self.testbed.lb.packet_in_handler)
+        self.testbed.datapath.listeners.append(self.responder)
+
+    def last_buckets(self):
+        return len(self.testbed.datapath.group_mods(
+                self.testbed.datapath.ofproto.OFPGC_MODIFY)[-1].buckets)
+
+    def test_all_up(self):
+        self.service.health.run_round()
+        self.assertEqual(self.responder.requests, len(SERVERS))
+        self.assertEqual(reachable_macs(self.service),
+                         sorted(server['mac'] for server in SERVERS))
+        self.assertEqual(self.service.to_dict()['unhealthy_servers'], [])
+
+    def test_server_removed_and_restored(self):
+        down = SERVERS[1]
+        self.responder.down.add(down['ip'])
+
+        self.service.health.run_round()
+        self.assertIn(down['mac'], reachable_macs(self.service))
+        self.service.health.run_round()
+        self.assertNotIn(down['mac'], reachable_macs(self.service))
+        self.assertEqual(self.service.to_dict()['unhealthy_servers'], [down['mac']])
+        self.assertEqual(self.last_buckets(), len(SERVERS) - 1)
+
+        self.responder.down.discard(down['ip'])
+        self.service.health.run_round()
+        self.assertNotIn(down['mac'], reachable_macs(self.service))
+        self.service.health.run_round()
+        self.assertIn(down['mac'], reachable_macs(self.service))
+        self.assertEqual(self.last_buckets(), len(SERVERS))
+
+    def test_unhealthy_server_stays_out_when_relearned(self):
+        down = SERVERS[0]
+        self.responder.down.add(down['ip'])
+        for _ in range(2):
+            self.service.health.run_round()
+
+        self.testbed.lb.mac_learned(1, down['mac'], 9)
+        self.assertNotIn(down['mac'], reachable_macs(self.service))
+
+
+class TestTcpHealthCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = self.listen(0)
+        self.port = self.listener.getsockname()[1]
+
+        # Nothing listens on the second address
+        self.servers = [{'ip': '127.0.0.1', 'mac': '00:00:00:00:01:01'},
+                        {'ip': '127.0.0.2', 'mac': '00:00:00:00:01:02'}]
+        self.testbed = LBTestbed(stateless_lb.LB_MODE_REACTIVE,
+                servers=self.servers,
+                health_check={'method': lb_health.HEALTH_CHECK_TCP,
+                              'port': self.port, 'interval': 1,
+                              'timeout': TIMEOUT, 'fall': 1, 'rise': 1})
+        self.service = self.testbed.service
+        self.service.health.stop()
+
+    def tearDown(self):
+        if self.listener is not None:
+            self.listener.close()
+
+    def listen(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('127.0.0.1', port))
+        sock.listen(16)
+        return sock
+
+    def test_listener_up_and_down(self):
+        self.service.health.run_round()
+        self.assertEqual(reachable_macs(self.service), [self.servers[0]['mac']])
+
+        # New connections all go to the server that answers
+        for client_port in range(10000, 10010):
+            forward, _reverse, _ports = self.testbed.connect('10.0.2.1', client_port)
+            self.assertEqual(forward['eth_dst'], self.servers[0]['mac'])
+
+        self.listener.close()
+        self.listener = None
+        self.service.health.run_round()
+        self.assertEqual(reachable_macs(self.service), [])
+
+        self.listener = self.listen(self.port)
+        self.service.health.run_round()
+        self.assertEqual(reachable_macs(self.service), [self.servers[0]['mac']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import collections
+import unittest
+
+from ryu.app.sdnhub_apps import lb_scheduler
+from ryu.app.sdnhub_apps.stateless_lb import ReachableServers
+
+# Small prime table, so that the tests build it quickly
+TABLE_SIZE = 5003
+
+
+def make_server(index, weight=1):
+    return {'ip': '10.0.1.%d' % index, 'mac': '00:00:00:00:01:%02x' % index,
+            'weight': weight}
+
+
+def make_reachable(servers):
+    reachable = ReachableServers()
+    for outport, server in enumerate(servers, 1):
+        reachable.update(server['mac'], server, outport)
+    return reachable
+
+
+def flow_keys(count):
+    return [('10.0.%d.%d' % (i // 250, i % 250 + 1), '10.0.0.100', 6,
+             1024 + i % 50000, 80) for i in range(count)]
+
+
+def assignments(scheduler, reachable, keys, dpid=1):
+    return dict((key, scheduler.select(dpid, reachable, key)[0]['mac'])
+                for key in keys)
+
+
+class TestMaglevScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = lb_scheduler.MaglevScheduler(TABLE_SIZE)
+        self.servers = [make_server(i) for i in range(1, 11)]
+        self.keys = flow_keys(20000)
+
+    def test_empty(self):
+        self.assertIsNone(self.scheduler.select(1, ReachableServers(),
+                                                self.keys[0]))
+
+    def test_stable(self):
+        reachable = make_reachable(self.servers)
+        first = assignments(self.scheduler, reachable, self.keys)
+        self.assertTrue(assignments(self.scheduler, reachable, self.keys) == first)
+
+        # The table only depends on the servers, not on the switch
+        other = lb_scheduler.MaglevScheduler(TABLE_SIZE)
+        self.assertTrue(assignments(other, make_reachable(self.servers),
+                                    self.keys, dpid=2) == first)
+
+    def test_balanced(self):
+        table = self.scheduler.build_table(make_reachable(self.servers).members)
+        counts = collections.Counter(table)
+        self.assertEqual(len(counts), len(self.servers))
+        share = float(TABLE_SIZE) / len(self.servers)
+        for count in counts.values():
+            self.assertLess(abs(count - share), share * 0.02)
+
+    def test_removal_disruption(self):
+        reachable = make_reachable(self.servers)
+        before = assignments(self.scheduler, reachable, self.keys)
+
+        removed = self.servers[3]['mac']
+        reachable.remove(removed)
+        after = assignments(self.scheduler, reachable, self.keys)
+
+        moved = [key for key in self.keys
+                 if before[key] != removed and before[key] != after[key]]
+        for key in self.keys:
+            self.assertNotEqual(after[key], removed)
+
+        # Flows of the other servers stay put, save for a few percent
+        self.assertLess(len(moved), len(self.keys) * 0.03)
+
+    def test_addition_disruption(self):
+        reachable = make_reachable(self.servers)
+        before = assignments(self.scheduler, reachable, self.keys)
+
+        added = make_server(11)
+        reachable.update(added['mac'], added, 11)
+        after = assignments(self.scheduler, reachable, self.keys)
+
+        gained = [key for key in self.keys if after[key] == added['mac']]
+        moved = [key for key in self.keys
+                 if after[key] != added['mac'] and before[key] != after[key]]
+        self.assertLess(abs(len(gained) - len(self.keys) / 11.0),
+                        len(self.keys) * 0.02)
+        self.assertLess(len(moved), len(self.keys) * 0.03)
+
+    def test_learning_order(self):
+        reachable = make_reachable(self.servers)
+        before = assignments(self.scheduler, reachable, self.keys)
+        rotated = make_reachable(self.servers[3:] + self.servers[:3])
+        after = assignments(self.scheduler, rotated, self.keys, dpid=2)
+        self.assertTrue(before == after)
+
+    def count_builds(self):
+        builds = []
+        build_table = self.scheduler.build_table
+
+        def counted(macs):
+            builds.append(macs)
+            return build_table(macs)
+        self.scheduler.build_table = counted
+        return builds
+
+    def test_built_once_per_membership(self):
+        builds = self.count_builds()
+        reachable = make_reachable(self.servers)
+        self.scheduler.servers_changed(reachable)
+        self.assertEqual(len(builds), 1)
+
+        # Neither packets, a server moving to another port, nor another
+        # switch reaching the same servers build a table again
+        before = assignments(self.scheduler, reachable, self.keys[:100])
+        self.assertFalse(reachable.update(self.servers[0]['mac'],
+                                          self.servers[0], 42))
+        assignments(self.scheduler, reachable, self.keys[:100])
+        assignments(self.scheduler, make_reachable(self.servers),
+                    self.keys[:100], dpid=2)
+        self.assertEqual(len(builds), 1)
+
+        # A server going down and coming back builds one table for the
+        # smaller pool, then finds the full one in the cache
+        mac = self.servers[3]['mac']
+        self.assertTrue(reachable.remove(mac))
+        self.scheduler.servers_changed(reachable)
+        self.assertTrue(reachable.update(mac, self.servers[3], 4))
+        self.scheduler.servers_changed(reachable)
+        self.assertEqual(len(builds), 2)
+        self.assertTrue(assignments(self.scheduler, reachable,
+                                    self.keys[:100]) == before)
+
+    def test_table_cache_bounded(self):
+        reachable = make_reachable(self.servers)
+        for server in self.servers:
+            reachable.remove(server['mac'])
+            self.scheduler.servers_changed(reachable)
+        self.assertEqual(len(self.scheduler.tables),
+                         lb_scheduler.MAGLEV_TABLE_CACHE_SIZE)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_select_is_abstract(self):
+        class NoSelect(lb_scheduler.Scheduler):
+            pass
+
+        self.assertRaises(TypeError, NoSelect)
+        for name in lb_scheduler.SCHEDULERS:
+            self.assertIsInstance(lb_scheduler.create_scheduler(name),
+                                  lb_scheduler.Scheduler)
+
+
+class TestWeightedSchedulers(unittest.TestCase):
+
+    def test_smooth_weighted_round_robin(self):
+        servers = [make_server(1, 5), make_server(2, 1), make_server(3, 1)]
+        reachable = make_reachable(servers)
+        scheduler = lb_scheduler.WeightedRoundRobinScheduler()
+        picks = [scheduler.select(1, reachable, None)[0]['mac']
+                 for _ in range(7)]
+
+        self.assertEqual(collections.Counter(picks),
+                         {servers[0]['mac']: 5, servers[1]['mac']: 1,
+                          servers[2]['mac']: 1})
+        # Interleaved rather than five in a row
+        self.assertNotEqual(picks[:5], [servers[0]['mac']] * 5)
+
+    def test_least_connections(self):
+        servers = [make_server(1, 2), make_server(2, 1)]
+        reachable = make_reachable(servers)
+        scheduler = lb_scheduler.LeastConnectionScheduler()
+
+        picks = []
+        for _ in range(6):
+            server = scheduler.select(1, reachable, None)[0]
+            scheduler.connection_opened(server)
+            picks.append(server['mac'])
+        self.assertEqual(collections.Counter(picks),
+                         {servers[0]['mac']: 4, servers[1]['mac']: 2})
+
+        scheduler.connection_closed(servers[1])
+        scheduler.connection_closed(servers[1])
+        self.assertEqual(scheduler.select(1, reachable, None)[0], servers[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,387 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import random
+import sys
+import time
+import unittest
+
+from ryu.controller.handler import MAIN_DISPATCHER
+from ryu.ofproto import ether
+from ryu.app.sdnhub_apps import flow_writer
+from ryu.app.sdnhub_apps import learning_switch
+
+from .fakes import FakeDatapath, FakeEvent
+from .test_stateless_lb import make_packet_in, output_ports
+
+# Running this module directly prints the throughput of the structures
+# under test as they grow, e.g.
+#   python -m ryu.app.sdnhub_apps.tests.test_learning_switch
+
+
+def linear_lookup(rules, fields):
+    # What the learning switch did before exemptions were indexed
+    for match in rules:
+        for key, val in match.items():
+            if key not in fields or fields[key] != val:
+                break
+        else:
+            return True
+    return False
+
+
+def random_mac(rand):
+    return ':'.join('%02x' % rand.randint(0, 255) for _ in range(6))
+
+
+def random_rule(rand, macs):
+    kind = rand.randint(0, 4)
+    if kind == 0:
+        return {'dl_dst': rand.choice(macs)}
+    if kind == 1:
+        return {'dl_src': rand.choice(macs), 'dl_type': 0x800}
+    if kind == 2:
+        return {'dl_type': 0x800, 'nw_proto': 6, 'tp_dst': rand.randint(1, 50)}
+    if kind == 3:
+        return {'dl_type': 0x800, 'nw_dst': '10.0.0.%d' % rand.randint(1, 50)}
+    return {'dl_type': rand.choice([0x806, 0x88cc, 0x86dd])}
+
+
+def random_packet(rand, macs):
+    fields = {'in_port': rand.randint(1, 8),
+              'dl_src': rand.choice(macs),
+              'dl_dst': rand.choice(macs),
+              'dl_type': rand.choice([0x800, 0x800, 0x806, 0x86dd])}
+    if fields['dl_type'] == 0x800:
+        fields['nw_src'] = '10.0.0.%d' % rand.randint(1, 50)
+        fields['nw_dst'] = '10.0.0.%d' % rand.randint(1, 50)
+        fields['nw_proto'] = rand.choice([6, 17])
+        fields['tp_src'] = rand.randint(1, 50)
+        fields['tp_dst'] = rand.randint(1, 50)
+    return fields
+
+
+def exemption_workload(rule_count, packet_count, seed=0):
+    rand = random.Random(seed)
+    macs = [random_mac(rand) for _ in range(max(4, rule_count // 2))]
+    rules = [random_rule(rand, macs) for _ in range(rule_count)]
+    packets = [random_packet(rand, macs) for _ in range(packet_count)]
+    return rules, packets
+
+
+class TestExemptionClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.classifier = learning_switch.ExemptionClassifier()
+
+    def test_indexed_rule(self):
+        self.classifier.add({'dl_dst': 'aa:aa:aa:aa:aa:aa', 'dl_type': 0x800})
+        self.assertTrue(self.classifier.lookup(
+                {'dl_dst': 'aa:aa:aa:aa:aa:aa', 'dl_type': 0x800, 'in_port': 1}))
+        self.assertFalse(self.classifier.lookup(
+                {'dl_dst': 'aa:aa:aa:aa:aa:aa', 'dl_type': 0x806}))
+        self.assertFalse(self.classifier.lookup(
+                {'dl_dst': 'bb:bb:bb:bb:bb:bb', 'dl_type': 0x800}))
+
+    def test_packet_missing_field(self):
+        self.classifier.add({'dl_type': 0x800, 'tp_dst': 80})
+        self.assertFalse(self.classifier.lookup({'dl_type': 0x800}))
+
+    def test_wildcard_rule(self):
+        self.classifier.add({'in_port': 3})
+        self.assertTrue(self.classifier.lookup({'in_port': 3, 'dl_type': 0x800}))
+        self.assertFalse(self.classifier.lookup({'in_port': 4}))
+
+    def test_empty_rule_matches_all(self):
+        self.classifier.add({})
+        self.assertTrue(self.classifier.lookup({'in_port': 1}))
+
+    def test_clear(self):
+        self.classifier.add({'dl_dst': 'aa:aa:aa:aa:aa:aa'})
+        self.classifier.add({'in_port': 3})
+        self.classifier.clear()
+        self.assertFalse(self.classifier.lookup(
+                {'dl_dst': 'aa:aa:aa:aa:aa:aa', 'in_port': 3}))
+
+    def test_same_as_linear_scan(self):
+        for rule_count in (0, 1, 10, 100, 500):
+            rules, packets = exemption_workload(rule_count, 2000, rule_count)
+            classifier = learning_switch.ExemptionClassifier()
+            for rule in rules:
+                classifier.add(rule)
+            for fields in packets:
+                self.assertEqual(classifier.lookup(fields),
+                                 linear_lookup(rules, fields), fields)
+
+
+class TestFlowTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = learning_switch.FlowTable()
+
+    def test_add_remove(self):
+        self.assertIsNone(self.table.add(1, {'in_port': 1}, [], 2))
+        self.assertIsNone(self.table.add(2, {'in_port': 2}, [], 2))
+        self.assertEqual(len(self.table), 2)
+
+        entry = self.table.remove(1)
+        self.assertEqual((entry.cookie, entry.match, entry.priority),
+                         (1, {'in_port': 1}, 2))
+        self.assertIsNone(self.table.remove(1))
+        self.assertEqual([entry['cookie'] for entry in self.table.entries()], [2])
+
+    def test_duplicate_match_replaces(self):
+        self.table.add(1, {'in_port': 1, 'eth_dst': 'aa'}, [], 2)
+        self.assertEqual(self.table.add(2, {'eth_dst': 'aa', 'in_port': 1}, [], 2), 1)
+        self.assertEqual(len(self.table), 1)
+        self.assertIsNone(self.table.remove(1))
+
+        # The FlowRemoved of the replaced flow must not drop its successor
+        self.assertEqual(self.table.by_match[(2, (('eth_dst', 'aa'), ('in_port', 1)))], 2)
+
+    def test_other_priority_is_distinct(self):
+        self.table.add(1, {'eth_dst': 'aa'}, [], 1)
+        self.assertIsNone(self.table.add(2, {'eth_dst': 'aa'}, [], 2))
+        self.assertEqual(len(self.table), 2)
+
+    def test_entries_format(self):
+        self.table.add(7, {'in_port': 1}, ['output:2'], 2)
+        self.assertEqual(self.table.entries(), [
+                {'cookie': 7, 'match': {'in_port': 1},
+                 'actions': ['output:2'], 'priority': 2}])
+
+    def test_stress(self):
+        count, _elapsed = flow_table_workload(100000)
+        self.assertEqual(count, 100000)
+
+
+class TestSwitchConnect(unittest.TestCase):
+
+    def test_stale_flows_deleted_before_table_miss(self):
+        switch = learning_switch.L2LearningSwitch()
+        datapath = FakeDatapath(1)
+        switch.state_change_handler(FakeEvent(datapath=datapath,
+                                              state=MAIN_DISPATCHER))
+        flow_writer.remove_writer(datapath.id)
+
+        parser = datapath.ofproto_parser
+        ofp = datapath.ofproto
+        kinds = [(type(msg), getattr(msg, 'command', None))
+                 for msg in datapath.messages]
+        self.assertEqual(kinds, [(parser.OFPFlowMod, ofp.OFPFC_DELETE),
+                                 (parser.OFPBarrierRequest, None),
+                                 (parser.OFPFlowMod, ofp.OFPFC_ADD)])
+        self.assertEqual(datapath.messages[0].cookie_mask,
+                         switch.cookies.owner_match()[1])
+        self.assertEqual(len(datapath.messages[2].match.items()), 0)
+
+
+HOST1 = '00:00:00:00:00:01'
+HOST2 = '00:00:00:00:00:02'
+
+
+def port(dpid, port_no):
+    return FakeEvent(dpid=dpid, port_no=port_no)
+
+
+def dst_flows(datapath, mac):
+    return [mod for mod in datapath.flow_mods()
+            if mod.match.get('eth_dst') == mac and
+            mod.priority == learning_switch.DST_FLOW_PRIORITY]
+
+
+# Three switches in a line, 1:10 - 20:2:21 - 30:3, hosts on port 1 of
+# switch 1 and port 3 of switch 3
+class TestDstForwardingMode(unittest.TestCase):
+
+    def setUp(self):
+        self.switch = learning_switch.L2LearningSwitch()
+        self.datapaths = [FakeDatapath(dpid) for dpid in (1, 2, 3)]
+        for datapath in self.datapaths:
+            self.switch.state_change_handler(FakeEvent(datapath=datapath,
+                                                       state=MAIN_DISPATCHER))
+            self.switch.switch_enter_handler(
+                    FakeEvent(switch=FakeEvent(dp=datapath)))
+        for src, dst in ((port(1, 10), port(2, 20)), (port(2, 21), port(3, 30))):
+            self.switch.link_add_handler(FakeEvent(link=FakeEvent(src=src, dst=dst)))
+            self.switch.link_add_handler(FakeEvent(link=FakeEvent(src=dst, dst=src)))
+        self.clear()
+
+    def tearDown(self):
+        for datapath in self.datapaths:
+            flow_writer.remove_writer(datapath.id)
+
+    def clear(self):
+        for datapath in self.datapaths:
+            datapath.clear()
+
+    def packet_in(self, datapath, in_port, src, dst):
+        self.switch.packet_in_handler(make_packet_in(datapath, {
+                'in_port': in_port, 'eth_src': src, 'eth_dst': dst,
+                'ipv4_src': '10.0.0.1', 'ipv4_dst': '10.0.0.2',
+                'tcp_src': 1234, 'tcp_dst': 80}))
+
+    def arp_punts(self, datapath, command):
+        return [mod for mod in datapath.flow_mods(command)
+                if mod.match.get('eth_type') == ether.ETH_TYPE_ARP and
+                mod.priority == learning_switch.ARP_PUNT_PRIORITY]
+
+    def test_mode_flip_installs_and_removes_arp_punt(self):
+        ofp = self.datapaths[0].ofproto
+        self.switch.set_forwarding_mode(learning_switch.FORWARDING_MODE_DST)
+        for datapath in self.datapaths:
+            punts = self.arp_punts(datapath, ofp.OFPFC_ADD)
+            self.assertEqual(len(punts), 1)
+            self.assertEqual(output_ports(punts[0].instructions[0].actions),
+                             [ofp.OFPP_CONTROLLER])
+        self.assertEqual(self.arp_punts(self.datapaths[0], ofp.OFPFC_DELETE_STRICT), [])
+
+        # Setting the same mode again changes nothing
+        self.clear()
+        self.switch.set_forwarding_mode(learning_switch.FORWARDING_MODE_DST)
+        self.assertEqual(self.datapaths[0].messages, [])
+
+        self.switch.set_forwarding_mode(learning_switch.FORWARDING_MODE_IN_PORT_DST)
+        for datapath in self.datapaths:
+            deletes = self.arp_punts(datapath, ofp.OFPFC_DELETE_STRICT)
+            self.assertEqual(len(deletes), 1)
+            self.assertEqual((deletes[0].cookie, deletes[0].cookie_mask),
+                             self.switch.cookies.owner_match())
+            self.assertEqual(self.arp_punts(datapath, ofp.OFPFC_ADD), [])
+        self.assertEqual(self.switch.get_forwarding_mode(),
+                         learning_switch.FORWARDING_MODE_IN_PORT_DST)
+
+        self.assertRaises(ValueError, self.switch.set_forwarding_mode, 'bogus')
+
+    def test_switch_joining_in_dst_mode_gets_arp_punt(self):
+        self.switch.set_forwarding_mode(learning_switch.FORWARDING_MODE_DST)
+        datapath = FakeDatapath(4)
+        self.switch.state_change_handler(FakeEvent(datapath=datapath,
+                                                   state=MAIN_DISPATCHER))
+        flow_writer.remove_writer(datapath.id)
+        self.assertEqual(len(self.arp_punts(datapath, datapath.ofproto.OFPFC_ADD)), 1)
+
+    def test_host_flow_pushed_along_tree(self):
+        self.switch.set_forwarding_mode(learning_switch.FORWARDING_MODE_DST)
+        self.clear()
+        self.packet_in(self.datapaths[0], 1, HOST1, HOST2)
+
+        out_ports = [[output_ports(mod.instructions[0].actions)
+                      for mod in dst_flows(datapath, HOST1)]
+                     for datapath in self.datapaths]
+        self.assertEqual(out_ports, [[[1]], [[20]], [[30]]])
+
+        # Learned again from another switch, over a link, it stays put
+        self.clear()
+        self.packet_in(self.datapaths[1], 20, HOST1, HOST2)
+        self.assertEqual(self.switch.host_ports[HOST1], (1, 1))
+        self.assertEqual(dst_flows(self.datapaths[2], HOST1), [])
+
+    def test_expired_flow_reinstalled_along_path(self):
+        self.switch.set_forwarding_mode(learning_switch.FORWARDING_MODE_DST)
+        self.packet_in(self.datapaths[0], 1, HOST1, HOST2)
+        self.packet_in(self.datapaths[2], 3, HOST2, HOST1)
+        self.clear()
+
+        # HOST2's flows expired: the PacketIn on switch 1 puts them back
+        # on every switch to HOST2 rather than on switch 1 alone
+        self.packet_in(self.datapaths[0], 1, HOST1, HOST2)
+        out_ports = [[output_ports(mod.instructions[0].actions)
+                      for mod in dst_flows(datapath, HOST2)]
+                     for datapath in self.datapaths]
+        self.assertEqual(out_ports, [[[10]], [[21]], [[3]]])
+        self.assertEqual(output_ports(self.datapaths[0].packet_outs()[0].actions),
+                         [10])
+
+    def test_no_topology_stays_local(self):
+        switch = learning_switch.L2LearningSwitch()
+        switch.set_forwarding_mode(learning_switch.FORWARDING_MODE_DST)
+        for datapath in self.datapaths:
+            switch.state_change_handler(FakeEvent(datapath=datapath,
+                                                  state=MAIN_DISPATCHER))
+        self.clear()
+        self.switch = switch
+
+        self.packet_in(self.datapaths[0], 1, HOST1, HOST2)
+        self.assertEqual(len(dst_flows(self.datapaths[0], HOST1)), 1)
+        self.assertEqual(dst_flows(self.datapaths[1], HOST1), [])
+
+
+def flow_table_workload(count):
+    table = learning_switch.FlowTable()
+    matches = [{'in_port': cookie % 48 + 1,
+                'eth_dst': '00:00:%02x:%02x:%02x:%02x' % (
+                    (cookie >> 24) & 0xff, (cookie >> 16) & 0xff,
+                    (cookie >> 8) & 0xff, cookie & 0xff)}
+               for cookie in range(count)]
+
+    start = time.time()
+    for cookie, match in enumerate(matches):
+        table.add(cookie, match, None, 2)
+    inserted = len(table)
+    added = time.time() - start
+
+    order = list(range(count))
+    random.Random(0).shuffle(order)
+    start = time.time()
+    for cookie in order:
+        table.remove(cookie)
+    removed = time.time() - start
+
+    assert len(table) == 0 and not table.by_match
+    return inserted, (added, removed)
+
+
+def bench_flow_table(out):
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    out.write('%8s %12s %12s %10s\n' % ('flows', 'add/s', 'remove/s', 'peak MB'))
+    for count in (1000, 10000, 100000):
+        if tracemalloc is not None:
+            tracemalloc.start()
+        _inserted, (added, removed) = flow_table_workload(count)
+        peak = 0
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        out.write('%8d %12d %12d %10.1f\n' % (count, count / added,
+                                               count / removed, peak / 1e6))
+
+
+def bench_exemptions(out):
+    out.write('%8s %16s %16s\n' % ('rules', 'indexed pkt/s', 'linear pkt/s'))
+    for rule_count in (10, 100, 1000, 10000):
+        rules, packets = exemption_workload(rule_count, 20000)
+        classifier = learning_switch.ExemptionClassifier()
+        for rule in rules:
+            classifier.add(rule)
+
+        start = time.time()
+        for fields in packets:
+            classifier.lookup(fields)
+        indexed = len(packets) / (time.time() - start)
+
+        start = time.time()
+        for fields in packets:
+            linear_lookup(rules, fields)
+        linear = len(packets) / (time.time() - start)
+
+        out.write('%8d %16d %16d\n' % (rule_count, indexed, linear))
+
+
+if __name__ == '__main__':
+    bench_exemptions(sys.stdout)
+    bench_flow_table(sys.stdout)
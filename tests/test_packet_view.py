@@ -0,0 +1,254 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import unittest
+
+from ryu.lib.packet import arp
+from ryu.lib.packet import ethernet
+from ryu.lib.packet import ipv4
+from ryu.lib.packet import packet
+from ryu.lib.packet import tcp
+from ryu.lib.packet import udp
+from ryu.lib.packet import vlan
+from ryu.ofproto import ether, inet
+from ryu.app.sdnhub_apps import packet_view
+
+from .fakes import FakeEvent
+
+SRC_MAC = '00:00:00:00:00:01'
+DST_MAC = '00:00:00:00:00:02'
+SRC_IP = '10.0.0.1'
+DST_IP = '10.0.0.2'
+
+
+def serialize(*protocols):
+    pkt = packet.Packet()
+    for protocol in protocols:
+        pkt.add_protocol(protocol)
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def eth(ethertype):
+    return ethernet.ethernet(dst=DST_MAC, src=SRC_MAC, ethertype=ethertype)
+
+
+def arp_frame(opcode=arp.ARP_REQUEST):
+    return serialize(eth(ether.ETH_TYPE_ARP),
+                     arp.arp(opcode=opcode, src_mac=SRC_MAC, src_ip=SRC_IP,
+                             dst_mac=DST_MAC, dst_ip=DST_IP))
+
+
+def ip_frame(l4, proto, option=None, tags=()):
+    protocols = []
+    ethertype = ether.ETH_TYPE_IP
+    for tpid, vid in reversed(tags):
+        protocols.insert(0, vlan.vlan(vid=vid, ethertype=ethertype))
+        ethertype = tpid
+    header_length = 5 + len(option or b'') // 4
+    protocols.insert(0, eth(ethertype))
+    protocols.append(ipv4.ipv4(header_length=header_length, proto=proto,
+                               src=SRC_IP, dst=DST_IP, option=option))
+    protocols.append(l4)
+    return serialize(*protocols)
+
+
+def tcp_frame(**kwargs):
+    return ip_frame(tcp.tcp(src_port=34567, dst_port=80),
+                    inet.IPPROTO_TCP, **kwargs)
+
+
+def udp_frame(**kwargs):
+    return ip_frame(udp.udp(src_port=5353, dst_port=53),
+                    inet.IPPROTO_UDP, **kwargs)
+
+
+def headers_of(data):
+    return packet_view.get_headers(FakeEvent(data=data))
+
+
+# Checks the view of a frame against what ryu.lib.packet makes of it
+class PacketViewTestCase(unittest.TestCase):
+
+    def assertSameHeaders(self, data):
+        pkt = packet.Packet(data)
+        headers = headers_of(data)
+
+        eth_hdr = pkt.get_protocol(ethernet.ethernet)
+        self.assertEqual(headers.eth_src, eth_hdr.src)
+        self.assertEqual(headers.eth_dst, eth_hdr.dst)
+
+        # Outer 802.1ad tags first
+        vlan_hdrs = pkt.get_protocols(vlan.svlan) + pkt.get_protocols(vlan.vlan)
+        if vlan_hdrs:
+            self.assertEqual(headers.vlan_vid, vlan_hdrs[0].vid)
+            self.assertEqual(headers.ethertype, vlan_hdrs[-1].ethertype)
+        else:
+            self.assertIsNone(headers.vlan_vid)
+            self.assertEqual(headers.ethertype, eth_hdr.ethertype)
+
+        arp_hdr = pkt.get_protocol(arp.arp)
+        if arp_hdr is None:
+            self.assertIsNone(headers.arp)
+        else:
+            self.assertEqual(headers.arp,
+                             (arp_hdr.opcode, arp_hdr.src_mac, arp_hdr.src_ip,
+                              arp_hdr.dst_mac, arp_hdr.dst_ip))
+
+        ip_hdr = pkt.get_protocol(ipv4.ipv4)
+        if ip_hdr is None:
+            self.assertIsNone(headers.ipv4)
+        else:
+            self.assertEqual(headers.ipv4,
+                             (ip_hdr.header_length * 4, ip_hdr.proto,
+                              ip_hdr.src, ip_hdr.dst))
+
+        for name, cls in (('tcp', tcp.tcp), ('udp', udp.udp)):
+            l4_hdr = pkt.get_protocol(cls)
+            if l4_hdr is None:
+                self.assertIsNone(getattr(headers, name))
+            else:
+                self.assertEqual(getattr(headers, name),
+                                 (l4_hdr.src_port, l4_hdr.dst_port))
+
+        return headers
+
+
+class TestPacketHeaders(PacketViewTestCase):
+
+    def test_arp(self):
+        for opcode in (arp.ARP_REQUEST, arp.ARP_REPLY):
+            headers = self.assertSameHeaders(arp_frame(opcode))
+            self.assertEqual(headers.arp.opcode, opcode)
+            self.assertEqual(headers.match_fields(),
+                             {'dl_src': SRC_MAC, 'dl_dst': DST_MAC,
+                              'dl_type': ether.ETH_TYPE_ARP,
+                              'nw_src': SRC_IP, 'nw_dst': DST_IP})
+
+    def test_tcp(self):
+        headers = self.assertSameHeaders(tcp_frame())
+        self.assertIsNone(headers.udp)
+        self.assertEqual(headers.match_fields(),
+                         {'dl_src': SRC_MAC, 'dl_dst': DST_MAC,
+                          'dl_type': ether.ETH_TYPE_IP,
+                          'nw_src': SRC_IP, 'nw_dst': DST_IP,
+                          'nw_proto': inet.IPPROTO_TCP,
+                          'tp_src': 34567, 'tp_dst': 80})
+
+    def test_udp(self):
+        headers = self.assertSameHeaders(udp_frame())
+        self.assertIsNone(headers.tcp)
+        self.assertEqual(headers.udp, (5353, 53))
+
+    def test_ipv4_options(self):
+        # Record route and end of options; the ports follow the options
+        option = b'\x07\x07\x04\x00\x00\x00\x00\x00'
+        headers = self.assertSameHeaders(tcp_frame(option=option))
+        self.assertEqual(headers.ipv4.header_length, 28)
+        self.assertEqual(headers.tcp, (34567, 80))
+        self.assertSameHeaders(udp_frame(option=option))
+
+    def test_other_ip_protocol(self):
+        data = ip_frame(b'\x08\x00\x00\x00\x00\x00\x00\x00', inet.IPPROTO_ICMP)
+        headers = headers_of(data)
+        self.assertEqual(headers.ipv4.proto, inet.IPPROTO_ICMP)
+        self.assertIsNone(headers.tcp)
+        self.assertIsNone(headers.udp)
+        self.assertNotIn('tp_src', headers.match_fields())
+
+    def test_vlan_tagged(self):
+        headers = self.assertSameHeaders(
+                tcp_frame(tags=[(ether.ETH_TYPE_8021Q, 10)]))
+        self.assertEqual(headers.ethertype, ether.ETH_TYPE_IP)
+        self.assertEqual(headers.vlan_vid, 10)
+        self.assertEqual(headers.tcp, (34567, 80))
+        self.assertEqual(headers.match_fields()['dl_vlan'], 10)
+
+        tagged_arp = serialize(eth(ether.ETH_TYPE_8021Q),
+                               vlan.vlan(vid=20, ethertype=ether.ETH_TYPE_ARP),
+                               arp.arp(src_mac=SRC_MAC, src_ip=SRC_IP,
+                                       dst_mac=DST_MAC, dst_ip=DST_IP))
+        headers = self.assertSameHeaders(tagged_arp)
+        self.assertEqual(headers.arp.src_ip, SRC_IP)
+
+    def test_stacked_vlan_tags(self):
+        headers = self.assertSameHeaders(
+                udp_frame(tags=[(ether.ETH_TYPE_8021AD, 100),
+                                (ether.ETH_TYPE_8021Q, 10)]))
+        self.assertEqual(headers.vlan_vid, 100)
+        self.assertEqual(headers.ethertype, ether.ETH_TYPE_IP)
+        self.assertEqual(headers.udp, (5353, 53))
+
+    def test_untagged_has_no_vlan(self):
+        self.assertNotIn('dl_vlan', headers_of(tcp_frame()).match_fields())
+
+
+class TestTruncatedFrames(unittest.TestCase):
+
+    def test_short_of_ethernet(self):
+        self.assertIsNone(headers_of(tcp_frame()[:13]))
+        self.assertIsNone(headers_of(b''))
+        self.assertIsNone(headers_of(None))
+
+    def test_short_of_arp(self):
+        data = arp_frame()
+        headers = headers_of(data[:packet_view.ETH_HEADER_LEN +
+                                  packet_view.ARP_HEADER_LEN - 1])
+        self.assertEqual(headers.ethertype, ether.ETH_TYPE_ARP)
+        self.assertIsNone(headers.arp)
+        self.assertNotIn('nw_src', headers.match_fields())
+
+    def test_short_of_ipv4(self):
+        headers = headers_of(tcp_frame()[:packet_view.ETH_HEADER_LEN + 19])
+        self.assertIsNone(headers.ipv4)
+        self.assertIsNone(headers.tcp)
+        self.assertEqual(headers.match_fields(),
+                         {'dl_src': SRC_MAC, 'dl_dst': DST_MAC,
+                          'dl_type': ether.ETH_TYPE_IP})
+
+    def test_short_of_ports(self):
+        option = b'\x07\x07\x04\x00\x00\x00\x00\x00'
+        data = tcp_frame(option=option)
+        ports_offset = packet_view.ETH_HEADER_LEN + 28
+
+        headers = headers_of(data[:ports_offset + 3])
+        self.assertEqual(headers.ipv4.src, SRC_IP)
+        self.assertIsNone(headers.tcp)
+
+        # The ports are enough, without the rest of the TCP header
+        headers = headers_of(data[:ports_offset + 4])
+        self.assertEqual(headers.tcp, (34567, 80))
+
+    def test_short_of_vlan_tag(self):
+        data = tcp_frame(tags=[(ether.ETH_TYPE_8021Q, 10)])
+        headers = headers_of(data[:packet_view.ETH_HEADER_LEN + 3])
+        self.assertEqual(headers.ethertype, ether.ETH_TYPE_8021Q)
+        self.assertIsNone(headers.vlan_vid)
+        self.assertIsNone(headers.ipv4)
+
+        headers = headers_of(data[:packet_view.ETH_HEADER_LEN + 4])
+        self.assertEqual(headers.ethertype, ether.ETH_TYPE_IP)
+        self.assertEqual(headers.vlan_vid, 10)
+        self.assertIsNone(headers.ipv4)
+
+
+class TestGetHeaders(unittest.TestCase):
+
+    def test_cached_on_message(self):
+        msg = FakeEvent(data=tcp_frame())
+        headers = packet_view.get_headers(msg)
+        self.assertIs(packet_view.get_headers(msg), headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
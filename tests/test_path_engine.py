@@ -0,0 +1,166 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import random
+import sys
+import time
+import unittest
+
+from ryu.app.sdnhub_apps import path_engine
+
+# A ROWS x COLUMNS grid of switches, 500 of them, each linked both ways
+# to its neighbours. Port 1 goes east, 2 west, 3 south and 4 north.
+ROWS = 20
+COLUMNS = 25
+LOOKUPS = 2000
+
+# A cached path is a dict lookup plus one edge lookup per hop, well under
+# a millisecond even on a slow machine
+MAX_CACHED_HOPS_TIME = 0.001
+
+
+def dpid(row, column):
+    return row * COLUMNS + column + 1
+
+
+def grid_paths():
+    paths = path_engine.ShortestPathCache()
+    for row in range(ROWS):
+        for column in range(COLUMNS):
+            paths.add_switch(dpid(row, column))
+
+    for row in range(ROWS):
+        for column in range(COLUMNS):
+            if column + 1 < COLUMNS:
+                paths.add_link(dpid(row, column), 1, dpid(row, column + 1), 2)
+                paths.add_link(dpid(row, column + 1), 2, dpid(row, column), 1)
+            if row + 1 < ROWS:
+                paths.add_link(dpid(row, column), 3, dpid(row + 1, column), 4)
+                paths.add_link(dpid(row + 1, column), 4, dpid(row, column), 3)
+    return paths
+
+
+def random_pairs(count, seed=1):
+    rand = random.Random(seed)
+    switches = ROWS * COLUMNS
+    return [(rand.randint(1, switches), rand.randint(1, switches))
+            for i in range(count)]
+
+
+def time_hops(paths, pairs):
+    start = time.time()
+    for src, dst in pairs:
+        paths.hops(src, 100, dst, 100)
+    return (time.time() - start) / len(pairs)
+
+
+class TestShortestPathCache(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = grid_paths()
+
+    def test_hops_follow_a_shortest_path(self):
+        hops = self.paths.hops(dpid(0, 0), 100, dpid(2, 3), 200)
+
+        # Manhattan distance, plus the source switch
+        self.assertEqual(len(hops), 6)
+        self.assertEqual(hops[0][:2], (dpid(0, 0), 100))
+        self.assertEqual(hops[-1][0::2], (dpid(2, 3), 200))
+        for (dpid1, _in_port, out_port), (dpid2, in_port, _out_port) in \
+                zip(hops, hops[1:]):
+            edge = self.paths.graph[dpid1][dpid2]
+            self.assertEqual((edge['src_port'], edge['dst_port']),
+                             (out_port, in_port))
+
+    def test_same_switch(self):
+        self.assertEqual(self.paths.hops(7, 1, 7, 2), [(7, 1, 2)])
+
+    def test_unknown_switch(self):
+        self.assertEqual(self.paths.hops(dpid(0, 0), 1, 10000, 1), None)
+
+    def test_cached_hops_time(self):
+        pairs = random_pairs(LOOKUPS)
+        sources = set(src for src, _dst in pairs)
+
+        time_hops(self.paths, pairs)
+        self.assertEqual(set(self.paths.trees), sources)
+        self.assertLess(time_hops(self.paths, pairs), MAX_CACHED_HOPS_TIME)
+
+    def test_removed_link_invalidates_trees_through_it(self):
+        src, dst = dpid(0, 0), dpid(0, COLUMNS - 1)
+        other = dpid(ROWS - 1, COLUMNS - 1)
+        hops = self.paths.hops(src, 100, dst, 100)
+        self.assertEqual(len(hops), COLUMNS)
+        self.paths.hops(other, 100, dst, 100)
+        other_tree = self.paths.trees[other]
+
+        # Cutting the top row forces a detour through the next one
+        self.paths.remove_link(dpid(0, 1), dpid(0, 2))
+        self.assertNotIn(src, self.paths.trees)
+        self.assertIs(self.paths.trees[other], other_tree)
+
+        hops = self.paths.hops(src, 100, dst, 100)
+        self.assertEqual(len(hops), COLUMNS + 2)
+        switches = [hop[0] for hop in hops]
+        self.assertNotIn((dpid(0, 1), dpid(0, 2)), zip(switches, switches[1:]))
+
+    def test_added_link_invalidates_shortened_trees(self):
+        src, dst = dpid(0, 0), dpid(ROWS - 1, COLUMNS - 1)
+        self.paths.hops(src, 100, dst, 100)
+
+        self.paths.add_link(src, 5, dst, 5)
+        self.assertNotIn(src, self.paths.trees)
+        self.assertEqual(len(self.paths.hops(src, 100, dst, 100)), 2)
+
+    def test_removed_switch_is_routed_around(self):
+        src, dst = dpid(0, 0), dpid(0, 2)
+        self.paths.hops(src, 100, dst, 100)
+
+        self.paths.remove_switch(dpid(0, 1))
+        hops = self.paths.hops(src, 100, dst, 100)
+        self.assertEqual(len(hops), 5)
+        self.assertNotIn(dpid(0, 1), [hop[0] for hop in hops])
+
+
+# Times path lookups and topology changes on the 500 switch grid
+def bench_paths(out):
+    paths = grid_paths()
+    pairs = random_pairs(LOOKUPS)
+
+    start = time.time()
+    time_hops(paths, pairs)
+    out.write('%d switches, %d lookups\n' % (ROWS * COLUMNS, LOOKUPS))
+    out.write('  first lookups (BFS per source):  %8.1f us/hops()\n' %
+              ((time.time() - start) / LOOKUPS * 1e6))
+    out.write('  cached lookups:                  %8.1f us/hops()\n' %
+              (time_hops(paths, pairs) * 1e6))
+
+    links = [(src, dst) for src, dst in paths.graph.edges()]
+    rand = random.Random(2)
+    changes = [links[rand.randrange(len(links))] for i in range(100)]
+    trees = len(paths.trees)
+    start = time.time()
+    for src, dst in changes:
+        edge = dict(paths.graph[src][dst])
+        paths.remove_link(src, dst)
+        paths.add_link(src, edge['src_port'], dst, edge['dst_port'])
+    out.write('  link down and up:                %8.1f us/change, '
+              '%d of %d trees left\n' %
+              ((time.time() - start) / (2 * len(changes)) * 1e6,
+               len(paths.trees), trees))
+    out.write('  lookups after the changes:       %8.1f us/hops()\n' %
+              (time_hops(paths, pairs) * 1e6))
+
+
+if __name__ == '__main__':
+    bench_paths(sys.stdout)
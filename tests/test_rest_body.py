@@ -0,0 +1,228 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import json
+import re
+import socket
+import sys
+import time
+import unittest
+
+from webob import Request
+
+from ryu.app.sdnhub_apps import rest_body
+from ryu.app.sdnhub_apps import stateless_lb_rest
+from ryu.app.sdnhub_apps import tap_rest
+
+# Running this module directly prints how many request bodies and
+# addresses are validated per second, e.g.
+#   python -m ryu.app.sdnhub_apps.tests.test_rest_body
+
+TAP_FILTER = {
+    'sources': [{'dpid': 1, 'port_no': 1}, {'dpid': 2, 'port_no': 'all'}],
+    'sinks': [{'dpid': 1, 'port_no': 5}],
+    'fields': {'dl_host': '00:00:00:00:00:01', 'dl_type': 0x800,
+               'nw_host': '10.0.0.0/24', 'nw_proto': 6, 'tp_port': 80},
+    'rate_limit': {'pps': 1000},
+    'sample': 4,
+}
+
+LB_CONFIG = {
+    'virtual_ip': '10.0.0.100',
+    'servers': [{'ip': '10.0.1.%d' % i, 'mac': '00:00:00:00:01:%02x' % i,
+                 'weight': i} for i in range(1, 9)],
+    'rewrite_ip': 1,
+    'scheduler': 'consistent_hash',
+    'mode': 'group',
+    'ports': [80, 443],
+    'health_check': {'method': 'tcp', 'port': 80, 'interval': 2.5},
+}
+
+
+def request(body):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+    req = Request.blank('/', method='PUT')
+    req.body = body
+    return req
+
+
+def error(schema, value):
+    try:
+        schema(value, 'body')
+    except rest_body.BodyError as err:
+        return err.message
+    return None
+
+
+class TestValidators(unittest.TestCase):
+
+    def test_mac(self):
+        for mac in ('00:00:00:00:00:01', 'AA-bb-CC-dd-EE-ff'):
+            self.assertTrue(rest_body.is_mac_valid(mac), mac)
+        for mac in ('00:00:00:00:00', '00:00:00:00:00:0g', '00:00-00:00:00:00',
+                    '00:00:00:00:00:01\n', ''):
+            self.assertFalse(rest_body.is_mac_valid(mac), mac)
+
+    def test_ip(self):
+        for ip in ('10.0.0.1', '0.0.0.0', '255.255.255.255', '10.0.0.0/8',
+                   '10.0.0.0/32', '10.0.0.0/255.255.0.0'):
+            self.assertTrue(rest_body.is_ip_valid(ip), ip)
+        for ip in ('10.0.0', '10.0.0.256', '10.0.0.1/33', '01.0.0.1x',
+                   '10.0.0.1 ', '10.0.0.1\n', ''):
+            self.assertFalse(rest_body.is_ip_valid(ip), ip)
+
+    def test_address(self):
+        self.assertTrue(rest_body.is_address_valid('10.0.0.1'))
+        self.assertFalse(rest_body.is_address_valid('10.0.0.0/8'))
+        self.assertFalse(rest_body.is_address_valid('10.0.0.0/255.0.0.0'))
+        self.assertEqual(error(rest_body.ADDRESS, '10.0.0.0/8'),
+                         'body is not an IPv4 address')
+
+    def test_integer(self):
+        schema = rest_body.integer(1, 10)
+        self.assertIsNone(error(schema, 5))
+        self.assertEqual(error(schema, True), 'body must be an integer')
+        self.assertEqual(error(schema, 1.5), 'body must be an integer')
+        self.assertEqual(error(schema, 0), 'body must be at least 1')
+        self.assertEqual(error(schema, 11), 'body must be at most 10')
+
+    def test_positive_number(self):
+        schema = rest_body.positive_number()
+        self.assertIsNone(error(schema, 0.5))
+        self.assertIsNone(error(schema, 3))
+        for value in (0, -1, False, '1'):
+            self.assertEqual(error(schema, value), 'body must be a positive number')
+
+    def test_one_of_any_of(self):
+        self.assertEqual(error(rest_body.one_of('a', 'b'), 'c'),
+                         'body must be one of a, b')
+        schema = rest_body.any_of(rest_body.integer(0), rest_body.one_of('all'))
+        self.assertIsNone(error(schema, 'all'))
+        self.assertIsNone(error(schema, 3))
+        self.assertEqual(error(schema, 'some'), 'body is not valid')
+
+    def test_array(self):
+        schema = rest_body.array(rest_body.integer(), max_items=2)
+        self.assertIsNone(error(schema, [1, 2]))
+        self.assertEqual(error(schema, {}), 'body must be a list')
+        self.assertEqual(error(schema, [1, 2, 3]), 'body has more than 2 items')
+        self.assertEqual(error(schema, [1, 'x']), 'body[1] must be an integer')
+
+    def test_obj(self):
+        schema = rest_body.obj({'a': rest_body.integer()}, required=('a',))
+        self.assertIsNone(error(schema, {'a': 1, 'b': 'anything'}))
+        self.assertEqual(error(schema, []), 'body must be an object')
+        self.assertEqual(error(schema, {}), 'body.a is missing')
+        self.assertEqual(error(schema, {'a': 'x'}), 'body.a must be an integer')
+
+        closed = rest_body.obj({'a': rest_body.integer(), 'b': rest_body.integer()},
+                               closed=True)
+        self.assertEqual(error(closed, {'c': 1}), 'body.c is not one of a, b')
+
+
+class TestParseBody(unittest.TestCase):
+
+    def test_valid(self):
+        data = rest_body.parse_body(request(TAP_FILTER), tap_rest.TAP_FILTER)
+        self.assertEqual(data, TAP_FILTER)
+
+    def test_invalid_json(self):
+        for body in (b'{', b"{'sources': []}", b'\xff'):
+            with self.assertRaises(rest_body.BodyError) as cm:
+                rest_body.parse_body(request(body), tap_rest.TAP_FILTER)
+            self.assertEqual(cm.exception.status, 400)
+
+    def test_python_literals_rejected(self):
+        # What eval() used to accept, and run
+        with self.assertRaises(rest_body.BodyError):
+            rest_body.parse_body(request(b"__import__('os').getcwd()"),
+                                 tap_rest.TAP_FILTER)
+
+    def test_too_large(self):
+        body = b' ' * rest_body.MAX_BODY_SIZE + b'{}'
+        with self.assertRaises(rest_body.BodyError) as cm:
+            rest_body.parse_body(request(body), tap_rest.TAP_FILTER)
+        self.assertEqual(cm.exception.status, 413)
+
+    def test_nested_error_path(self):
+        data = dict(TAP_FILTER, sinks=[{'dpid': 1, 'port_no': -1}])
+        with self.assertRaises(rest_body.BodyError) as cm:
+            rest_body.parse_body(request(data), tap_rest.TAP_FILTER)
+        self.assertEqual(cm.exception.message, 'body.sinks[0].port_no is not valid')
+
+    def test_rate_limit_units(self):
+        data = dict(TAP_FILTER, rate_limit={'mbps': 5})
+        with self.assertRaises(rest_body.BodyError) as cm:
+            rest_body.parse_body(request(data), tap_rest.TAP_FILTER)
+        self.assertTrue(cm.exception.message.startswith('body.rate_limit.mbps'))
+
+    def test_lb_config(self):
+        data = rest_body.parse_body(request(LB_CONFIG), stateless_lb_rest.LB_CONFIG)
+        self.assertEqual(data, LB_CONFIG)
+
+        data = dict(LB_CONFIG, virtual_ip='10.0.0.0/24')
+        with self.assertRaises(rest_body.BodyError) as cm:
+            rest_body.parse_body(request(data), stateless_lb_rest.LB_CONFIG)
+        self.assertEqual(cm.exception.message, 'body.virtual_ip is not an IPv4 address')
+
+    def test_error_response(self):
+        res = rest_body.error_response(rest_body.BodyError('body is wrong', 413))
+        self.assertEqual(res.status_int, 413)
+        self.assertEqual(json.loads(res.body.decode('utf-8')),
+                         {'status': 'error', 'message': 'body is wrong'})
+
+
+# The checks the controllers made before rest_body, for comparison
+def old_is_mac_valid(x):
+    return re.match("[0-9a-f]{2}([-:])[0-9a-f]{2}(\\1[0-9a-f]{2}){4}$",
+                    x.lower()) is not None
+
+
+def old_is_ip_valid(x):
+    try:
+        socket.inet_aton(x.split('/')[0])
+        return True
+    except socket.error:
+        return False
+
+
+def rate(function, args, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for arg in args:
+            function(arg)
+    return repeat * len(args) / (time.time() - start)
+
+
+def bench_validation(out):
+    macs = ['00:00:00:00:%02x:%02x' % (i // 256, i % 256) for i in range(1000)]
+    ips = ['10.0.%d.%d/24' % (i // 256, i % 256) for i in range(1000)]
+    out.write('%24s %14s %14s\n' % ('check', 'new per s', 'old per s'))
+    out.write('%24s %14d %14d\n' % ('MAC', rate(rest_body.is_mac_valid, macs, 100),
+                                    rate(old_is_mac_valid, macs, 100)))
+    out.write('%24s %14d %14d\n' % ('IP', rate(rest_body.is_ip_valid, ips, 100),
+                                    rate(old_is_ip_valid, ips, 100)))
+
+    for name, data, schema in (
+            ('tap filter', TAP_FILTER, tap_rest.TAP_FILTER),
+            ('load balancer', LB_CONFIG, stateless_lb_rest.LB_CONFIG)):
+        body = json.dumps(data)
+        reqs = [request(body.encode('utf-8')) for _ in range(1000)]
+        new = rate(lambda req: rest_body.parse_body(req, schema), reqs, 10)
+        old = rate(lambda req: eval(req.body), reqs, 10)
+        out.write('%24s %14d %14d\n' % (name + ' body', new, old))
+
+
+if __name__ == '__main__':
+    bench_validation(sys.stdout)
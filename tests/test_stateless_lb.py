@@ -0,0 +1,381 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import sys
+import time
+import unittest
+import zlib
+
+from ryu.lib.packet import arp, ethernet, ipv4, packet, tcp
+from ryu.ofproto import ether, inet
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+from ryu.app.sdnhub_apps import learning_switch
+from ryu.app.sdnhub_apps import stateless_lb
+
+from .fakes import FakeDatapath, FakeEvent
+
+# One switch: clients on port 1, servers on ports 2 and up. Running this
+# module directly prints the PacketIns and flow entries each mode costs
+# for a growing number of connections, and the rate at which the LB
+# handles its PacketIns, e.g.
+#   python -m ryu.app.sdnhub_apps.tests.test_stateless_lb
+
+VIRTUAL_IP = '10.0.0.100'
+CLIENT_MAC = '00:00:00:00:00:01'
+CLIENT_PORT = 1
+SERVICE_PORT = 80
+
+SERVERS = [{'ip': '10.0.1.%d' % i, 'mac': '00:00:00:00:01:%02x' % i}
+           for i in range(1, 4)]
+
+
+def make_packet_in(datapath, fields):
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(dst=fields['eth_dst'],
+                                       src=fields['eth_src'],
+                                       ethertype=ether.ETH_TYPE_IP))
+    pkt.add_protocol(ipv4.ipv4(src=fields['ipv4_src'], dst=fields['ipv4_dst'],
+                               proto=inet.IPPROTO_TCP))
+    pkt.add_protocol(tcp.tcp(src_port=fields['tcp_src'],
+                             dst_port=fields['tcp_dst'], bits=tcp.TCP_SYN))
+    pkt.serialize()
+
+    parser = datapath.ofproto_parser
+    msg = parser.OFPPacketIn(datapath, buffer_id=ofproto_v1_3.OFP_NO_BUFFER,
+            total_len=len(pkt.data), reason=ofproto_v1_3.OFPR_NO_MATCH,
+            table_id=0, cookie=0,
+            match=parser.OFPMatch(in_port=fields['in_port']),
+            data=bytes(pkt.data))
+    return FakeEvent(msg=msg)
+
+
+def output_ports(actions):
+    return [action.port for action in actions
+            if isinstance(action, ofproto_v1_3_parser.OFPActionOutput)]
+
+
+def set_fields(actions):
+    fields = {}
+    for action in actions:
+        if isinstance(action, ofproto_v1_3_parser.OFPActionSetField):
+            fields[action.key] = action.value
+    return fields
+
+
+class LBTestbed(object):
+
+    def __init__(self, mode, servers=SERVERS, **options):
+        self.datapath = FakeDatapath(1)
+        self.switch = learning_switch.L2LearningSwitch()
+        self.switch.datapaths[1] = self.datapath
+        self.switch.mac_to_port[1] = {CLIENT_MAC: CLIENT_PORT}
+        for port, server in enumerate(servers, CLIENT_PORT + 1):
+            self.switch.mac_to_port[1][server['mac']] = port
+
+        options.setdefault('ports', [SERVICE_PORT])
+        self.lb = stateless_lb.StatelessLB()
+        self.lb.set_learning_switch(self.switch)
+        self.service = self.lb.add_service(VIRTUAL_IP,
+                [dict(server) for server in servers], mode=mode, **options)
+        self.packet_ins = 0
+        self.packet_in_time = 0.0
+
+    # Runs the packet through the flows of the switch, and through the
+    # LB when it misses them or is sent to the controller. Returns the
+    # actions applied to it.
+    def switch_packet(self, fields):
+        mod = self.datapath.lookup(fields)
+        if mod is not None:
+            actions = mod.instructions[0].actions
+            if ofproto_v1_3.OFPP_CONTROLLER not in output_ports(actions):
+                return actions
+
+        self.packet_ins += 1
+        sent = len(self.datapath.messages)
+        ev = make_packet_in(self.datapath, fields)
+        start = time.time()
+        self.lb.packet_in_handler(ev)
+        self.packet_in_time += time.time() - start
+        for msg in self.datapath.messages[sent:]:
+            if isinstance(msg, self.datapath.ofproto_parser.OFPFlowMod):
+                return msg.instructions[0].actions
+            if isinstance(msg, self.datapath.ofproto_parser.OFPPacketOut):
+                return msg.actions
+        return []
+
+    def select_bucket(self, actions, fields):
+        group_ids = [action.group_id for action in actions
+                     if isinstance(action, self.datapath.ofproto_parser.OFPActionGroup)]
+        if not group_ids:
+            return actions
+
+        group = [mod for mod in self.datapath.sent(self.datapath.ofproto_parser.OFPGroupMod)
+                 if mod.group_id == group_ids[0]][-1]
+        key = '%(ipv4_src)s|%(tcp_src)d' % fields
+        return group.buckets[zlib.crc32(key.encode('ascii')) % len(group.buckets)].actions
+
+    def connect(self, client_ip, client_port):
+        request = {'in_port': CLIENT_PORT, 'eth_type': ether.ETH_TYPE_IP,
+                   'ip_proto': inet.IPPROTO_TCP,
+                   'eth_src': CLIENT_MAC, 'eth_dst': self.service.virtual_mac.lower(),
+                   'ipv4_src': client_ip, 'ipv4_dst': VIRTUAL_IP,
+                   'tcp_src': client_port, 'tcp_dst': SERVICE_PORT}
+        actions = self.select_bucket(self.switch_packet(request), request)
+        rewritten = set_fields(actions)
+        server_port = output_ports(actions)[0]
+
+        reply = dict(request, in_port=server_port,
+                     eth_src=rewritten['eth_dst'], eth_dst=CLIENT_MAC,
+                     ipv4_src=rewritten.get('ipv4_dst', VIRTUAL_IP),
+                     ipv4_dst=client_ip,
+                     tcp_src=SERVICE_PORT, tcp_dst=client_port)
+        actions = self.switch_packet(reply)
+        return rewritten, set_fields(actions), output_ports(actions)
+
+    def flow_entries(self):
+        return len(self.datapath.flow_mods())
+
+
+def run_connections(mode, clients, connections_per_client):
+    testbed = LBTestbed(mode)
+    for client in range(clients):
+        client_ip = '10.0.2.%d' % (client + 1)
+        for connection in range(connections_per_client):
+            testbed.connect(client_ip, 10000 + connection)
+    return testbed
+
+
+class TestStatelessLBModes(unittest.TestCase):
+
+    def test_reactive_connection(self):
+        testbed = LBTestbed(stateless_lb.LB_MODE_REACTIVE)
+        forward, reverse, ports = testbed.connect('10.0.2.1', 10000)
+
+        self.assertIn(forward['eth_dst'], [server['mac'] for server in SERVERS])
+        self.assertEqual(reverse, {'eth_src': testbed.service.virtual_mac,
+                                   'ipv4_src': VIRTUAL_IP})
+        self.assertEqual(ports, [CLIENT_PORT])
+        self.assertEqual(testbed.packet_ins, 1)
+        self.assertEqual(testbed.flow_entries(), 2)
+
+    def test_group_connection(self):
+        testbed = LBTestbed(stateless_lb.LB_MODE_GROUP)
+        installed = testbed.flow_entries()
+        forward, reverse, ports = testbed.connect('10.0.2.1', 10000)
+
+        self.assertIn(forward['eth_dst'], [server['mac'] for server in SERVERS])
+        self.assertEqual(reverse, {'eth_src': testbed.service.virtual_mac,
+                                   'ipv4_src': VIRTUAL_IP})
+        self.assertEqual(ports, [CLIENT_PORT])
+
+        # Only the first reply to the client is seen by the controller
+        self.assertEqual(testbed.packet_ins, 1)
+        self.assertEqual(testbed.flow_entries(), installed + 1)
+
+        buckets = testbed.datapath.group_mods()[0].buckets
+        self.assertEqual(len(buckets), len(SERVERS))
+
+    def test_reactive_cost_grows_with_connections(self):
+        testbed = run_connections(stateless_lb.LB_MODE_REACTIVE, 4, 25)
+        self.assertEqual(testbed.packet_ins, 100)
+        self.assertEqual(testbed.flow_entries(), 200)
+
+    def test_group_cost_bounded_by_clients(self):
+        few = run_connections(stateless_lb.LB_MODE_GROUP, 4, 1)
+        many = run_connections(stateless_lb.LB_MODE_GROUP, 4, 25)
+
+        # At most one PacketIn and reverse flow per client and server,
+        # however many connections they make
+        self.assertLessEqual(many.packet_ins, 4 * len(SERVERS))
+        self.assertLessEqual(many.flow_entries(),
+                             few.flow_entries() + 4 * len(SERVERS))
+        self.assertLess(many.packet_ins, 100)
+
+    def test_group_mode_ignores_client_packet_in(self):
+        testbed = LBTestbed(stateless_lb.LB_MODE_GROUP)
+        installed = len(testbed.datapath.messages)
+        request = {'in_port': CLIENT_PORT, 'eth_src': CLIENT_MAC,
+                   'eth_dst': testbed.service.virtual_mac.lower(),
+                   'ipv4_src': '10.0.2.1', 'ipv4_dst': VIRTUAL_IP,
+                   'tcp_src': 10000, 'tcp_dst': SERVICE_PORT}
+        testbed.lb.packet_in_handler(make_packet_in(testbed.datapath, request))
+        self.assertEqual(len(testbed.datapath.messages), installed)
+
+
+MAC_A = '00:00:00:00:01:01'
+MAC_B = '00:00:00:00:01:02'
+
+
+class TestAffinityTable(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        table = stateless_lb.AffinityTable(timeout=300, size=3)
+        for i, client in enumerate(('10.0.2.1', '10.0.2.2', '10.0.2.3')):
+            table.record(client, MAC_A, now=i)
+
+        # The lookup makes 10.0.2.1 the most recently used
+        self.assertEqual(table.lookup('10.0.2.1', now=10), MAC_A)
+        table.record('10.0.2.4', MAC_B, now=11)
+
+        self.assertEqual(len(table), 3)
+        self.assertIsNone(table.lookup('10.0.2.2', now=12))
+        self.assertEqual(table.lookup('10.0.2.1', now=12), MAC_A)
+        self.assertEqual(table.lookup('10.0.2.4', now=12), MAC_B)
+
+    def test_record_replaces(self):
+        table = stateless_lb.AffinityTable(timeout=300, size=2)
+        table.record('10.0.2.1', MAC_A, now=0)
+        table.record('10.0.2.1', MAC_B, now=1)
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.lookup('10.0.2.1', now=2), MAC_B)
+
+    def test_expiry_refreshed_by_lookup(self):
+        table = stateless_lb.AffinityTable(timeout=10, size=10)
+        table.record('10.0.2.1', MAC_A, now=0)
+        self.assertEqual(table.lookup('10.0.2.1', now=8), MAC_A)
+        self.assertEqual(table.lookup('10.0.2.1', now=16), MAC_A)
+
+        self.assertIsNone(table.lookup('10.0.2.1', now=27))
+        self.assertEqual(len(table), 0)
+
+    def test_forget_server(self):
+        table = stateless_lb.AffinityTable(timeout=300, size=10)
+        table.record('10.0.2.1', MAC_A, now=0)
+        table.record('10.0.2.2', MAC_B, now=0)
+        table.record('10.0.2.3', MAC_A, now=0)
+
+        table.forget_server(MAC_A)
+        self.assertEqual(list(table.entries), ['10.0.2.2'])
+
+
+class TestAffinity(unittest.TestCase):
+
+    def server_of(self, testbed, client_ip, client_port):
+        forward, _reverse, _ports = testbed.connect(client_ip, client_port)
+        return forward['eth_dst']
+
+    def test_client_stays_on_server(self):
+        testbed = LBTestbed(stateless_lb.LB_MODE_REACTIVE,
+                            affinity=stateless_lb.AFFINITY_CLIENT_IP)
+        servers = set(self.server_of(testbed, '10.0.2.1', port)
+                      for port in range(10000, 10010))
+        self.assertEqual(len(servers), 1)
+
+        # Other clients still get spread over the pool
+        others = set(self.server_of(testbed, '10.0.2.%d' % i, 10000)
+                     for i in range(2, 2 + len(SERVERS)))
+        self.assertEqual(len(others), len(SERVERS))
+
+    def test_without_affinity_client_moves(self):
+        testbed = LBTestbed(stateless_lb.LB_MODE_REACTIVE)
+        servers = set(self.server_of(testbed, '10.0.2.1', port)
+                      for port in range(10000, 10000 + len(SERVERS)))
+        self.assertEqual(len(servers), len(SERVERS))
+
+    def test_affinity_dropped_when_server_goes_down(self):
+        testbed = LBTestbed(stateless_lb.LB_MODE_REACTIVE,
+                            affinity=stateless_lb.AFFINITY_CLIENT_IP)
+        server = self.server_of(testbed, '10.0.2.1', 10000)
+
+        testbed.lb.server_health_changed(testbed.service, server, False)
+        self.assertEqual(len(testbed.service.affinity_table), 0)
+        moved = self.server_of(testbed, '10.0.2.1', 10001)
+        self.assertNotEqual(moved, server)
+
+        # The client sticks to its new server, even once the old one is back
+        testbed.lb.server_health_changed(testbed.service, server, True)
+        self.assertEqual(self.server_of(testbed, '10.0.2.1', 10002), moved)
+
+
+def decode_arp(frame):
+    pkt = packet.Packet(frame)
+    return pkt.get_protocol(ethernet.ethernet), pkt.get_protocol(arp.arp)
+
+
+class TestVirtualServiceArp(unittest.TestCase):
+
+    def setUp(self):
+        self.service = stateless_lb.VirtualService(1, VIRTUAL_IP, SERVERS)
+        self.virtual_mac = self.service.virtual_mac.lower()
+
+    def test_reply(self):
+        template = bytes(self.service.arp_template)
+        eth, reply = decode_arp(self.service.arp_reply(CLIENT_MAC, '10.0.2.1'))
+
+        self.assertEqual((eth.dst, eth.src, eth.ethertype),
+                         (CLIENT_MAC, self.virtual_mac, ether.ETH_TYPE_ARP))
+        self.assertEqual((reply.hwtype, reply.proto, reply.hlen, reply.plen),
+                         (1, ether.ETH_TYPE_IP, 6, 4))
+        self.assertEqual(reply.opcode, arp.ARP_REPLY)
+        self.assertEqual((reply.src_mac, reply.src_ip),
+                         (self.virtual_mac, VIRTUAL_IP))
+        self.assertEqual((reply.dst_mac, reply.dst_ip), (CLIENT_MAC, '10.0.2.1'))
+
+        # Stamped out of a copy of the template
+        self.assertEqual(bytes(self.service.arp_template), template)
+
+    def test_reply_cached_per_requester(self):
+        first = self.service.arp_reply(CLIENT_MAC, '10.0.2.1')
+        self.assertIs(self.service.arp_reply(CLIENT_MAC, '10.0.2.1'), first)
+
+        other = self.service.arp_reply('00:00:00:00:00:02', '10.0.2.2')
+        _eth, reply = decode_arp(other)
+        self.assertEqual((reply.dst_mac, reply.dst_ip),
+                         ('00:00:00:00:00:02', '10.0.2.2'))
+        self.assertEqual(len(self.service.arp_replies), 2)
+
+    def test_full_cache_evicted(self):
+        requesters = [('02:00:00:00:%02x:%02x' % (i >> 8, i & 0xff),
+                       '10.1.%d.%d' % (i >> 8, i & 0xff))
+                      for i in range(stateless_lb.ARP_REPLY_CACHE_SIZE + 1)]
+        for mac, ip in requesters[:-1]:
+            self.service.arp_reply(mac, ip)
+        self.assertEqual(len(self.service.arp_replies),
+                         stateless_lb.ARP_REPLY_CACHE_SIZE)
+
+        mac, ip = requesters[-1]
+        _eth, reply = decode_arp(self.service.arp_reply(mac, ip))
+        self.assertEqual((reply.dst_mac, reply.dst_ip), (mac, ip))
+        self.assertEqual(list(self.service.arp_replies), [(mac, ip)])
+
+        # Evicted replies are built again, the same as before
+        mac, ip = requesters[0]
+        _eth, reply = decode_arp(self.service.arp_reply(mac, ip))
+        self.assertEqual((reply.opcode, reply.src_ip, reply.dst_mac, reply.dst_ip),
+                         (arp.ARP_REPLY, VIRTUAL_IP, mac, ip))
+
+    def test_probe(self):
+        server = SERVERS[1]
+        eth, probe = decode_arp(self.service.arp_probe(server))
+
+        self.assertEqual((eth.dst, eth.src), (server['mac'], self.virtual_mac))
+        self.assertEqual(probe.opcode, arp.ARP_REQUEST)
+        self.assertEqual((probe.src_mac, probe.src_ip),
+                         (self.virtual_mac, VIRTUAL_IP))
+        self.assertEqual(probe.dst_ip, server['ip'])
+
+
+def bench_modes(out):
+    out.write('%12s %10s %12s %12s %14s\n' % ('mode', 'conns',
+              'PacketIns', 'flows', 'PacketIn/s'))
+    for mode in (stateless_lb.LB_MODE_REACTIVE, stateless_lb.LB_MODE_GROUP):
+        for connections in (100, 500, 2000):
+            testbed = run_connections(mode, 50, connections // 50)
+            out.write('%12s %10d %12d %12d %14d\n' % (mode, connections,
+                      testbed.packet_ins, testbed.flow_entries(),
+                      testbed.packet_ins / testbed.packet_in_time))
+
+
+if __name__ == '__main__':
+    bench_modes(sys.stdout)
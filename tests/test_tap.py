@@ -0,0 +1,218 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ryu.ofproto import ofproto_v1_3
+from ryu.app.sdnhub_apps import cookie_allocator
+from ryu.app.sdnhub_apps import tap
+
+from .fakes import FakeDatapath, FakeDPSet
+
+MAC = '00:00:00:00:00:01'
+IP = '10.0.0.1'
+
+BROADENED_FIELD = {'dl_host': ['dl_src', 'dl_dst'],
+                   'nw_host': ['nw_src', 'nw_dst'],
+                   'tp_port': ['tp_src', 'tp_dst']}
+
+# Fields of a filter, and the number of exact matches they stand for
+COMBINATIONS = [
+    ({}, 1),
+    ({'dl_src': MAC}, 1),
+    ({'dl_host': MAC}, 2),
+    ({'dl_type': 0x800, 'nw_host': IP}, 2),
+    ({'dl_type': 0x800, 'nw_proto': 6, 'tp_port': 80}, 2),
+    ({'dl_host': MAC, 'dl_type': 0x800, 'nw_host': IP}, 4),
+    ({'dl_type': 0x800, 'nw_host': IP, 'nw_proto': 6, 'tp_port': 80}, 4),
+    ({'dl_host': MAC, 'dl_type': 0x800, 'nw_host': IP, 'nw_proto': 6,
+      'tp_port': 80}, 8),
+]
+
+
+class TestExpandFields(unittest.TestCase):
+
+    def test_combinations(self):
+        for fields, count in COMBINATIONS:
+            matches = tap.expand_fields(fields, BROADENED_FIELD)
+            self.assertEqual(len(matches), count, fields)
+            for match in matches:
+                for key in BROADENED_FIELD:
+                    self.assertNotIn(key, match)
+
+    def test_no_duplicates(self):
+        fields = {'dl_host': MAC, 'dl_src': MAC}
+        matches = tap.expand_fields(fields, BROADENED_FIELD)
+        self.assertEqual(sorted(sorted(match.items()) for match in matches),
+                         [[('dl_dst', MAC), ('dl_src', MAC)], [('dl_src', MAC)]])
+
+    def test_conflicting_values(self):
+        other = '00:00:00:00:00:02'
+        matches = tap.expand_fields({'dl_host': MAC, 'dl_src': other},
+                                    BROADENED_FIELD)
+        self.assertEqual(matches, [{'dl_dst': MAC, 'dl_src': other}])
+
+    def test_fields_untouched(self):
+        fields = {'dl_host': MAC, 'nw_host': IP, 'dl_type': 0x800}
+        tap.expand_fields(fields, BROADENED_FIELD)
+        self.assertEqual(fields, {'dl_host': MAC, 'nw_host': IP, 'dl_type': 0x800})
+
+
+class TestProgramTap(unittest.TestCase):
+
+    def setUp(self):
+        self.datapaths = [FakeDatapath(1), FakeDatapath(2)]
+        self.tap = tap.StarterTap()
+        self.tap.dpset = FakeDPSet(self.datapaths)
+        for datapath in self.datapaths:
+            self.tap.paths.add_switch(datapath.id)
+        self.tap.paths.add_link(1, 10, 2, 20)
+        self.tap.paths.add_link(2, 20, 1, 10)
+
+    def filter(self, fields, sinks=((1, 2),)):
+        return {'sources': [{'dpid': 1, 'port_no': 1}],
+                'sinks': [{'dpid': dpid, 'port_no': port} for dpid, port in sinks],
+                'fields': dict(fields)}
+
+    def test_flow_mods_per_combination(self):
+        for fields, count in COMBINATIONS:
+            datapath = self.datapaths[0]
+            datapath.clear()
+            self.assertTrue(self.tap.create_tap(self.filter(fields)))
+            self.assertEqual(len(datapath.flow_mods()), count, fields)
+
+            # One batched write for the whole tap
+            self.assertEqual(len(datapath.writes), 1)
+            self.tap.delete_tap(self.filter(fields))
+
+    def test_matches_in_port_and_filter(self):
+        fields = {'dl_type': 0x800, 'nw_host': IP}
+        self.tap.create_tap(self.filter(fields))
+        matches = sorted(sorted(mod.match.items())
+                         for mod in self.datapaths[0].flow_mods())
+        self.assertEqual(matches, [
+                [('eth_type', 0x800), ('in_port', 1), ('ipv4_dst', IP)],
+                [('eth_type', 0x800), ('in_port', 1), ('ipv4_src', IP)]])
+
+    def test_resubmit_is_noop(self):
+        fields = {'dl_host': MAC}
+        self.tap.create_tap(self.filter(fields))
+        self.datapaths[0].clear()
+        self.assertTrue(self.tap.create_tap(self.filter(fields)))
+        self.assertEqual(self.datapaths[0].messages, [])
+        self.assertEqual(len(self.tap.get_taps()), 1)
+
+    def test_transit_hops_match_tag_only(self):
+        fields = {'dl_host': MAC, 'dl_type': 0x800, 'nw_host': IP,
+                  'nw_proto': 6, 'tp_port': 80}
+        self.tap.create_tap(self.filter(fields, sinks=((2, 5),)))
+
+        self.assertEqual(len(self.datapaths[0].flow_mods()), 8)
+        sink_mods = self.datapaths[1].flow_mods()
+        self.assertEqual(len(sink_mods), 1)
+        self.assertEqual(sink_mods[0].match['in_port'], 20)
+        self.assertEqual(sink_mods[0].match['vlan_vid'],
+                         ofproto_v1_3.OFPVID_PRESENT | self.tap.get_taps()[0]['id'])
+
+    def test_several_sinks_share_a_group(self):
+        fields = {'nw_host': IP, 'dl_type': 0x800}
+        self.tap.create_tap(self.filter(fields, sinks=((1, 2), (1, 3))))
+
+        datapath = self.datapaths[0]
+        self.assertEqual(len(datapath.group_mods()), 1)
+        self.assertEqual(len(datapath.group_mods()[0].buckets), 2)
+        self.assertEqual(len(datapath.flow_mods()), 2)
+
+    def test_delete_by_cookie(self):
+        fields = {'dl_host': MAC, 'nw_host': IP, 'dl_type': 0x800}
+        self.tap.create_tap(self.filter(fields))
+        tap_id = self.tap.get_taps()[0]['id']
+        datapath = self.datapaths[0]
+        datapath.clear()
+
+        self.assertTrue(self.tap.delete_tap_by_id(tap_id))
+        deletes = datapath.flow_mods(ofproto_v1_3.OFPFC_DELETE)
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(cookie_allocator.cookie_instance(deletes[0].cookie), tap_id)
+        self.assertEqual(deletes[0].cookie_mask & cookie_allocator.INSTANCE_MASK,
+                         cookie_allocator.INSTANCE_MASK)
+        self.assertEqual(self.tap.get_taps(), [])
+
+    def test_unknown_rate_limit_unit(self):
+        fields = {'dl_host': MAC}
+        filter_data = self.filter(fields)
+        filter_data['rate_limit'] = {'mbps': 5}
+        self.assertFalse(self.tap.create_tap(filter_data))
+        self.assertEqual(self.datapaths[0].messages, [])
+
+    def test_rate_limit_and_sample_at_source(self):
+        filter_data = self.filter({'dl_host': MAC}, sinks=((2, 5),))
+        filter_data['rate_limit'] = {'pps': 100}
+        filter_data['sample'] = 4
+        self.tap.create_tap(filter_data)
+
+        source, sink = self.datapaths
+        self.assertEqual(len(source.sent(source.ofproto_parser.OFPMeterMod,
+                                         ofproto_v1_3.OFPMC_ADD)), 1)
+        self.assertEqual(len(source.group_mods()), 1)
+        for mod in source.flow_mods():
+            self.assertIsInstance(mod.instructions[0],
+                                  source.ofproto_parser.OFPInstructionMeter)
+        self.assertEqual(sink.sent(sink.ofproto_parser.OFPMeterMod), [])
+
+    def test_group_ids_stay_within_the_tap(self):
+        datapath = self.datapaths[0]
+        tap_id = 5
+        groups = dict((('key', i), tap.TAP_GROUP_ID_BASE |
+                       tap_id << tap.TAP_GROUP_ID_SHIFT | i)
+                      for i in range(tap.MAX_TAP_GROUPS - 1))
+        tap_data = {'id': tap_id, 'groups': {datapath.id: groups}}
+        ofproto = datapath.ofproto
+
+        group_id = self.tap.program_group(datapath, tap_data, 'last',
+                                          ofproto.OFPGT_ALL, [])
+        self.assertEqual(group_id >> tap.TAP_GROUP_ID_SHIFT,
+                         tap.TAP_GROUP_ID_BASE >> tap.TAP_GROUP_ID_SHIFT | tap_id)
+        self.assertRaises(ValueError, self.tap.program_group, datapath,
+                          tap_data, 'one too many', ofproto.OFPGT_ALL, [])
+        self.assertEqual(len(groups), tap.MAX_TAP_GROUPS)
+
+    def test_out_of_groups_leaves_nothing_behind(self):
+        # Two sinks and sampling take an ALL and a SELECT group
+        filter_data = self.filter({'dl_host': MAC}, sinks=((1, 2), (1, 3)))
+        filter_data['sample'] = 4
+        datapath = self.datapaths[0]
+
+        with mock.patch.object(tap, 'MAX_TAP_GROUPS', 1):
+            self.assertFalse(self.tap.create_tap(filter_data))
+
+        self.assertEqual(self.tap.get_taps(), [])
+        added = [mod.group_id for mod in datapath.group_mods()]
+        deleted = [mod.group_id for mod in
+                   datapath.group_mods(ofproto_v1_3.OFPGC_DELETE)]
+        self.assertEqual(len(added), 1)
+        self.assertIn(added[0], deleted)
+        self.assertEqual(len(datapath.flow_mods(ofproto_v1_3.OFPFC_DELETE)), 1)
+
+        # The tap id is free again
+        self.assertTrue(self.tap.create_tap(self.filter({'dl_host': MAC})))
+        self.assertEqual(self.tap.get_taps()[0]['id'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
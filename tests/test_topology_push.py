@@ -0,0 +1,167 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import collections
+import json
+import unittest
+
+from ryu.app.sdnhub_apps import topology_push
+
+from .fakes import FakeEvent
+
+
+class FakeEntity(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+def switch_event(dpid):
+    return FakeEvent(switch=FakeEntity({'dpid': dpid, 'ports': []}))
+
+
+def link_event(src, dst):
+    return FakeEvent(link=FakeEntity({'src': {'dpid': src, 'port_no': 1},
+                                      'dst': {'dpid': dst, 'port_no': 2}}))
+
+
+def parse(message):
+    fields = {}
+    for line in message.decode('utf-8').strip().split('\n'):
+        name, _sep, value = line.partition(': ')
+        fields[name] = value
+    if 'data' in fields:
+        fields['data'] = json.loads(fields['data'])
+    return fields
+
+
+class FakeHostTracker(object):
+
+    def __init__(self):
+        self.hosts = {}
+        self.listeners = []
+
+    def addHostListener(self, listener):
+        self.listeners.append(listener)
+
+
+class TestTopologyPush(unittest.TestCase):
+
+    def setUp(self):
+        self.push = topology_push.TopologyPush()
+        self.tracker = FakeHostTracker()
+        self.push.set_host_tracker(self.tracker)
+
+    def connect(self, last_seq=None):
+        stream = self.push.event_stream(last_seq)
+        self.assertEqual(next(stream), b'retry: 2000\n\n')
+        return stream
+
+    def test_snapshot_on_connect(self):
+        self.push.switch_enter_handler(switch_event('1'))
+        self.push.switch_enter_handler(switch_event('2'))
+        self.push.link_add_handler(link_event('1', '2'))
+        self.tracker.hosts['10.0.0.1'] = {'mac': '00:00:00:00:00:01', 'dpid': '1'}
+
+        message = parse(next(self.connect()))
+        self.assertEqual(message['event'], 'snapshot')
+        self.assertEqual(message['id'], '3')
+        snapshot = message['data']
+        self.assertEqual(snapshot['seq'], 3)
+        self.assertEqual(sorted(switch['dpid'] for switch in snapshot['switches']),
+                         ['1', '2'])
+        self.assertEqual(len(snapshot['links']), 1)
+        self.assertEqual(snapshot['hosts'], self.tracker.hosts)
+
+    def test_diffs_after_snapshot(self):
+        stream = self.connect()
+        next(stream)
+
+        self.push.switch_enter_handler(switch_event('1'))
+        self.tracker.listeners[0]('10.0.0.1', {'dpid': '1'})
+        self.tracker.listeners[0]('10.0.0.1', None)
+
+        diffs = [parse(next(stream))['data'] for _ in range(3)]
+        self.assertEqual([(diff['seq'], diff['type']) for diff in diffs],
+                         [(1, 'switch_add'), (2, 'host_add'), (3, 'host_delete')])
+        self.assertEqual(diffs[1]['data'], {'ip': '10.0.0.1', 'host': {'dpid': '1'}})
+
+    def test_history_replay(self):
+        for dpid in ('1', '2', '3'):
+            self.push.switch_enter_handler(switch_event(dpid))
+
+        stream = self.connect(last_seq=1)
+        diffs = [parse(next(stream)) for _ in range(2)]
+        self.assertEqual([diff['id'] for diff in diffs], ['2', '3'])
+        self.assertEqual([diff['data']['data']['dpid'] for diff in diffs], ['2', '3'])
+        self.assertNotIn('event', diffs[0])
+
+        # Then live diffs, without a snapshot in between
+        self.push.switch_leave_handler(switch_event('3'))
+        self.assertEqual(parse(next(stream))['data']['type'], 'switch_delete')
+
+    def test_up_to_date_reconnect(self):
+        self.push.switch_enter_handler(switch_event('1'))
+        stream = self.connect(last_seq=1)
+        self.push.switch_enter_handler(switch_event('2'))
+        self.assertEqual(parse(next(stream))['id'], '2')
+
+    def test_snapshot_when_history_lost(self):
+        self.push.history = collections.deque(maxlen=2)
+        for dpid in ('1', '2', '3', '4'):
+            self.push.switch_enter_handler(switch_event(dpid))
+
+        message = parse(next(self.connect(last_seq=1)))
+        self.assertEqual(message['event'], 'snapshot')
+        self.assertEqual(message['data']['seq'], 4)
+
+        # A sequence number from before a controller restart
+        message = parse(next(self.connect(last_seq=100)))
+        self.assertEqual(message['event'], 'snapshot')
+
+    def test_switch_leave_drops_links(self):
+        self.push.switch_enter_handler(switch_event('1'))
+        self.push.switch_enter_handler(switch_event('2'))
+        self.push.link_add_handler(link_event('1', '2'))
+        self.push.link_add_handler(link_event('2', '1'))
+        self.push.switch_leave_handler(switch_event('2'))
+        self.assertEqual(self.push.links, {})
+
+    def test_slow_subscriber_dropped(self):
+        stream = self.connect()
+        next(stream)
+        fast = self.connect()
+        next(fast)
+
+        for i in range(topology_push.SUBSCRIBER_QUEUE_SIZE + 1):
+            self.push.switch_enter_handler(switch_event(str(i)))
+            next(fast)
+
+        self.assertEqual(len(self.push.subscribers), 1)
+
+        # What was queued is still sent, then the stream ends
+        messages = list(stream)
+        self.assertEqual(len(messages), topology_push.SUBSCRIBER_QUEUE_SIZE)
+        self.assertEqual(parse(messages[-1])['id'],
+                         str(topology_push.SUBSCRIBER_QUEUE_SIZE))
+
+        # Publishing does not touch the dropped queue anymore
+        self.push.switch_enter_handler(switch_event('last'))
+        self.assertEqual(parse(next(fast))['data']['data']['dpid'], 'last')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+import collections
+import json
+import logging
+
+from ryu.base import app_manager
+from ryu.controller.handler import set_ev_cls
+from ryu.topology import event as topo_event
+from ryu.lib import hub
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.topology_push')
+
+# Diffs kept for clients that reconnect, and the most a slow client may
+# fall behind before it is dropped (it then reconnects and catches up)
+HISTORY_SIZE = 1024
+SUBSCRIBER_QUEUE_SIZE = 256
+KEEPALIVE_INTERVAL = 15
+
+# Pushes the changes to switches, links and hosts to the web clients as
+# server-sent events. A client gets a snapshot when it connects, and
+# then one diff per change, each numbered with a sequence number. A
+# client reconnecting with the number of the last diff it saw is only
+# sent the diffs it missed, while they are still in the history. Each
+# diff is serialized once, whatever the number of clients.
+
+
+def sse_message(data, event=None, seq=None):
+    lines = []
+    if event is not None:
+        lines.append('event: %s' % event)
+    if seq is not None:
+        lines.append('id: %d' % seq)
+    lines.append('data: %s' % data)
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def link_key(link):
+    return '%s:%s-%s:%s' % (link['src']['dpid'], link['src']['port_no'],
+                            link['dst']['dpid'], link['dst']['port_no'])
+
+
+class TopologyPush(app_manager.RyuApp):
+
+    def __init__(self, *args, **kwargs):
+        super(TopologyPush, self).__init__(*args, **kwargs)
+        self.host_tracker = None
+        self.seq = 0
+        self.switches = {}
+        self.links = {}
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        self.subscribers = set()
+
+    def set_host_tracker(self, host_tracker):
+        self.host_tracker = host_tracker
+        self.host_tracker.addHostListener(self.host_changed)
+
+    def publish(self, diff_type, data):
+        self.seq += 1
+        message = sse_message(json.dumps({'seq': self.seq, 'type': diff_type,
+                                          'data': data}), seq=self.seq)
+        self.history.append((self.seq, message))
+
+        for queue in list(self.subscribers):
+            if queue.qsize() >= SUBSCRIBER_QUEUE_SIZE:
+                # Too far behind; closing the stream has it reconnect
+                self.subscribers.discard(queue)
+                queue.put(None)
+            else:
+                queue.put(message)
+
+    def snapshot(self):
+        hosts = {}
+        if self.host_tracker is not None:
+            hosts = self.host_tracker.hosts
+        return {'seq': self.seq,
+                'switches': list(self.switches.values()),
+                'links': list(self.links.values()),
+                'hosts': hosts}
+
+    def host_changed(self, ip, entry):
+        if entry is None:
+            self.publish('host_delete', {'ip': ip})
+        else:
+            self.publish('host_add', {'ip': ip, 'host': entry})
+
+    @set_ev_cls(topo_event.EventSwitchEnter)
+    def switch_enter_handler(self, ev):
+        switch = ev.switch.to_dict()
+        self.switches[switch['dpid']] = switch
+        self.publish('switch_add', switch)
+
+    @set_ev_cls(topo_event.EventSwitchLeave)
+    def switch_leave_handler(self, ev):
+        switch = ev.switch.to_dict()
+        self.switches.pop(switch['dpid'], None)
+        for key, link in list(self.links.items()):
+            if switch['dpid'] in (link['src']['dpid'], link['dst']['dpid']):
+                del self.links[key]
+        self.publish('switch_delete', switch)
+
+    @set_ev_cls(topo_event.EventLinkAdd)
+    def link_add_handler(self, ev):
+        link = ev.link.to_dict()
+        self.links[link_key(link)] = link
+        self.publish('link_add', link)
+
+    @set_ev_cls(topo_event.EventLinkDelete)
+    def link_delete_handler(self, ev):
+        link = ev.link.to_dict()
+        self.links.pop(link_key(link), None)
+        self.publish('link_delete', link)
+
+    def event_stream(self, last_seq=None):
+        queue = hub.Queue()
+        self.subscribers.add(queue)
+
+        try:
+            yield b'retry: 2000\n\n'
+
+            oldest = self.history[0][0] if self.history else self.seq + 1
+            if last_seq is not None and oldest - 1 <= last_seq <= self.seq:
+                for seq, message in list(self.history):
+                    if seq > last_seq:
+                        yield message
+            else:
+                yield sse_message(json.dumps(self.snapshot()),
+                                  event='snapshot', seq=self.seq)
+
+            while True:
+                try:
+                    message = queue.get(timeout=KEEPALIVE_INTERVAL)
+                except hub.QueueEmpty:
+                    message = b': keepalive\n\n'
+
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.subscribers.discard(queue)
@@ -0,0 +1,70 @@
+# Copyright (C) 2014 SDN Hub
+#
+# Licensed under the GNU GENERAL PUBLIC LICENSE, Version 3.
+# You may not use this file except in compliance with this License.
+# You may obtain a copy of the License at
+#
+#    http://www.gnu.org/licenses/gpl-3.0.txt
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+
+# REST API
+#
+############# Topology updates ##############
+#
+# stream of switch, link and host changes as server-sent events: a
+# "snapshot" event first, then one message per change. Reconnecting
+# with the Last-Event-ID header resumes from that change.
+# GET /v1.0/topology/events
+#
+#
+
+import logging
+from webob import Response
+
+from ryu.base import app_manager
+from ryu.app.wsgi import ControllerBase, WSGIApplication, route
+from ryu.app.sdnhub_apps import host_tracker
+from ryu.app.sdnhub_apps import topology_push
+
+LOG = logging.getLogger('ryu.app.sdnhub_apps.topology_push_rest')
+
+class TopologyPushController(ControllerBase):
+    def __init__(self, req, link, data, **config):
+        super(TopologyPushController, self).__init__(req, link, data, **config)
+        self.topology_push = data['topology_push']
+
+    @route('topology', '/v1.0/topology/events', methods=['GET'])
+    def get_events(self, req, **_kwargs):
+        last_seq = req.headers.get('Last-Event-ID')
+        try:
+            last_seq = int(last_seq) if last_seq else None
+        except ValueError:
+            last_seq = None
+
+        res = Response(status=200, content_type='text/event-stream')
+        res.cache_control = 'no-cache'
+        res.app_iter = self.topology_push.event_stream(last_seq)
+        return res
+
+
+class TopologyPushRestApi(app_manager.RyuApp):
+    _CONTEXTS = {
+            'wsgi': WSGIApplication,
+            'host_tracker': host_tracker.HostTracker,
+            'topology_push': topology_push.TopologyPush
+            }
+
+    def __init__(self, *args, **kwargs):
+        super(TopologyPushRestApi, self).__init__(*args, **kwargs)
+        wsgi = kwargs['wsgi']
+        push = kwargs['topology_push']
+        push.set_host_tracker(kwargs['host_tracker'])
+
+        self.data = {}
+        self.data['topology_push'] = push
+
+        wsgi.register(TopologyPushController, self.data)
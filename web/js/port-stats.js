@@ -21,36 +21,35 @@ function updatePortStats() {
             statsTableBody.removeChild(statsTableBody.firstChild);
     }
 
-    $.getJSON(url.concat("/stats/switches"), function(switches){
-        $.each(switches, function(index, dpid){
-            var hex_dpid = parseInt(dpid).toString(16);
-
-            $.getJSON(url.concat("/stats/port/").concat(dpid), function(ports) {
-                var portStats = ports[dpid];
-
-                var tr = document.createElement('TR');
-                var physicalPorts = 0;
-                var switchColTd = document.createElement('TD');
-                switchColTd.appendChild(document.createTextNode(hex_dpid));
-                tr.appendChild(switchColTd);
-
-                $.each(portStats, function(index, obj) {
-                    if (obj.port_no < 65280) {
-                        physicalPorts += 1;
-                        var statsArray = new Array(obj.port_no, obj.rx_packets, obj.rx_bytes, obj.rx_dropped, obj.rx_errors, obj.tx_packets, obj.tx_bytes, obj.tx_dropped, obj.tx_errors);
-
-                        $.each(statsArray, function(index, value) {
-                            var td = document.createElement('TD');
-                            td.appendChild(document.createTextNode(value));
-                            tr.appendChild(td);
-                        });
-                        statsTableBody.appendChild(tr);
-                        tr = document.createElement('TR');
-                    }
-                });
-
-                switchColTd.rowSpan = physicalPorts;
+    // One request for the whole fabric. The controller polls the
+    // switches by itself, however many pages are open.
+    $.getJSON(url.concat("/v1.0/stats/fabric"), function(fabric){
+        $.each(fabric.switches, function(index, sw){
+            var hex_dpid = parseInt(sw.dpid, 16).toString(16);
+            var portStats = sw.ports;
+
+            var tr = document.createElement('TR');
+            var physicalPorts = 0;
+            var switchColTd = document.createElement('TD');
+            switchColTd.appendChild(document.createTextNode(hex_dpid));
+            tr.appendChild(switchColTd);
+
+            $.each(portStats, function(index, obj) {
+                if (obj.port_no < 65280) {
+                    physicalPorts += 1;
+                    var statsArray = new Array(obj.port_no, obj.rx_packets, obj.rx_bytes, obj.rx_dropped, obj.rx_errors, obj.tx_packets, obj.tx_bytes, obj.tx_dropped, obj.tx_errors);
+
+                    $.each(statsArray, function(index, value) {
+                        var td = document.createElement('TD');
+                        td.appendChild(document.createTextNode(value));
+                        tr.appendChild(td);
+                    });
+                    statsTableBody.appendChild(tr);
+                    tr = document.createElement('TR');
+                }
             });
+
+            switchColTd.rowSpan = physicalPorts;
         });
     });
 }
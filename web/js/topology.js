@@ -14,8 +14,10 @@
  */
 
 var switchList = {};
+var linkList = {};
 var hostList = {};
-var hostSwitchLinkList = [];
+var hosts = {};
+var lastSeq = 0;
 
 var url = "http://" + location.hostname + ":8080";
 var graph = new joint.dia.Graph;
@@ -95,103 +97,219 @@ var setSwitchTooltip = function() {
     });
 };
 
-var hostCleanup = function(currentHosts) {
-    $.each(hostList, function(key, value){
+var clearHost = function(key) {
+    var value = hostList[key];
+    if (value.tooltip != undefined)
         value.tooltip.remove();
-        try {
-        value.link.remove();
-      } catch (e) {
+    try {
+        if (value.link != undefined)
+            value.link.remove();
+    } catch (e) {
         console.log(e);
-      }
-        if (!(key in currentHosts))
-            value.element.remove();
-    });
+    }
+    value.tooltip = undefined;
+    value.link = undefined;
 };
 
-var drawHosts = function() {
-	srcSwitch = {};
-	dstSwitch = {};
-
-	$.getJSON(url.concat("/v1.0/hosts"), function(hosts){
-        //Remove old tooltips and host links
-        hostCleanup(hosts);
-
-	    $.each(hosts, function(key, value){
-            //Do all common stuff for an IP
-            if (!(key in hostList))
-                hostList[key] = {};
-
-            if (!('element' in hostList[key])) {
-                var x = 1000, y=1000;
-                var cell = new erd.Normal({ position: { x: x, y: y }, attrs: { text: { text: key }}});
-                graph.addCell(cell);
-
-                hostList[key]['element'] = cell;
-                hostList[key]['dom'] = getDom(cell.id);
-            }
-
-            hostList[key]['entry'] = value;
-            var hostDom = hostList[key]['dom'];
-            var cell = hostList[key]['element'];
-
-            if (value.dpid in switchList && hostDom != undefined) {
-                var date = new Date(value.timestamp * 1000);
-                var dateStr = (date.getMonth() + 1) + "/" +
-                               date.getDate() + "/" +
-                               date.getFullYear() + " " +
-                               date.getHours() + ":" +
-                               date.getMinutes() + ":" +
-                               date.getSeconds();
-
-                hostList[key]['tooltip'] = new joint.ui.Tooltip({
-                        target: hostDom,
-                        content: '<table>' +
-                                 '<tr><td>IP:</td><td>' + key + '</td></tr>' +
-                                 '<tr><td>MAC:</td><td>' + value.mac + '</td></tr>' +
-                                 '<tr><td>Assoc switch:</td><td>' + value.dpid + '</td></tr>' +
-                                 '<tr><td>Assoc port:</td><td>' + value.port + '</td></tr>' +
-                                 '<tr><td>Time seen:</td><td>' + dateStr + '</td></tr>' +
-                                 '</table>',
-                        top: hostDom,
-                        direction: 'top'
-                });
-                
-                try{
-                hostList[key]['link'] =link(switchList[value.dpid]['element'], cell);
-              }catch(e){
-                console.log(e);
-              }
-            }
-		});
+var removeHost = function(key) {
+    if (!(key in hostList))
+        return;
+
+    clearHost(key);
+    hostList[key].element.remove();
+    delete hostList[key];
+};
+
+var layout = function() {
     try {
         joint.layout.DirectedGraph.layout(graph, { setLinkVertices: false, edgeSep: 20, rankSep: 80, nodeSep: 50 });
       } catch (e) {
         console.log(e)
       }
-	});
 };
 
-var drawLinks = function() {
-	srcSwitch = {};
-	dstSwitch = {};
-	$.getJSON(url.concat("/v1.0/topology/links"), function(links){
-	    $.each(links, function(key, value){
-            var valueJson = JSON.stringify(value);
-            var obj = JSON.parse(valueJson);
+// Changes tend to come in bursts, so the graph is laid out again once
+// they stop rather than once per change
+var layoutTimer = undefined;
+var scheduleLayout = function() {
+    if (layoutTimer != undefined)
+        clearTimeout(layoutTimer);
+    layoutTimer = setTimeout(function() {
+        layoutTimer = undefined;
+        layout();
+    }, 500);
+};
 
-            var portname = obj.src.name;
+// Draws one host, or redraws its tooltip and link to its switch
+var drawHost = function(key, value) {
+    if (!(key in hostList))
+        hostList[key] = {};
+    else
+        clearHost(key);
 
+    if (!('element' in hostList[key])) {
+        var x = 1000, y=1000;
+        var cell = new erd.Normal({ position: { x: x, y: y }, attrs: { text: { text: key }}});
+        graph.addCell(cell);
 
-            link(switchList[obj.src.dpid]['element'],
-                 switchList[obj.dst.dpid]['element']).cardinality(portname);
-		});
-    try{
-        joint.layout.DirectedGraph.layout(graph, { setLinkVertices: false, edgeSep: 20, rankSep: 80, nodeSep: 80 });
-      } catch (e) {
-        console.log(e)
+        hostList[key]['element'] = cell;
+        hostList[key]['dom'] = getDom(cell.id);
+    }
+
+    hostList[key]['entry'] = value;
+    var hostDom = hostList[key]['dom'];
+    var cell = hostList[key]['element'];
+
+    if (value.dpid in switchList && hostDom != undefined) {
+        var date = new Date(value.timestamp * 1000);
+        var dateStr = (date.getMonth() + 1) + "/" +
+                       date.getDate() + "/" +
+                       date.getFullYear() + " " +
+                       date.getHours() + ":" +
+                       date.getMinutes() + ":" +
+                       date.getSeconds();
+
+        hostList[key]['tooltip'] = new joint.ui.Tooltip({
+                target: hostDom,
+                content: '<table>' +
+                         '<tr><td>IP:</td><td>' + key + '</td></tr>' +
+                         '<tr><td>MAC:</td><td>' + value.mac + '</td></tr>' +
+                         '<tr><td>Assoc switch:</td><td>' + value.dpid + '</td></tr>' +
+                         '<tr><td>Assoc port:</td><td>' + value.port + '</td></tr>' +
+                         '<tr><td>Time seen:</td><td>' + dateStr + '</td></tr>' +
+                         '</table>',
+                top: hostDom,
+                direction: 'top'
+        });
+
+        try{
+        hostList[key]['link'] =link(switchList[value.dpid]['element'], cell);
+      }catch(e){
+        console.log(e);
       }
-	}).then(drawHosts);
-}
+    }
+};
+
+var drawHosts = function() {
+    $.each(hosts, drawHost);
+};
+
+// Hosts attached to a switch that just came or went
+var redrawSwitchHosts = function(dpid) {
+    $.each(hosts, function(key, value) {
+        if (value.dpid == dpid)
+            drawHost(key, value);
+    });
+};
+
+var linkKey = function(obj) {
+    return obj.src.dpid + ":" + obj.src.port_no + "-" + obj.dst.dpid + ":" + obj.dst.port_no;
+};
+
+var addSwitch = function(obj) {
+    if (obj.dpid in switchList)
+        return;
+
+    var index = Object.keys(switchList).length;
+    switchList[obj.dpid] = {}
+
+    var switchName = obj.dpid;
+    switchList[obj.dpid]['name'] = switchName;
+
+    var x = 200 + 150 * (index % 4);
+    var y = 100 + 150 * Math.floor(index/4);
+
+    switchList[obj.dpid]['element'] = element(joint.shapes.basic.Rect, x, y, switchName);
+
+    getSwitchDesc(obj.dpid);
+};
+
+var removeSwitch = function(obj) {
+    if (!(obj.dpid in switchList))
+        return;
+
+    if (switchList[obj.dpid].tooltip != undefined)
+        switchList[obj.dpid].tooltip.remove();
+    // Removing the element also removes the links attached to it
+    switchList[obj.dpid].element.remove();
+    delete switchList[obj.dpid];
+
+    $.each(linkList, function(key, value) {
+        if (value.src.dpid == obj.dpid || value.dst.dpid == obj.dpid)
+            delete linkList[key];
+    });
+};
+
+var addLink = function(obj) {
+    var key = linkKey(obj);
+    if (key in linkList || !(obj.src.dpid in switchList) || !(obj.dst.dpid in switchList))
+        return;
+
+    var portname = obj.src.name;
+
+    linkList[key] = obj;
+    linkList[key]['cell'] = link(switchList[obj.src.dpid]['element'],
+                                 switchList[obj.dst.dpid]['element']).cardinality(portname);
+};
+
+var removeLink = function(obj) {
+    var key = linkKey(obj);
+    if (!(key in linkList))
+        return;
+
+    try {
+        linkList[key].cell.remove();
+    } catch (e) {
+        console.log(e);
+    }
+    delete linkList[key];
+};
+
+// The controller pushes a snapshot of the switches, links and hosts,
+// then every change to them as it happens, each with a sequence number
+var applySnapshot = function(snapshot) {
+    graph.clear();
+    switchList = {};
+    linkList = {};
+    hostList = {};
+    hosts = snapshot.hosts;
+    lastSeq = snapshot.seq;
+
+    $.each(snapshot.switches, function(index, value) { addSwitch(value); });
+    $.each(snapshot.links, function(index, value) { addLink(value); });
+    drawHosts();
+    layout();
+};
+
+var applyDiff = function(diff) {
+    // Changes already covered by the snapshot
+    if (diff.seq <= lastSeq)
+        return;
+    lastSeq = diff.seq;
+
+    // Only what the change touches is redrawn
+    if (diff.type == "switch_add") {
+        addSwitch(diff.data);
+        redrawSwitchHosts(diff.data.dpid);
+    } else if (diff.type == "switch_delete") {
+        removeSwitch(diff.data);
+        redrawSwitchHosts(diff.data.dpid);
+    } else if (diff.type == "link_add") {
+        addLink(diff.data);
+    } else if (diff.type == "link_delete") {
+        removeLink(diff.data);
+    } else if (diff.type == "host_add") {
+        hosts[diff.data.ip] = diff.data.host;
+        drawHost(diff.data.ip, diff.data.host);
+    } else if (diff.type == "host_delete") {
+        delete hosts[diff.data.ip];
+        removeHost(diff.data.ip);
+    } else {
+        return;
+    }
+
+    scheduleLayout();
+};
 
 $(function()  {
     var paperScroller = new joint.ui.PaperScroller;
@@ -207,29 +325,6 @@ $(function()  {
     $('#paper-container').append(paperScroller.render().el);
     paper.on('blank:pointerdown', paperScroller.startPanning);
 
-$.getJSON(url.concat("/v1.0/topology/switches"), function(switches){
-	var counter = 0;
-    $.each(switches, function(index, value){
-		var valueJson = JSON.stringify(value);
-        var obj = JSON.parse(valueJson);
-
-        switchList[obj.dpid] = {}
-
-        var switchName = obj.dpid;
-        switchList[obj.dpid]['name'] = switchName;
-
-        var x = 200 + 150 * (index % 4);
-        var y = 100 + 150 * Math.floor(index/4);
-
-        //console.log("DPID: " + obj.dpid + " X = "+x + " Y = "+y)
-		    switchList[obj.dpid]['element'] = element(joint.shapes.basic.Rect, x, y, switchName);
-
-        getSwitchDesc(obj.dpid);
-        //console.log(switchList[obj.dpid]['element'])
-
-    });
-}).then(drawLinks);
-
 paper.on('cell:pointerdown',
     function(cellView, evt, x, y) {
         $.each(switchList, function(key, value) {
@@ -239,7 +334,13 @@ paper.on('cell:pointerdown',
         });
 });
 
-var drawHostIntervalD = setInterval(function(){drawHosts()}, 10000);
+var events = new EventSource(url.concat("/v1.0/topology/events"));
+events.addEventListener("snapshot", function(e) {
+    applySnapshot(JSON.parse(e.data));
+});
+events.onmessage = function(e) {
+    applyDiff(JSON.parse(e.data));
+};
 
 });
 /*